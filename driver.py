@@ -1,6 +1,12 @@
+import sys
+import pathlib
+import itertools
 from pprint import pprint
 from mkvremux import MKV
-from mkvremux import utils
+from mkvremux import archive, catalog, interventions, journal, offload, utils, watch
+from mkvremux.config import settings, resource_path
+from mkvremux.scheduler import Scheduler
+from mkvremux.staging import Stager
 from mkvremux.container import stages
 
 
@@ -60,9 +66,15 @@ def select_audio(mkv):
         choice = input('     [*] Enter number of desired stream or M for detailed stream info: ')
         valid_choice = True if choice in valid_indices else False
 
+    return use_audio_stream(mkv, choice)
+
+
+def use_audio_stream(mkv, choice):
+    """ Make the audio stream with the given index the one that gets copied """
+
     # Add the stream to the copy_streams list
     for stream in mkv.audio.streams:
-        if str(stream['index']) == choice:
+        if str(stream['index']) == str(choice):
             # Overwrite the other audio stream
             mkv.audio.copy_streams = [stream]
             break
@@ -116,52 +128,184 @@ def intervene(mkv):
         pass
 
 
-def main_loop():
-    """ Process each mkv. Processing has 3 distinct steps:
+def park(mkv, reason=None, candidates=None):
+    """ Put a title in the intervention queue instead of prompting, and leave it out of the rest of this run """
+    if reason is None:
+        reason = 'no_title' if mkv.intervene['reason']['no_title'] else 'audio_stream'
 
-            1) pre-processing
-                - Gathers information about the container
-                - Identify any issues that need user intervention
-            2) command execution
-                - Builds out commands for next stage
-                - Executes any commands (i.e. ffmpeg, qaac)
-            3) post-processing
-                - Cleans up any artifacts from this stage
-                - Transitions mkv to next state
+    queue = interventions.get_queue()
+    queue.park(mkv, reason, interventions.context(mkv, reason, candidates))
+    print('  Parked for intervention ({}): {}'.format(reason, mkv.state.cur_path))
+    mkv.can_transition = False
 
-        I have separated these three steps primarily as a way to manage flow and remove user input
-        (when necessary) from functional code.
 
-        Note: I have designed this driver to perform pre-processing, command execution, ans post-processing as a batch
-        for all MKVs at each each stage.
+def reenter():
+    """ Rebuild every answered title from the intervention queue, with its answer applied
 
-        This allows me to get all of the user input out of the way (pre-processing) at the beginning. Otherwise,
-        I'd have to wait for the (sometimes very long) command execution step of each mkv before being able to
-        answer any prompts for the next one.
+    :return list:   MKVs ready to go back into processing
     """
+    queue = interventions.get_queue()
+    if queue is None:
+        return []
+
+    mkvs = []
+    for entry in queue.take_answered():
+        mkv = journal.restore(entry['record'])
+        mkv.intervene = entry['intervene']
+        value = entry['answer']
+
+        if entry['reason'] == 'metadata':
+            mkv.metadata = entry['context']['candidates'][int(value)]
+        elif entry['reason'] == 'no_title':
+            mkv.intervention('no_title', lambda x: setattr(x, 'media_title', value) or True)
+        elif entry['reason'] == 'audio_stream':
+            mkv.intervention('audio_stream', lambda x: use_audio_stream(x, value))
+
+        # There may be more than one decision to make about a title
+        mkv.intervene['needed'] = any(mkv.intervene['reason'].values())
+        if mkv.intervene['needed']:
+            park(mkv)
+            continue
+
+        print('Answered, back in the queue: ' + str(mkv.state.cur_path))
+        mkvs.append(mkv)
+
+    return mkvs
+
+
+def answer():
+    """ Walk through the intervention queue and record a decision for every parked title """
+    queue = interventions.InterventionQueue(resource_path(settings['intervention_queue']))
+    pending = queue.pending()
+    print('{} title(s) waiting on an answer'.format(len(pending)))
+
+    for entry in pending:
+        info = entry['context']
+        print('\n   [{}] {}'.format(entry['reason'], info['path']))
+
+        if entry['reason'] == 'audio_stream':
+            valid = [str(_['index']) for _ in info['streams']]
+            for stream in info['streams']:
+                print('     [Stream #{}] {}'.format(stream['index'], ', '.join(
+                    '{}: {}'.format(k, v) for k, v in stream.items() if k != 'index')))
+            choice = input('     [*] Enter number of desired stream (blank to skip): ')
+            while choice and choice not in valid:
+                print('       [*] You entered {}. That stream number does not exist!'.format(choice))
+                choice = input('     [*] Enter number of desired stream (blank to skip): ')
+
+        elif entry['reason'] == 'metadata':
+            valid = [str(_) for _ in range(len(info['candidates']))]
+            for i, movie in enumerate(info['candidates']):
+                print('     [{}] {} ({}) {}'.format(i, movie['title'], movie.get('year'), movie.get('imdb_id', '')))
+            choice = input('     [*] Enter number of the right movie (blank to skip): ')
+            while choice and choice not in valid:
+                print('       [*] Invalid choice! ')
+                choice = input('     [*] Enter number of the right movie (blank to skip): ')
+
+        else:
+            for movie in info.get('candidates', []):
+                print('     [Suggestion] {} ({})'.format(movie['title'], movie.get('year')))
+            choice = input('    [*] Enter the title of this film (blank to skip): ')
+            if choice:
+                ans = input('     [*] You have entered: "{}". Is this correct? [YES/no] '.format(choice))
+                if ans.lower() not in ['', 'y', 'yes']:
+                    choice = ''
+
+        if choice:
+            queue.answer(entry['key'], choice)
+
+
+def execute(mkv):
+    """ Command execution and post-processing for a single mkv. Run by the scheduler """
+    print('  Cmd Exec for MKV: ' + str(mkv.state.cur_path))
+    try:
+        mkv.run_commands()
+        print('  Cmd Exec: success!')
+        mkv.post_process()
+        print('  Post proc: success!')
+
+        # The stage is committed. Make sure a restart picks this title up from here
+        job_journal = journal.get_journal()
+        if job_journal is not None:
+            job_journal.record(mkv)
+
+        # An answer it was parked for has been acted on
+        queue = interventions.get_queue()
+        if queue is not None:
+            queue.done(str(mkv.state.init_path))
+
+    except RuntimeError as exc:
+        # The stage didn't finish (or its source couldn't be moved on). Don't run it again next stage
+        mkv.can_transition = False
+
+        if 'Problem Extracting Global Format Data' in str(exc):
+            # Probably a show stopper so skip this MKV
+            # TODO: Maybe somehow generate a log that this one failed?
+            print('Could not extract global format data')
+        elif 'Output verification failed' in str(exc) or 'Stream hashes changed' in str(exc) \
+                or 'Audio out of sync' in str(exc):
+            # Source is left where it is. Don't let this one go any further
+            print('Output failed verification')
+            pprint(exc.args[1])
+        elif 'MKV missing global title' in str(exc):
+            # TODO: Need to manually prompt for media title
+            print('MKV has no global title')
+        else:
+            print('Got a runtimeerror in cmd exec')
+            print(exc)
+
 
-    # DIRTY HACK FOR TESTING
-    import os
-    import shutil
-    #shutil.copy('tests/mkvs/audio/Multiple Audio Streams.mkv', 'tests/processing/0_analyze')
-    os.chdir('tests/processing')
+def process_batch(mkv_list, scheduler):
+    """ Take a batch of MKVs through every remaining stage (see main_loop). Resumed MKVs may start past stage 0
 
-    stage = stages.STAGE_0
-    mkv_list = utils.get_mkvs(stage)
+    :return list:   MKVs deferred for lack of room, at the stage they are waiting to run
+    """
+    waiting = []
+    if not mkv_list:
+        return waiting
+
+    stage = min(x.stage for x in mkv_list)
+    later = [x for x in mkv_list if x.stage > stage]
+    mkv_list = [x for x in mkv_list if x.stage == stage]
     while stage < stages.STAGE_3:
         # TODO: Need to refactor a bit. Each process step should return true if successful and be checked
 
         print('Processing MKVs for Stage: ' + str(stage))
         print('Found MKVs: ' + str(len(mkv_list)))
 
+        # Look up metadata for the whole batch before anything runs. Titles that can't be matched
+        # are known now instead of partway through the encodes
+        if stage == stages.STAGE_2:
+            titled = [x for x in mkv_list if x.media_title and x.metadata is None]
+            resolved = catalog.resolve([x.media_title for x in titled], max_distance=settings['fuzzy_max_distance'])
+            print('Metadata resolution:')
+            print(catalog.resolution_report(resolved))
+
+            for mkv in titled:
+                resolution = resolved[mkv.media_title]
+                if resolution.movie is not None:
+                    mkv.metadata = resolution.movie
+                elif resolution.status == 'ambiguous' and interventions.get_queue() is not None:
+                    park(mkv, 'metadata', [_.movie for _ in resolution.candidates])
+                else:
+                    print('Stopping processing on this MKV, metadata {}: {}'.format(resolution.status,
+                                                                                    mkv.state.cur_path))
+                    mkv.can_transition = False
+
         # Pre-process all MKVs
         for mkv in mkv_list:
+            if not mkv.can_transition:
+                continue
             print('  Pre-proc for MKV: ' + str(mkv.state.cur_path))
             try:
                 mkv.pre_process()
 
+                # Unattended runs don't wait on anyone. The title is parked and the batch carries on
                 if mkv.intervene['needed']:
-                    intervene(mkv)
+                    if interventions.get_queue() is not None:
+                        park(mkv)
+                    else:
+                        intervene(mkv)
 
             except RuntimeError as exc:
                 print('Got a runtimeerror in preproc')
@@ -177,40 +321,178 @@ def main_loop():
                     mkv.can_transition = False
                 elif 'No audio streams found' in str(exc):
                     mkv.can_transition = False
+                elif 'Ambiguous metadata match' in str(exc):
+                    pprint(exc.args[1])
+                    mkv.can_transition = False
+                    if interventions.get_queue() is not None:
+                        movies = [catalog.get_catalog().lookup(title, year) for title, year, _ in exc.args[1]]
+                        park(mkv, 'metadata', [_ for _ in movies if _ is not None])
+
+        if stage == stages.STAGE_2 and mkv_list:
+            print(catalog.get_catalog().report())
 
         # TODO: Remove MKVs from list that can't continue processing
 
-        # Run commands to transition to next stage
         for mkv in mkv_list:
-            print('  Cmd Exec for MKV: ' + str(mkv.state.cur_path))
-            if mkv.can_transition:
-                try:
-                    mkv.run_commands()
-                    print('  Cmd Exec: success!')
-                    mkv.post_process()
-                    print('  Post proc: success!')
-
-                except RuntimeError as exc:
-
-                    if 'Problem Extracting Global Format Data' in str(exc):
-                        # Probably a show stopper so skip this MKV
-                        # TODO: Maybe somehow generate a log that this one failed?
-                        print('Could not extract global format data')
-                        continue
-                    elif 'MKV missing global title' in str(exc):
-                        # TODO: Need to manually prompt for media title
-                        print('MKV has no global title')
-                    else:
-                        print('Got a runtimeerror in cmd exec')
-                        print(exc)
+            if not mkv.can_transition:
+                print('Stopping processing on this MKV due to earlier failure: ' + str(mkv.state.cur_path))
 
-            else:
-                print('Stopping processing on this MKV due to earlier failure.')
+        # Run commands to transition to next stage. Jobs only start once there's room for their output.
+        # Jobs that don't fit stay where they are until the next run
+        done, deferred = scheduler.run([x for x in mkv_list if x.can_transition], execute)
+        waiting += deferred
 
-        # Remove the MKVs that can't transition
-        mkv_list = [x for x in mkv_list if x.can_transition]
+        # Remove the MKVs that can't transition. Failed, deferred and parked ones give back their scratch room
+        moving_on = [x for x in done if x.can_transition]
+        for mkv in mkv_list:
+            if mkv not in moving_on:
+                mkv.release_scratch()
+        mkv_list = moving_on
         stage += 1
 
+        # Resumed MKVs join the batch at the stage they stopped at
+        mkv_list += [x for x in later if x.stage == stage]
+
+    return waiting
+
+
+def arrivals(paths: list):
+    """ Jobs for the files a watcher handed out. A file can still disappear after it has settled """
+    for path in paths:
+        try:
+            yield utils.Job.for_path(path, stages.STAGE_0)
+        except FileNotFoundError:
+            print('Gone before it could be processed: ' + str(path))
+
+
+def main_loop(daemon: bool = False):
+    """ Process each mkv. Processing has 3 distinct steps:
+
+            1) pre-processing
+                - Gathers information about the container
+                - Identify any issues that need user intervention
+            2) command execution
+                - Builds out commands for next stage
+                - Executes any commands (i.e. ffmpeg, qaac)
+            3) post-processing
+                - Cleans up any artifacts from this stage
+                - Transitions mkv to next state
+
+        I have separated these three steps primarily as a way to manage flow and remove user input
+        (when necessary) from functional code.
+
+        Note: I have designed this driver to perform pre-processing, command execution, ans post-processing as a batch
+        for all MKVs at each each stage.
+
+        This allows me to get all of the user input out of the way (pre-processing) at the beginning. Otherwise,
+        I'd have to wait for the (sometimes very long) command execution step of each mkv before being able to
+        answer any prompts for the next one.
+
+        With daemon set, the driver doesn't exit once everything is done. It keeps watching 0_analyze
+        (see watch.py) and processes new files as they finish copying.
+    """
+
+    # Anything still carrying a temporary name was left behind by a run that didn't finish
+    for root in settings['roots']:
+        for partial in utils.clean_partials(root):
+            print('Removed half-written file: ' + str(partial))
+
+    # Keep the archives from filling their disks while we work
+    evictor = None
+    if settings['archive_high_water'] is not None:
+        evictor = archive.Evictor([archive.get_archive(_) for _ in settings['roots']], settings['archive_high_water'],
+                                  settings['archive_interval'])
+        evictor.start()
+
+    stager = None
+    if settings['staging']:
+        stager = Stager(settings['staging'], settings['staging_bwlimit'], settings['transfer_reserve'])
+
+    scheduler = Scheduler(settings['max_jobs'], settings['transfer_reserve'], settings['jobs_per_device'],
+                          settings['cache_hints'], stager, offload.get_queue())
+
+    # Nobody is around to answer prompts in daemon mode
+    if daemon:
+        settings['interventions'] = 'queue'
+
+    # Titles that were in progress when the driver last stopped pick up where they left off. Titles that had
+    # to wait for room are retried by the daemon (a plain run leaves them for the next one)
+    waiting = []
+    queue = interventions.get_queue()
+    job_journal = journal.get_journal()
+    if job_journal is not None:
+        # Parked titles come back through the intervention queue instead, unless they had already moved on
+        resumed = [x for x in job_journal.resume()
+                   if queue is None or not queue.parked(x.state.init_path) or queue.carried_on(x)]
+        if resumed:
+            print('Resuming {} title(s) from the journal'.format(len(resumed)))
+            waiting += process_batch(resumed, scheduler)
+
+    # Daemon mode watches for new files from the start, so nothing copied in during the first pass is missed
+    watcher = None
+    if daemon:
+        watcher = watch.get_watcher([pathlib.Path(_).joinpath(utils.search_paths[stages.STAGE_0])
+                                     for _ in settings['roots']],
+                                    settings['watch_settle'], settings['watch_interval'], settings['watch_inotify'])
+
+    # Titles someone answered for since the last run
+    waiting += process_batch(reenter(), scheduler)
+
+    # Sources are found lazily and taken a batch at a time. MKVs only exist for the batch at hand.
+    # In daemon mode, files that may still be copying are left to the watcher until they've settled
+    min_age = None
+    if watcher is not None:
+        watcher.seed()
+        min_age = max(settings['scan_min_age'], settings['watch_settle'])
+    jobs = itertools.chain.from_iterable(utils.iter_jobs(stages.STAGE_0, root, min_age) for root in settings['roots'])
+    if queue is not None:
+        jobs = (x for x in jobs if not queue.parked(x.path))
+    while True:
+        batch = [job.mkv() for job in itertools.islice(jobs, settings['batch_size'])]
+        if not batch:
+            break
+        waiting += process_batch(batch, scheduler)
+
+    # From here on, new files are fed in as soon as they are completely copied
+    if watcher is not None:
+        print('Watching for new files. Ctrl-C to stop')
+        try:
+            while True:
+                # A batch that blows up shouldn't take the daemon down with it
+                try:
+                    # Wake up now and then to pick up answered interventions and retry titles waiting for room.
+                    # Those were renamed to orig_ already, so the watcher won't hand them out again
+                    ready = watcher.wait(settings['intervention_poll'] if queue is not None or waiting else None)
+                    arrived = utils.skip_duplicates(arrivals(ready))
+                    batch = reenter() + waiting + [job.mkv() for job in arrived]
+                    waiting = []
+                    if batch:
+                        waiting = process_batch(batch, scheduler)
+
+                        # Finished titles only have to stay in the journal until it's compacted
+                        if job_journal is not None:
+                            job_journal.compact()
+                except Exception as exc:
+                    print('Batch failed, still watching: {!r}'.format(exc))
+        except KeyboardInterrupt:
+            print('Stopped watching')
+        finally:
+            watcher.close()
+
+    # Let the offload queue finish before we exit
+    offloader = offload.get_queue()
+    if offloader is not None:
+        print('Waiting for {} bytes to be offloaded'.format(offloader.pending_bytes()))
+        offloader.join()
+        for path in offloader.failed:
+            print('Could not offload: ' + str(path))
+
+    if evictor is not None:
+        evictor.stop()
+
 
 if __name__ == '__main__':
-    main_loop()
+    if sys.argv[1:2] == ['answer']:
+        answer()
+    else:
+        main_loop(daemon='--daemon' in sys.argv[1:])
@@ -0,0 +1,194 @@
+""" Retention for archived originals.
+
+    Stage 0 moves every original into _archive and nothing ever takes it out again, so sooner or
+    later the archive fills its disk and stage 0 starts failing. Each archive keeps a small index
+    (archive.json) of what it holds: size, when it was archived and whether the final output made
+    it through stage 2 verification.
+
+    An Evictor thread watches every archive and, once its disk goes over the high-water mark,
+    deletes originals oldest first until it is back under. An original whose output was never
+    verified is never deleted.
+"""
+import os
+import json
+import time
+import shutil
+import pathlib
+import threading
+from typing import List
+
+from mkvremux.state import partial_path
+
+INDEX_NAME = 'archive.json'
+
+
+class Archive:
+    """ The _archive directory of a processing root and what we know about everything in it
+
+        Instance Attributes
+        ====================
+
+        path        The archive directory
+        entries     {clean_name: {'file', 'size', 'archived', 'verified', 'output'}}
+    """
+
+    def __init__(self, root: pathlib.Path):
+        """ Constructor for Archive """
+        self.path = pathlib.Path(root).joinpath('_archive')
+        self.index_path = self.path.joinpath(INDEX_NAME)
+        self._lock = threading.Lock()
+        self.entries = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(str(self.index_path), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        # Same trick as the stage outputs: never leave a half-written index behind
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp = partial_path(self.index_path)
+        with open(str(tmp), 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(str(tmp), str(self.index_path))
+
+    def add(self, original: pathlib.Path, clean_name: str):
+        """ Record an original that was just archived """
+        original = pathlib.Path(original)
+        with self._lock:
+            self.entries[clean_name] = {
+                'file': original.name,
+                'size': original.stat().st_size,
+                'archived': time.time(),
+                'verified': False,
+                'output': None
+            }
+            self._save()
+
+    def mark_verified(self, clean_name: str, output: pathlib.Path):
+        """ Record that the final output of an archived original passed verification """
+        with self._lock:
+            entry = self.entries.get(clean_name)
+            if entry is None:
+                return
+            entry['verified'] = True
+            entry['output'] = str(output)
+            self._save()
+
+    def scan(self):
+        """ Bring the index in line with the directory
+
+            Entries whose original is gone (deleted by hand, offloaded to cold storage) are
+            forgotten. Originals that were archived before there was an index are picked up as
+            unverified, aged by their mtime.
+        """
+        with self._lock:
+            present = {_.name: _ for _ in self.path.glob('orig_*')} if self.path.is_dir() else {}
+            known = {_['file'] for _ in self.entries.values()}
+
+            gone = [name for name, entry in self.entries.items() if entry['file'] not in present]
+            for name in gone:
+                del self.entries[name]
+
+            for fname, path in present.items():
+                if fname not in known:
+                    stat = path.stat()
+                    self.entries[path.stem[len('orig_'):]] = {
+                        'file': fname, 'size': stat.st_size, 'archived': stat.st_mtime,
+                        'verified': False, 'output': None
+                    }
+
+            self._save()
+
+    def usage(self) -> float:
+        """ Fraction of the archive's disk that is in use """
+        usage = shutil.disk_usage(str(self.path))
+        return usage.used / usage.total
+
+    def evict(self, high_water: float) -> List[pathlib.Path]:
+        """ Delete verified originals, oldest first, until the disk is under the high-water mark
+
+        :param high_water:  Fraction of the disk (0.0 - 1.0) the archive may fill it up to
+        :return list:       Every original that was deleted
+        """
+        if not self.path.is_dir():
+            return []
+
+        self.scan()
+        evicted = []
+
+        with self._lock:
+            candidates = sorted((_ for _ in self.entries.items() if _[1]['verified']),
+                                key=lambda _: _[1]['archived'])
+
+            for name, entry in candidates:
+                if self.usage() <= high_water:
+                    break
+
+                original = self.path.joinpath(entry['file'])
+                original.unlink()
+                del self.entries[name]
+                evicted.append(original)
+
+            if evicted:
+                self._save()
+
+        return evicted
+
+
+_archives = {}
+
+
+def get_archive(root: pathlib.Path) -> Archive:
+    """ The process wide Archive of a processing root """
+    root = pathlib.Path(root)
+    if root not in _archives:
+        _archives[root] = Archive(root)
+    return _archives[root]
+
+
+class Evictor:
+    """ Background thread that keeps every archive under the high-water mark
+
+        Instance Attributes
+        ====================
+
+        archives    The archives to watch
+        high_water  Fraction of a disk (0.0 - 1.0) the archive may fill it up to
+        interval    Seconds between checks
+    """
+
+    def __init__(self, archives: List[Archive], high_water: float, interval: float = 60):
+        """ Constructor for Evictor """
+        self.archives = archives
+        self.high_water = high_water
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def run_once(self) -> List[pathlib.Path]:
+        """ Check every archive once """
+        evicted = []
+        for archive in self.archives:
+            try:
+                evicted += archive.evict(self.high_water)
+            except OSError as exc:
+                print('  Archive eviction failed in {}: {}'.format(archive.path, exc))
+
+        for original in evicted:
+            print('  Evicted archived original: ' + str(original))
+        return evicted
+
+    def _worker(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
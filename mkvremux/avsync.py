@@ -0,0 +1,104 @@
+""" Audio sync regression check for stage 2.
+
+    Stage 2 muxes the stereo mix in next to the original audio track. If either one ends up shifted
+    (bad start time, dropped priming samples, etc.) the two tracks drift apart even though both
+    "play fine". Comparing full decodes would be way too expensive, so instead we:
+
+        1) Decode a few short windows of each track to 8 kHz mono
+        2) Reduce each window to an RMS envelope at a few hundred Hz
+        3) Cross-correlate the envelopes (FFT based) to find the lag between them
+
+    A window is only ever a few thousand floats, so memory and CPU stay tiny.
+
+    Requires numpy.
+"""
+import pathlib
+from subprocess import run, PIPE, DEVNULL
+from typing import List, Tuple
+
+import numpy as np
+
+from mkvremux.verify import container_duration
+
+# Decode rate and the number of samples folded into each envelope point (8000 / 20 = 400 Hz envelope)
+DECODE_RATE = 8000
+HOP = 20
+ENVELOPE_RATE = DECODE_RATE / HOP
+
+
+def envelope(path: pathlib.Path, track: int, start: float, length: float) -> np.ndarray:
+    """ Decode a window of an audio track and reduce it to a mono RMS envelope
+
+    :param path:    Path to the container
+    :param track:   Audio track number (0:a:N)
+    :param start:   Where the window starts (seconds)
+    :param length:  Length of the window (seconds)
+    :return:        RMS envelope sampled at ENVELOPE_RATE
+    """
+    cmd = ['ffmpeg', '-v', 'error', '-ss', '{:.3f}'.format(start), '-i', str(path), '-map', '0:a:{}'.format(track),
+           '-t', '{:.3f}'.format(length), '-ac', '1', '-ar', str(DECODE_RATE), '-f', 'f32le', '-']
+
+    ret = run(cmd, stdout=PIPE, stderr=DEVNULL)
+    if ret.returncode != 0:
+        raise RuntimeError('Problem decoding audio window: {}'.format(path))
+
+    samples = np.frombuffer(ret.stdout, dtype=np.float32)
+    samples = samples[:len(samples) - len(samples) % HOP].reshape(-1, HOP)
+
+    return np.sqrt(np.mean(np.square(samples, dtype=np.float64), axis=1))
+
+
+def estimate_lag(a: np.ndarray, b: np.ndarray, max_lag: int) -> int:
+    """ Find the shift (in envelope samples) that best lines `b` up with `a`.
+
+        Positive means `a` is late compared to `b`.
+
+    :param a:       First envelope
+    :param b:       Second envelope
+    :param max_lag: Largest shift to consider in either direction
+    :return int:    The best shift
+    """
+    a = (a - a.mean()) / (a.std() or 1.0)
+    b = (b - b.mean()) / (b.std() or 1.0)
+
+    # Zero pad to avoid circular wrap-around
+    n = 1 << int(np.ceil(np.log2(len(a) + len(b))))
+    corr = np.fft.irfft(np.fft.rfft(a, n) * np.conj(np.fft.rfft(b, n)), n)
+
+    # corr[k] is the score for shift k, corr[n - k] for shift -k
+    lags = np.arange(-max_lag, max_lag + 1)
+    return int(lags[np.argmax(corr[lags % n])])
+
+
+def measure_offset(path: pathlib.Path, windows: int, length: float,
+                   max_offset: float = 1.0) -> Tuple[float, List[float]]:
+    """ Measure the offset between the first two audio tracks of a container.
+
+        The windows are spread evenly over the file and the median is used so one quiet (or
+        silent) window can't skew the result.
+
+    :param path:        Path to the container
+    :param windows:     How many windows to measure
+    :param length:      Length of each window (seconds)
+    :param max_offset:  Largest offset to search for (seconds)
+    :return tuple:      (median offset in seconds, offset of each window in seconds)
+    """
+    duration = container_duration(path)
+    max_lag = int(max_offset * ENVELOPE_RATE)
+
+    offsets = []
+    for n in range(windows):
+        start = max(0.0, (duration - length) * (n + 1) / (windows + 1))
+        original = envelope(path, 0, start, length)
+        mix = envelope(path, 1, start, length)
+
+        size = min(len(original), len(mix))
+        if size <= max_lag:
+            continue
+
+        offsets.append(estimate_lag(mix[:size], original[:size], max_lag) / ENVELOPE_RATE)
+
+    if not offsets:
+        raise RuntimeError('Not enough audio to measure sync: {}'.format(path))
+
+    return float(np.median(offsets)), offsets
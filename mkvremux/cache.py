@@ -0,0 +1,122 @@
+""" Page cache hygiene.
+
+    Every file we touch is 40 GB and read exactly once. Left alone, the kernel happily evicts
+    everything else on the box (media server metadata, artwork, ...) to cache them. So:
+
+        - Before a job starts, the first few MB of its input get WILLNEED so the job starts on a
+          warm cache. (SEQUENTIAL would be no use here: it only applies to the file description it
+          is issued on, and ffmpeg opens its own)
+        - Once a stage commits, its inputs and outputs get DONTNEED (after an fsync, since dirty
+          pages can't be dropped)
+
+    residency() and snapshot() measure how much of a file (and of RAM) is cached, so the effect can
+    actually be seen. Everything here quietly does nothing on platforms without posix_fadvise.
+"""
+import os
+import mmap
+import ctypes
+import ctypes.util
+import pathlib
+from typing import Iterable, Union
+
+# How much of the next input to pull in ahead of time
+PREFETCH_BYTES = 64 * 1024 * 1024
+
+
+def advise(path: Union[str, pathlib.Path], advice: str, offset: int = 0, length: int = 0):
+    """ posix_fadvise a whole file (or a range of it)
+
+    :param path:    The file
+    :param advice:  'willneed' or 'dontneed'. Both act on the file's cached pages, not just our descriptor
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+
+    flag = {
+        'willneed': os.POSIX_FADV_WILLNEED,
+        'dontneed': os.POSIX_FADV_DONTNEED
+    }[advice]
+
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        # Dirty pages are never dropped. Flush them first
+        if advice == 'dontneed':
+            os.fsync(fd)
+        os.posix_fadvise(fd, offset, length, flag)
+    finally:
+        os.close(fd)
+
+
+def prefetch(path: Union[str, pathlib.Path]):
+    """ Get a file ready to be streamed """
+    advise(path, 'willneed', 0, PREFETCH_BYTES)
+
+
+def drop(paths: Iterable[Union[str, pathlib.Path]]):
+    """ Evict files we're done with from the page cache """
+    for path in paths:
+        if pathlib.Path(path).is_file():
+            advise(path, 'dontneed')
+
+
+def residency(path: Union[str, pathlib.Path]) -> float:
+    """ Fraction of a file that is currently in the page cache (mincore)
+
+    :return float: 0.0 - 1.0, or -1.0 if it can't be measured on this platform
+    """
+    size = os.path.getsize(str(path))
+    if size == 0:
+        return 0.0
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                              ctypes.c_long]
+        libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+    except (OSError, AttributeError):
+        return -1.0
+
+    pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+    vec = (ctypes.c_ubyte * pages)()
+
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        # Mapping a file doesn't read it. mincore just reports which pages are already there
+        addr = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+        if addr in [None, ctypes.c_void_p(-1).value]:
+            return -1.0
+        try:
+            if libc.mincore(addr, size, vec) != 0:
+                return -1.0
+        finally:
+            libc.munmap(addr, size)
+    finally:
+        os.close(fd)
+
+    raw = bytes(vec)
+    return (pages - raw.count(0)) / pages
+
+
+def cached_kb() -> int:
+    """ Size of the page cache ('Cached' in /proc/meminfo), or -1 if unknown """
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('Cached:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return -1
+
+
+def snapshot(paths: Iterable[Union[str, pathlib.Path]]) -> dict:
+    """ Page cache metrics for a set of files
+
+    :return dict: {'cached_kb': int, 'resident': {path: fraction}}
+    """
+    return {
+        'cached_kb': cached_kb(),
+        'resident': {str(_): residency(_) for _ in paths if pathlib.Path(_).is_file()}
+    }
@@ -0,0 +1,375 @@
+""" The movie catalog (movie_details.json) stage 2 pulls its metadata from.
+
+    The catalog is loaded once per process and indexed by exact title, normalized title, year and
+    imdb_id, so a lookup is a dict hit instead of a scan of every movie. If the file changes on
+    disk (mtime) it is reloaded on the next lookup. Load and lookup times are kept in `timings`.
+
+    Titles that don't match outright go through a trigram index: only titles sharing enough
+    trigrams with the query to possibly be within the edit distance limit are compared at all.
+    Candidates come back ranked by edit distance, then year agreement. When the best two can't be
+    told apart the match is ambiguous and nobody guesses.
+"""
+import os
+import json
+import string
+import pathlib
+import threading
+import time
+from collections import namedtuple
+from typing import List, Optional
+
+from mkvremux.config import settings, resource_path
+from mkvremux.provider import get_provider
+from mkvremux.state import partial_path
+
+# Leading words that don't count when comparing titles
+ARTICLES = ('the', 'a', 'an')
+
+_strip_punctuation = str.maketrans('', '', string.punctuation)
+
+# A fuzzy match candidate. Lower distance is better, year_match breaks ties
+Candidate = namedtuple('Candidate', ['movie', 'distance', 'year_match'])
+
+
+def normalize(title: str) -> str:
+    """ Reduce a title to what matters for matching
+
+        'Blade Runner: 2049' and 'blade runner 2049' both become 'blade runner 2049', and
+        'The Thing' becomes 'thing'. ':' goes away just like it does for MKV.media_title
+    """
+    words = title.replace(':', '').translate(_strip_punctuation).lower().split()
+    if len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+    return ' '.join(words)
+
+
+def trigrams(text: str) -> List[str]:
+    """ Character trigrams of a (normalized) title, padded so that short titles have some too """
+    padded = '  ' + text + ' '
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """ Levenshtein distance between a and b, or limit + 1 as soon as it's known to exceed limit """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+
+    return previous[-1]
+
+
+def movie_key(movie: dict) -> str:
+    """ What identifies a movie between two versions of the catalog file """
+    if movie.get('imdb_id'):
+        return movie['imdb_id']
+    return '{}|{}'.format(movie['title'], movie.get('year'))
+
+
+class TitleIndex:
+    """ Trigram inverted index over normalized titles
+
+        Instance Attributes
+        ====================
+
+        titles      {normalized title: [movies]}
+        postings    {trigram: [normalized titles containing it]}
+        lengths     {length: [normalized titles that long]}
+    """
+
+    def __init__(self, titles: dict):
+        """ Constructor for TitleIndex """
+        self.titles = titles
+        self.postings = {}
+        self.lengths = {}
+        for title in titles:
+            for gram in set(trigrams(title)):
+                self.postings.setdefault(gram, []).append(title)
+            self.lengths.setdefault(len(title), []).append(title)
+
+    def search(self, title: str, year: str = None, max_distance: int = 2, limit: int = 5) -> List[Candidate]:
+        """ Every movie within max_distance edits of title, best first
+
+        :param title:           The title to look for (normalized or not)
+        :param year:            Year we expect. Movies from that year rank above others at the same distance
+        :param max_distance:    Most edits between the normalized titles
+        :param limit:           Most candidates to return
+        :return list:           Candidates ranked by (distance, year agreement)
+        """
+        query = normalize(title)
+        grams = sorted(set(trigrams(query)), key=lambda _: len(self.postings.get(_, [])))
+
+        # Every edit breaks at most 3 trigrams, so with more than 3 * max_distance of them anything close
+        # enough shares one of the rarest 3 * max_distance + 1. Only those posting lists have to be walked
+        shared = set()
+        if len(grams) > 3 * max_distance:
+            for gram in grams[:3 * max_distance + 1]:
+                shared.update(self.postings.get(gram, []))
+        else:
+            # Too short for the trigram filter to be safe. Only the length filter is left
+            for length in range(len(query) - max_distance, len(query) + max_distance + 1):
+                shared.update(self.lengths.get(length, []))
+
+        candidates = []
+        for other in shared:
+            distance = edit_distance(query, other, max_distance)
+            if distance > max_distance:
+                continue
+            for movie in self.titles[other]:
+                year_match = year is not None and str(movie.get('year')) == str(year)
+                candidates.append(Candidate(movie, distance, year_match))
+
+        candidates.sort(key=lambda _: (_.distance, not _.year_match, _.movie['title']))
+        return candidates[:limit]
+
+
+def ambiguous(candidates: List[Candidate]) -> bool:
+    """ True if the best candidate can't be told apart from the runner up """
+    if len(candidates) < 2:
+        return False
+    best, runner_up = candidates[0], candidates[1]
+    return (best.distance, best.year_match) == (runner_up.distance, runner_up.year_match)
+
+
+class Catalog:
+    """ Indexed, auto-reloading view of the movie catalog
+
+        Instance Attributes
+        ====================
+
+        path        The catalog file
+        movies      Every movie in the catalog
+        mtime       mtime of the file when it was last loaded
+        timings     {'loads', 'load_seconds', 'lookups', 'lookup_seconds'}
+    """
+
+    def __init__(self, path: pathlib.Path):
+        """ Constructor for Catalog """
+        self.path = pathlib.Path(path)
+        self.movies = []
+        self.mtime = None
+        self.timings = {'loads': 0, 'load_seconds': 0.0, 'lookups': 0, 'lookup_seconds': 0.0}
+
+        self._by_title = {}
+        self._by_normalized = {}
+        self._by_year = {}
+        self._by_imdb = {}
+        self._fuzzy = TitleIndex({})
+        self._lock = threading.Lock()
+
+    def _load(self, mtime: float):
+        start = time.perf_counter()
+
+        with open(str(self.path), 'r') as f:
+            movies = json.load(f)['Movies']
+
+        by_title, by_normalized, by_year, by_imdb = {}, {}, {}, {}
+        for movie in movies:
+            by_title.setdefault(movie['title'], []).append(movie)
+            by_normalized.setdefault(normalize(movie['title']), []).append(movie)
+            by_year.setdefault(str(movie.get('year')), []).append(movie)
+            if movie.get('imdb_id'):
+                by_imdb[movie['imdb_id']] = movie
+
+        self.movies = movies
+        self._by_title, self._by_normalized, self._by_year, self._by_imdb = by_title, by_normalized, by_year, by_imdb
+        self._fuzzy = TitleIndex(by_normalized)
+        self.mtime = mtime
+
+        self.timings['loads'] += 1
+        self.timings['load_seconds'] += time.perf_counter() - start
+
+    def refresh(self):
+        """ Load the catalog if it has never been loaded or has changed on disk since """
+        mtime = os.stat(str(self.path)).st_mtime
+        with self._lock:
+            if mtime != self.mtime:
+                self._load(mtime)
+
+    def _timed(self, start: float):
+        self.timings['lookups'] += 1
+        self.timings['lookup_seconds'] += time.perf_counter() - start
+
+    def matches(self, title: str, year: str = None) -> List[dict]:
+        """ Every movie with exactly this title or, failing that, this normalized title
+
+        :param title:   The title to look for
+        :param year:    Only accept movies from this year
+        :return list:   The movies. More than one means the title alone doesn't say which (e.g. remakes)
+        """
+        self.refresh()
+        start = time.perf_counter()
+
+        for index, key in [(self._by_title, title), (self._by_normalized, normalize(title))]:
+            hits = [_ for _ in index.get(key, []) if year is None or str(_.get('year')) == str(year)]
+            if hits:
+                self._timed(start)
+                return hits
+
+        self._timed(start)
+        return []
+
+    def lookup(self, title: str, year: str = None) -> Optional[dict]:
+        """ Find a movie by exact title, then by normalized title. See matches()
+
+        :param title:   The title to look for
+        :param year:    Only accept a movie from this year
+        :return dict:   The movie, or None if there's no match or more than one
+        """
+        hits = self.matches(title, year)
+        return hits[0] if len(hits) == 1 else None
+
+    def fuzzy(self, title: str, year: str = None, max_distance: int = 2, limit: int = 5) -> List[Candidate]:
+        """ Ranked fuzzy matches for a title. See TitleIndex.search() """
+        self.refresh()
+        start = time.perf_counter()
+        candidates = self._fuzzy.search(title, year, max_distance, limit)
+        self._timed(start)
+        return candidates
+
+    def by_imdb(self, imdb_id: str) -> Optional[dict]:
+        """ Find a movie by its imdb_id """
+        self.refresh()
+        return self._by_imdb.get(imdb_id)
+
+    def by_year(self, year: str) -> List[dict]:
+        """ Every movie from a given year """
+        self.refresh()
+        return list(self._by_year.get(str(year), []))
+
+    def add(self, movies: List[dict]):
+        """ Write new movies into the catalog file (e.g. ones a metadata provider found)
+
+            Movies the catalog already has, or that show up twice (two titles in a batch resolving to
+            the same movie), are only written once. Otherwise every later lookup would be ambiguous
+        """
+        if not movies:
+            return
+
+        with self._lock:
+            with open(str(self.path), 'r') as f:
+                data = json.load(f)
+
+            known = {movie_key(_) for _ in data['Movies']}
+            for movie in movies:
+                if movie_key(movie) not in known:
+                    known.add(movie_key(movie))
+                    data['Movies'].append(movie)
+
+            tmp = partial_path(self.path)
+            with open(str(tmp), 'w') as f:
+                json.dump(data, f, indent=4)
+            os.replace(str(tmp), str(self.path))
+
+        self.refresh()
+
+    def size(self) -> int:
+        """ Number of movies in the catalog """
+        return len(self.movies)
+
+    def report(self) -> str:
+        """ One line summary of how much time the catalog has cost us """
+        lookups = self.timings['lookups']
+        return 'Catalog: {} movies, {} load(s) in {:.3f}s, {} lookup(s) averaging {:.1f}us'.format(
+            self.size(), self.timings['loads'], self.timings['load_seconds'], lookups,
+            self.timings['lookup_seconds'] / lookups * 1e6 if lookups else 0.0)
+
+
+# Outcome of resolving a single title. status is 'exact', 'fuzzy', 'fetched', 'ambiguous' or 'missing'
+Resolution = namedtuple('Resolution', ['status', 'movie', 'candidates'])
+
+
+def resolve(titles: List[str], catalog: Catalog = None, max_distance: int = 2, provider=None) -> dict:
+    """ Resolve a whole batch of titles against the catalog in one pass
+
+        Meant to run before any stage 2 command does, so that titles which will never get their
+        metadata are known up front instead of halfway through the batch. Titles the catalog has
+        nothing for are handed to the metadata provider (if there is one) as a single batch, and
+        whatever it finds is added to the catalog.
+
+    :param titles:          Every title in the batch
+    :param catalog:         The catalog (get_catalog() by default)
+    :param max_distance:    See Catalog.fuzzy()
+    :param provider:        Metadata provider (provider.get_provider() by default)
+    :return dict:           {title: Resolution}
+    """
+    catalog = catalog or get_catalog()
+    provider = provider or get_provider()
+    resolved = {}
+
+    for title in titles:
+        if title in resolved:
+            continue
+
+        # Two movies by the same name (remakes) can't be told apart without a year
+        hits = catalog.matches(title)
+        if len(hits) == 1:
+            resolved[title] = Resolution('exact', hits[0], [])
+            continue
+        if hits:
+            resolved[title] = Resolution('ambiguous', None, [Candidate(_, 0, False) for _ in hits])
+            continue
+
+        candidates = catalog.fuzzy(title, max_distance=max_distance)
+        if not candidates:
+            resolved[title] = Resolution('missing', None, [])
+        elif ambiguous(candidates):
+            resolved[title] = Resolution('ambiguous', None, candidates)
+        else:
+            resolved[title] = Resolution('fuzzy', candidates[0].movie, candidates)
+
+    missing = [_ for _, resolution in resolved.items() if resolution.status == 'missing']
+    if provider is not None and missing:
+        fetched = {_: movie for _, movie in provider.fetch(missing).items() if movie is not None}
+        catalog.add(list(fetched.values()))
+        for title, movie in fetched.items():
+            resolved[title] = Resolution('fetched', movie, [])
+
+    return resolved
+
+
+def resolution_report(resolved: dict) -> str:
+    """ Human readable summary of resolve() """
+    lines = []
+    for status in ['exact', 'fuzzy', 'fetched', 'ambiguous', 'missing']:
+        titles = [_ for _, resolution in resolved.items() if resolution.status == status]
+        lines.append('  {}: {}'.format(status.capitalize(), len(titles)))
+
+        for title in titles:
+            resolution = resolved[title]
+            if status == 'fuzzy':
+                lines.append('    {} -> {} ({}), distance {}'.format(
+                    title, resolution.movie['title'], resolution.movie.get('year'), resolution.candidates[0].distance))
+            elif status == 'ambiguous':
+                lines.append('    {} -> {}'.format(title, ', '.join(
+                    '{} ({})'.format(_.movie['title'], _.movie.get('year')) for _ in resolution.candidates)))
+            elif status == 'missing':
+                lines.append('    ' + title)
+
+    return '\n'.join(lines)
+
+
+_catalogs = {}
+
+
+def get_catalog(path: pathlib.Path = None) -> Catalog:
+    """ The process wide Catalog for a file (settings['catalog'] by default)
+
+        With settings['catalog_db'] set, the catalog lives in SQLite instead and the file is only
+        used to import changes from (see catalog_db.py)
+    """
+    path = resource_path(path or settings['catalog'])
+    if path not in _catalogs:
+        if settings['catalog_db']:
+            from mkvremux.catalog_db import SqliteCatalog
+            _catalogs[path] = SqliteCatalog(resource_path(settings['catalog_db']), path)
+        else:
+            _catalogs[path] = Catalog(path)
+    return _catalogs[path]
@@ -0,0 +1,186 @@
+""" SQLite backed movie catalog.
+
+    Same interface as catalog.Catalog, but nothing is held in memory: opening the catalog costs the
+    same no matter how big it is, and lookups are answered by indexes in the database.
+
+    movie_details.json stays the source of truth. Whenever its mtime changes, the entries are
+    diffed against the database and only new, changed and removed movies are written. Fuzzy title
+    search uses an FTS5 table with the trigram tokenizer (SQLite 3.34+) to find candidates: every
+    title sharing one of the query's 3 * max_distance + 1 rarest trigrams (counted in the fts5vocab
+    table), which can't miss a title within max_distance edits. Queries too short for that are
+    checked against every title of a similar length instead. Candidates are ranked by edit distance
+    the same way the in-memory index ranks them.
+"""
+import json
+import sqlite3
+import pathlib
+import threading
+import time
+from typing import List, Optional
+
+from mkvremux.catalog import Catalog, Candidate, edit_distance, movie_key, normalize
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS movies (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    title TEXT NOT NULL,
+    normalized TEXT NOT NULL,
+    year TEXT,
+    imdb_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS movies_title ON movies (title);
+CREATE INDEX IF NOT EXISTS movies_normalized ON movies (normalized);
+CREATE INDEX IF NOT EXISTS movies_year ON movies (year);
+CREATE INDEX IF NOT EXISTS movies_imdb ON movies (imdb_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS movies_fts USING fts5 (
+    normalized, content='movies', content_rowid='id', tokenize='trigram'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS movies_vocab USING fts5vocab (movies_fts, 'row');
+CREATE TRIGGER IF NOT EXISTS movies_ai AFTER INSERT ON movies BEGIN
+    INSERT INTO movies_fts (rowid, normalized) VALUES (new.id, new.normalized);
+END;
+CREATE TRIGGER IF NOT EXISTS movies_ad AFTER DELETE ON movies BEGIN
+    INSERT INTO movies_fts (movies_fts, rowid, normalized) VALUES ('delete', old.id, old.normalized);
+END;
+CREATE TRIGGER IF NOT EXISTS movies_au AFTER UPDATE ON movies BEGIN
+    INSERT INTO movies_fts (movies_fts, rowid, normalized) VALUES ('delete', old.id, old.normalized);
+    INSERT INTO movies_fts (rowid, normalized) VALUES (new.id, new.normalized);
+END;
+
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class SqliteCatalog(Catalog):
+    """ Movie catalog kept in SQLite and fed from the catalog file
+
+        Instance Attributes
+        ====================
+
+        db_path     The database
+        path        The catalog file changes are imported from
+        imported    {'added', 'changed', 'removed'} counts of the last import
+    """
+
+    def __init__(self, db_path: pathlib.Path, path: pathlib.Path):
+        """ Constructor for SqliteCatalog """
+        super().__init__(path)
+        self.db_path = pathlib.Path(db_path)
+        self.imported = {'added': 0, 'changed': 0, 'removed': 0}
+
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        try:
+            self._db.executescript(SCHEMA)
+        except sqlite3.OperationalError as exc:
+            raise RuntimeError('SQLite has no FTS5 trigram tokenizer', sqlite3.sqlite_version, str(exc))
+
+    def _query(self, sql: str, args: tuple = ()) -> list:
+        with self._db_lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def _load(self, mtime: float):
+        """ Import whatever changed in the catalog file since the last import """
+        start = time.perf_counter()
+
+        stored = self._query("SELECT value FROM meta WHERE name = 'mtime'")
+        if stored and float(stored[0][0]) == mtime:
+            self.mtime = mtime
+            return
+
+        with open(str(self.path), 'r') as f:
+            movies = {movie_key(_): _ for _ in json.load(f)['Movies']}
+
+        with self._db_lock, self._db:
+            existing = dict(self._db.execute('SELECT key, data FROM movies'))
+
+            added = [_ for _ in movies if _ not in existing]
+            changed = [_ for _ in movies if _ in existing and json.loads(existing[_]) != movies[_]]
+            removed = [_ for _ in existing if _ not in movies]
+
+            self._db.executemany('DELETE FROM movies WHERE key = ?', [(_,) for _ in removed])
+            self._db.executemany('DELETE FROM movies WHERE key = ?', [(_,) for _ in changed])
+            self._db.executemany(
+                'INSERT INTO movies (key, title, normalized, year, imdb_id, data) VALUES (?, ?, ?, ?, ?, ?)',
+                [(_, movies[_]['title'], normalize(movies[_]['title']), str(movies[_].get('year')),
+                  movies[_].get('imdb_id'), json.dumps(movies[_])) for _ in added + changed])
+            self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('mtime', ?)", (str(mtime),))
+
+        self.imported = {'added': len(added), 'changed': len(changed), 'removed': len(removed)}
+        self.mtime = mtime
+
+        self.timings['loads'] += 1
+        self.timings['load_seconds'] += time.perf_counter() - start
+
+    def size(self) -> int:
+        return self._query('SELECT COUNT(*) FROM movies')[0][0]
+
+    def matches(self, title: str, year: str = None) -> List[dict]:
+        """ See Catalog.matches() """
+        self.refresh()
+        start = time.perf_counter()
+
+        for column, key in [('title', title), ('normalized', normalize(title))]:
+            sql = 'SELECT data FROM movies WHERE {} = ?'.format(column)
+            args = (key,)
+            if year is not None:
+                sql += ' AND year = ?'
+                args += (str(year),)
+
+            rows = self._query(sql + ' ORDER BY id', args)
+            if rows:
+                self._timed(start)
+                return [json.loads(_[0]) for _ in rows]
+
+        self._timed(start)
+        return []
+
+    def fuzzy(self, title: str, year: str = None, max_distance: int = 2, limit: int = 5) -> List[Candidate]:
+        """ See Catalog.fuzzy(). Candidates come from the trigram table instead of the in-memory index """
+        self.refresh()
+        start = time.perf_counter()
+
+        query = normalize(title)
+        grams = sorted({query[i:i + 3] for i in range(len(query) - 2)})
+
+        # Every edit breaks at most 3 trigrams, so with more than 3 * max_distance of them anything close
+        # enough shares one of the rarest 3 * max_distance + 1. Same filter as TitleIndex.search()
+        if len(grams) > 3 * max_distance:
+            counts = dict(self._query('SELECT term, doc FROM movies_vocab WHERE term IN ({})'.format(
+                ', '.join('?' * len(grams))), tuple(grams)))
+            grams = sorted(grams, key=lambda _: counts.get(_, 0))[:3 * max_distance + 1]
+
+            match = ' OR '.join('"{}"'.format(_.replace('"', '""')) for _ in grams)
+            rows = self._query('SELECT m.normalized, m.data FROM movies_fts f JOIN movies m ON m.id = f.rowid '
+                               'WHERE movies_fts MATCH ?', (match,))
+        else:
+            # Too short for the trigram filter to be safe. Only the length filter is left
+            rows = self._query('SELECT normalized, data FROM movies WHERE length(normalized) BETWEEN ? AND ?',
+                               (len(query) - max_distance, len(query) + max_distance))
+
+        candidates = []
+        for other, data in rows:
+            distance = edit_distance(query, other, max_distance)
+            if distance > max_distance:
+                continue
+            movie = json.loads(data)
+            candidates.append(Candidate(movie, distance, year is not None and str(movie.get('year')) == str(year)))
+
+        candidates.sort(key=lambda _: (_.distance, not _.year_match, _.movie['title']))
+        self._timed(start)
+        return candidates[:limit]
+
+    def by_imdb(self, imdb_id: str) -> Optional[dict]:
+        """ See Catalog.by_imdb() """
+        self.refresh()
+        row = self._query('SELECT data FROM movies WHERE imdb_id = ? LIMIT 1', (imdb_id,))
+        return json.loads(row[0][0]) if row else None
+
+    def by_year(self, year: str) -> List[dict]:
+        """ See Catalog.by_year() """
+        self.refresh()
+        return [json.loads(_[0]) for _ in self._query('SELECT data FROM movies WHERE year = ? ORDER BY id',
+                                                      (str(year),))]
@@ -0,0 +1,159 @@
+""" Pipeline tunables.
+
+    Everything in here has a sane default. The driver (or a test) can override any of these before
+    processing starts, e.g. settings['verify'] = False
+"""
+import pathlib
+from typing import Optional, Union
+
+settings = {
+    # Processing roots. Each one holds its own 0_analyze, 1_remux, 2_mix, 3_review and _archive directories.
+    # Put one on every disk and the driver spreads the work across them
+    'roots': ['tests/processing'],
+
+    # Relative resource paths below (catalog, journal, indexes, ...) are resolved against this directory. None uses
+    # the first processing root, which is where they have always lived
+    'resource_dir': None,
+
+    # How many stage jobs (remux, mix, mux) may run at the same time, and how many of those may touch any
+    # single device. Every job is I/O heavy, so more than one per spindle just makes them all slower. Raise max_jobs
+    # with care: a stage 1 job holds the whole decoded WAV of its title in memory (several GB for a feature film)
+    'max_jobs': 1,
+    'jobs_per_device': 1,
+
+    # Movie catalog stage 2 takes its metadata from. Reloaded whenever the file changes
+    'catalog': 'resources/movie_details.json',
+
+    # SQLite database to keep the catalog in, e.g. 'resources/movie_details.db'. Changes to the catalog file are
+    # imported into it incrementally. None keeps the whole catalog in memory
+    'catalog_db': None,
+
+    # HTTP metadata service asked about titles the catalog doesn't have (GET <url>?title=...). None disables.
+    # Answers are cached in provider_cache for provider_ttl seconds ("not found" for provider_negative_ttl), and at
+    # most provider_max_concurrent requests run at once, no more than provider_rate starting per second
+    'metadata_provider': None,
+    'provider_cache': 'resources/provider_cache',
+    'provider_ttl': 30 * 24 * 3600,
+    'provider_negative_ttl': 24 * 3600,
+    'provider_max_concurrent': 4,
+    'provider_rate': 5,
+
+    # Most edits (after normalizing) between a title and a catalog entry for a fuzzy match
+    'fuzzy_max_distance': 2,
+
+    # Which files the stage directories are scanned for: glob patterns to include (None for every .mkv) and exclude,
+    # the smallest size in bytes and how many seconds a file must be left alone before it's picked up
+    'scan_include': None,
+    'scan_exclude': [],
+    'scan_min_size': 0,
+    'scan_min_age': 0,
+
+    # Stage 0 sources are taken batch_size at a time (None for all at once). Each batch goes through every stage,
+    # and MKVs are only built for the batch being processed
+    'batch_size': None,
+
+    # What to do with stage 0 sources whose fingerprint (size, head/middle/tail hashes, stream layout) matches one
+    # already processed or another in the same batch: 'skip' them, 'flag' them and carry on, or None to not check.
+    # Checking costs an extra ffprobe and a few MB of reads per source, so it's off unless asked for
+    'duplicates': None,
+    'fingerprint_index': 'resources/fingerprints.json',
+
+    # Library stream inventory (see inventory.py), kept as NumPy arrays in a single .npz file
+    'inventory': 'resources/inventory.npz',
+
+    # Daemon mode (driver.py --daemon): how long a new file's size must stay the same before it's picked up, and
+    # whether to watch with inotify or rescan every watch_interval seconds
+    'watch_settle': 10,
+    'watch_inotify': True,
+    'watch_interval': 30,
+
+    # Journal every title's progress after each stage so a restarted driver resumes where it stopped. None disables
+    'journal': 'resources/journal.jsonl',
+
+    # Titles that need a decision (no title, several audio streams, ambiguous metadata) are either parked in
+    # intervention_queue until someone runs `driver.py answer` ('queue'), or prompted for on the spot ('prompt').
+    # Daemon mode always uses the queue, since nobody is there to answer a prompt
+    'interventions': 'prompt',
+    'intervention_queue': 'resources/interventions.json',
+
+    # How often (seconds) daemon mode looks for answered interventions to pick back up
+    'intervention_poll': 60,
+
+    # Compare every stage 0 and stage 2 output against its source(s) before the source is thrown away
+    'verify': True,
+
+    # How far (in seconds) a stream duration may drift between source and output before we call it truncated
+    'verify_duration_tolerance': 0.5,
+
+    # Number of random keyframes to decode and compare with the source on top of the index check. 0 disables
+    'verify_samples': 0,
+
+    # Length (in seconds) of each decoded window and the seed used to pick them (None for a fresh pick every run)
+    'verify_sample_window': 2.0,
+    'verify_sample_seed': None,
+
+    # Hash every copied stream during the stage 0 and stage 2 remux (ffmpeg streamhash muxer) and make
+    # sure stage 2 didn't change anything stage 0 wrote
+    'stream_hashes': False,
+
+    # Drop a review bundle (contact sheet, audio snippets, stream table) next to every mkv that lands in 3_review
+    'review_bundle': True,
+    'review_grid': (4, 4),
+
+    # Where the audio snippets are cut (fractions of the total duration) and how long each one is (seconds)
+    'review_snippet_offsets': [0.25, 0.5, 0.75],
+    'review_snippet_length': 10.0,
+
+    # Scratch tier for small intermediates (the stereo mix), e.g. '/dev/shm/mkvremux' or a local SSD. None disables.
+    # Once scratch_cap bytes are in use, intermediates go to the stage directories like usual
+    'scratch': None,
+    'scratch_cap': 4 * 1024 ** 3,
+
+    # Page cache hygiene: readahead hints for the next input, evict inputs and outputs once a stage commits
+    'cache_hints': True,
+
+    # Optional wrapper the ffmpeg/qaac children are launched with to keep them from filling the page cache
+    # themselves, e.g. ['nocache']. None disables
+    'drop_behind': None,
+
+    # Local directory that the next stage 0 source gets copied to while the current job runs, for when 0_analyze
+    # is on network storage. The copy is capped at staging_bwlimit bytes per second (None for no cap)
+    'staging': None,
+    'staging_bwlimit': None,
+
+    # Cross device moves: hash both copies before deleting the source, and refuse any move that would leave less
+    # than transfer_reserve bytes free on the target
+    'transfer_verify_hash': False,
+    'transfer_reserve': 1024 ** 3,
+
+    # Background offload: finished outputs (and their review bundles) go to offload_library, archived originals go
+    # to offload_archive, overlapped with processing. Each move is hash checked, capped at offload_bwlimit bytes per
+    # second (None for no cap) and tried offload_retries times. None leaves the files where they are
+    'offload_library': None,
+    'offload_archive': None,
+    'offload_bwlimit': None,
+    'offload_retries': 3,
+
+    # Once an archive's disk is fuller than this fraction, archived originals whose output passed verification are
+    # deleted (oldest first) until it isn't. Checked every archive_interval seconds. None keeps everything
+    'archive_high_water': None,
+    'archive_interval': 60,
+
+    # Compare the stereo mix with the original audio track after stage 2 and fail the title if they are more
+    # than sync_threshold seconds apart. Needs numpy
+    'sync_check': False,
+    'sync_threshold': 0.04,
+    'sync_windows': 5,
+    'sync_window_length': 20.0,
+}
+
+
+def resource_path(path: Union[str, pathlib.Path, None]) -> Optional[pathlib.Path]:
+    """ A resource path from the settings, resolved against settings['resource_dir'] if it's relative """
+    if path is None:
+        return None
+
+    path = pathlib.Path(path)
+    if path.is_absolute():
+        return path
+    return pathlib.Path(settings['resource_dir'] or settings['roots'][0]).joinpath(path)
@@ -1,14 +1,18 @@
 import os
 import json
-import shutil
 import pathlib
 from subprocess import run, PIPE, DEVNULL
 from typing import Union
 
-import regex
-
+from mkvremux import archive, cache, fingerprint, offload, review, transfer, verify
+from mkvremux.catalog import ambiguous, get_catalog
+from mkvremux.config import settings
 from mkvremux.mkvstream import MKVStream
-from mkvremux.state import State, stages
+from mkvremux.provider import get_provider
+from mkvremux.scheduler import STEREO_MIX_RATE
+from mkvremux.scratch import get_scratch
+from mkvremux.state import State, stages, partial_path
+from mkvremux.verify import container_duration
 
 __author__ = 'Frank Woodall'
 __project__ = 'mkvremux'
@@ -56,6 +60,13 @@ class MKV:
         # Metadata
         self.metadata = None
 
+        # Content fingerprint of the source, and where we've seen it before (see fingerprint.py)
+        self.fingerprint = None
+        self.duplicate_of = None
+
+        # Page cache metrics for the current stage, taken before and after it runs
+        self.cache_stats = {}
+
     @property
     def media_title(self):
         return self._title
@@ -302,8 +313,8 @@ class MKV:
         def cmd_stage_0():
             """ Build the command for the stage_0 -> stage_1 transition """
             commands = []
-            in_file = self.state.cur_dir.joinpath(self.state.cur_fname)
-            out_file = self.state.cur_dir.joinpath(self.state.out_fname)
+            in_file = self.state.read_path
+            out_file = self.state.plan_output('mkv', self.state.out_fname)
 
             cmd_list = ['ffmpeg', '-hide_banner', '-i', str(in_file)]
 
@@ -333,7 +344,13 @@ class MKV:
             # Copy without transcoding
             cmd_list += ['-c', 'copy']
 
-            cmd_list += [str(out_file)]
+            # Output has a temporary name, so the muxer has to be named explicitly
+            cmd_list += ['-f', 'matroska', str(out_file)]
+
+            # Fingerprint every copied stream in the same pass
+            if settings['stream_hashes']:
+                cmd_list += self._hash_output(['0:{}'.format(_) for _ in self._stage_0_indices()])
+
             commands.append(cmd_list)
 
             return commands
@@ -346,7 +363,8 @@ class MKV:
 
             commands = []
             in_file = self.state.cur_path
-            out_file = self.state.assoc_files['stereo_mix']
+            mix = self.state.assoc_files['stereo_mix']
+            out_file = self.state.plan_output('stereo_mix', mix.name, mix.parent)
 
             cmd_list = ['ffmpeg', '-hide_banner', '-i', str(in_file)]
 
@@ -385,8 +403,7 @@ class MKV:
             commands = []
             in_file = self.state.cur_path
             stereo_mix = self.state.assoc_files['stereo_mix']
-            out_name = '{} ({}){}'.format(self.metadata['title'], self.metadata['year'], self.state.ext)
-            out_file = self.state.cur_dir.joinpath(out_name)
+            out_file = self.state.plan_output('mkv', self._titled_fname())
 
             cmd_list = ['ffmpeg', '-hide_banner', '-i', str(in_file)]
 
@@ -416,8 +433,13 @@ class MKV:
             # Set stereo mix to _not_  be default audio
             cmd_list += ['-disposition:a:1', 'none']
 
-            # And set the output file
-            cmd_list += [str(out_file)]
+            # And set the output file. It has a temporary name, so the muxer has to be named explicitly
+            cmd_list += ['-f', 'matroska', str(out_file)]
+
+            # Fingerprint every copied stream in the same pass
+            if settings['stream_hashes']:
+                cmd_list += self._hash_output(['0', '1'])
+
             commands.append(cmd_list)
             return commands
 
@@ -450,40 +472,194 @@ class MKV:
             self.state.out_dir = self.state.out_dir
 
     def _set_metadata(self):
-        r_template = '({}){{e<3}}'
-        r_str = r_template.format(self.media_title)
-
-        hit = False
-
-        # Load the data from json file
-        with open('resources\movie_details.json', 'r') as md:
-            movie_data = json.load(md)
-
-        # Attempt a perfect match first
-        for movie in movie_data['Movies']:
-            if self.media_title == movie['title']:
-                self.metadata = movie
-                hit = True
-                print('Perfect Name Match!')
-                from pprint import pprint
-                pprint(self.metadata)
-                break
-
-        # If that didn't work, attempt a fuzzy match
-        if not hit:
-            for movie in movie_data['Movies']:
-                # Do a fuzzy match
-                if regex.match(r_str, movie.get('title')):
-                    self.metadata = movie
-                    print('METADATA SET TO: ')
-                    from pprint import pprint
-                    pprint(self.metadata)
-                    break
+        # Already resolved along with the rest of the batch (see catalog.resolve)
+        if self.metadata is not None:
+            return
+
+        # Loaded once per process and indexed, see catalog.py
+        movies = get_catalog()
+
+        # Attempt a perfect (or normalized) match first. Two movies by that name is as good as a tie
+        hits = movies.matches(self.media_title)
+        if len(hits) > 1:
+            raise RuntimeError('Ambiguous metadata match', [(_['title'], _.get('year'), 0) for _ in hits])
+
+        self.metadata = hits[0] if hits else None
+        if self.metadata is not None:
+            print('Perfect Name Match!')
+
+        # If that didn't work, attempt a fuzzy match. Never guess between equally good ones
+        else:
+            candidates = movies.fuzzy(self.media_title, max_distance=settings['fuzzy_max_distance'])
+            if ambiguous(candidates):
+                raise RuntimeError('Ambiguous metadata match', [(_.movie['title'], _.movie.get('year'), _.distance)
+                                                                for _ in candidates])
+            if candidates:
+                self.metadata = candidates[0].movie
+                print('METADATA SET TO (distance {}): '.format(candidates[0].distance))
+
+        # Last resort, ask the metadata provider. Whatever it finds goes into the catalog for next time
+        provider = get_provider()
+        if self.metadata is None and provider is not None:
+            self.metadata = provider.fetch([self.media_title])[self.media_title]
+            if self.metadata is not None:
+                movies.add([self.metadata])
+                print('METADATA FETCHED: ')
 
         # Sanity check
         if self.metadata is None:
             raise Exception('Movie missing from movie_details.json')
 
+        from pprint import pprint
+        pprint(self.metadata)
+
+    def _titled_fname(self):
+        """ The final filename of the mkv once metadata is known, e.g. 'Title (Year).mkv' """
+        return '{} ({}){}'.format(self.metadata['title'], self.metadata['year'], self.state.ext)
+
+    def _stage_0_indices(self):
+        """ Indices of the streams copied at stage 0, in the order they are mapped """
+        return self.video.copy_indices[:1] + self.audio.copy_indices[:1] + self.subs.copy_indices
+
+    def _hash_output(self, maps):
+        """ Build an extra ffmpeg output that hashes every mapped stream while it's being copied.
+
+            This rides along on the remux itself, so we get a fingerprint of each stream
+            without reading the file a second time.
+
+            :param list maps: -map specifiers, in the same order as the real output
+            :return list: ffmpeg args to append after the real output file
+        """
+        sidecar = self.state.cur_dir.joinpath(self.state.clean_name + '.streamhash')
+        self.state.assoc_files['stream_hashes'] = sidecar
+
+        args = []
+        for m in maps:
+            args += ['-map', m]
+
+        return args + ['-c', 'copy', '-f', 'streamhash', '-hash', 'sha256', str(sidecar)]
+
+    def release_scratch(self):
+        """ Give back the scratch room reserved for the stereo mix of a title that stops here.
+
+            A half-written mix is removed. A finished one is left for the next attempt at stage 2
+        """
+        scratch = get_scratch()
+        mix = self.state.assoc_files.get('stereo_mix')
+        if scratch is None or mix is None or not scratch.contains(mix):
+            return
+
+        partial = partial_path(mix)
+        if partial.exists():
+            partial.unlink()
+        scratch.release(mix)
+
+    def _discard_stream_hashes(self):
+        """ Remove the stream hash sidecar of a stage that didn't make it """
+        sidecar = self.state.assoc_files.pop('stream_hashes', None)
+        if sidecar is not None and sidecar.exists():
+            sidecar.unlink()
+
+    def _collect_stream_hashes(self):
+        """ Read the stream hashes written during this stage and store them on the state.
+
+            Stage 2 copies every stream of the stage 0 output before adding the stereo mix, so the
+            leading stream hashes of both stages have to agree. If they don't, something changed
+            the data along the way.
+
+            :raises RuntimeError if a stream that should have been copied untouched was changed
+        """
+        sidecar = self.state.assoc_files.pop('stream_hashes', None)
+        if sidecar is None:
+            return
+
+        # One line per stream, e.g. '0,v,SHA256=...'
+        hashes = {}
+        with open(str(sidecar), 'r') as f:
+            for line in f:
+                fields = line.strip().split(',')
+                if len(fields) == 3:
+                    hashes[int(fields[0])] = fields[2]
+        sidecar.unlink()
+
+        self.state.stream_hashes[self.stage] = hashes
+
+        if self.stage == stages.STAGE_2 and stages.STAGE_0 in self.state.stream_hashes:
+            changed = [index for index, digest in self.state.stream_hashes[stages.STAGE_0].items()
+                       if hashes.get(index) != digest]
+            if changed:
+                raise RuntimeError('Stream hashes changed between stages', changed)
+
+    def _check_sync(self):
+        """ Make sure muxing in the stereo mix didn't shift it against the original audio track.
+
+            :raises RuntimeError if the measured offset is over the threshold
+        """
+        # numpy is only needed for this check
+        from mkvremux import avsync
+
+        out_file = partial_path(self.state.pending['mkv'])
+        offset, offsets = avsync.measure_offset(out_file, settings['sync_windows'], settings['sync_window_length'])
+
+        if abs(offset) > settings['sync_threshold']:
+            raise RuntimeError('Audio out of sync', offsets)
+
+    def _verify_output(self):
+        """ Make sure the output of this stage carries every packet of the streams it was built from.
+
+            Only stage 0 and stage 2 produce an mkv from another mkv. Stage 1 output is a new encode
+            and can't be compared this way.
+
+            :raises RuntimeError if the output doesn't match its source(s)
+        """
+        if self.stage == stages.STAGE_0:
+            in_file = self.state.read_path
+            out_file = partial_path(self.state.pending['mkv'])
+
+            sources = [(in_file, self._stage_0_indices())]
+
+        elif self.stage == stages.STAGE_2:
+            out_file = partial_path(self.state.pending['mkv'])
+
+            # cmd_stage_2 maps every stream of both inputs
+            sources = [(self.state.cur_path, None), (self.state.assoc_files['stereo_mix'], None)]
+
+        else:
+            return
+
+        mismatches = verify.verify_remux(out_file, sources, settings['verify_duration_tolerance'])
+
+        # Index totals can't see a corrupt packet. Optionally decode a few windows to catch those too
+        if not mismatches and settings['verify_samples'] > 0:
+            mismatches = verify.verify_samples(out_file, sources, settings['verify_samples'],
+                                               settings['verify_sample_window'], settings['verify_sample_seed'])
+
+        if mismatches:
+            raise RuntimeError('Output verification failed', mismatches)
+
+    def _move(self, src, dst):
+        """ Move a file between processing directories. See transfer.move() """
+        return transfer.move(src, dst, verify_hash=settings['transfer_verify_hash'],
+                             reserve=settings['transfer_reserve'])
+
+    def _move_target(self):
+        """ Where post_process() moves the source of this stage, or None if it stays where it is """
+        if self.stage == stages.STAGE_0:
+            return self.state.root.joinpath('_archive', self.state.cur_fname)
+        if self.stage == stages.STAGE_1:
+            return self.state.out_dir.joinpath(self.state.cur_fname)
+        return None
+
+    def commit_outputs(self):
+        """ Give every output of this stage its real name.
+
+            Outputs were written straight into the next stage directory under a temporary name, so
+            this is just a rename. Finished data never has to be moved again.
+        """
+        for final in self.state.pending.values():
+            os.replace(str(partial_path(final)), str(final))
+        self.state.pending = {}
+
     def rename_original(self):
         """ Rename the original file to orig_<filename>.
 
@@ -491,18 +667,40 @@ class MKV:
         without having to worry about name collisions and, in the event
         of a processing failure, clearly indicates the original file."""
 
+        # Already renamed by an earlier run that got deferred or interrupted
+        if self.state.init_path.name.startswith('orig_'):
+            self.state.cur_path = self.state.init_path
+            return
+
         target = self.state.init_path.parent.joinpath('orig_' + self.state.init_path.name)
+
+        # Renamed before the title was parked for an intervention (see interventions.py)
+        if target.exists() and not self.state.init_path.exists():
+            self.state.cur_path = target
+            return
+
         self.state.init_path.rename(target)
         self.state.cur_path = target
 
     def pre_process(self):
         if self.stage == stages.STAGE_0:
             self.rename_original()
-            self._analyze()
+
+            # Titles coming back from the intervention queue were analyzed before they were parked
+            if self.video is None:
+                self._analyze()
 
         if self.stage == stages.STAGE_1:
-            mix_path = self.state.cur_dir.joinpath(self.state.clean_name + '.m4a')
-            self.state.assoc_files['stereo_mix'] = mix_path
+            mix_name = self.state.clean_name + '.m4a'
+            mix_path = None
+
+            # Keep the stereo mix off the disk the big files are streaming to, if there's room
+            scratch = get_scratch()
+            if scratch is not None:
+                size = container_duration(self.state.cur_path) * STEREO_MIX_RATE
+                mix_path = scratch.reserve(mix_name, size)
+
+            self.state.assoc_files['stereo_mix'] = mix_path or self.state.out_dir.joinpath(mix_name)
 
         if self.stage == stages.STAGE_2:
             self._set_metadata()
@@ -514,63 +712,154 @@ class MKV:
          Post-Processing should only happen for MKVs that successfully completed the
          command execution step.
         """
+        # (path, destination) to hand to the offload queue at the end
+        offloads = []
 
         if self.stage == stages.STAGE_0:
             # Move original MKV to the archive
-            archive = self.state.root.joinpath('_archive')
-            shutil.move(str(self.state.cur_path), str(archive))
+            archive_dir = self.state.root.joinpath('_archive')
+            self._move(str(self.state.cur_path), str(archive_dir))
+            archive.get_archive(self.state.root).add(archive_dir.joinpath(self.state.cur_fname), self.state.clean_name)
 
-            # Update current path to point to newly generated mkv
-            self.state.cur_path = self.state.cur_dir.joinpath(self.state.clean_name + self.state.ext)
+            # New mkv was already written into the next stage directory
+            touched = [archive_dir.joinpath(self.state.cur_fname), self.state.out_dir.joinpath(self.state.out_fname)]
+            offloads.append((archive_dir.joinpath(self.state.cur_fname), 'archive'))
 
-            # Move new mkv to next stage directory
-            shutil.move(str(self.state.cur_path), str(self.state.out_dir))
+            # Remember this source so the same rip isn't processed again
+            index = fingerprint.get_index()
+            if index is not None and self.fingerprint is not None:
+                index.add(self.fingerprint, archive_dir.joinpath(self.state.cur_fname))
 
         elif self.stage == stages.STAGE_1:
-            # Move both files to next stage directory
-            shutil.move(str(self.state.cur_path), str(self.state.out_dir))
-            shutil.move(str(self.state.assoc_files['stereo_mix']), str(self.state.out_dir))
+            # Stereo mix was written straight into the next stage directory. Only the mkv has to follow it
+            self._move(str(self.state.cur_path), str(self.state.out_dir))
+            touched = [self.state.out_dir.joinpath(self.state.cur_fname), self.state.assoc_files['stereo_mix']]
 
         elif self.stage == stages.STAGE_2:
-            # Update current path to point to newly generated mkv
-            out_name = '{} ({}){}'.format(self.metadata['title'], self.metadata['year'], self.state.ext)
-            self.state.cur_path = self.state.cur_dir.joinpath(out_name)
-
-            # Move final product into next stage directory
-            shutil.move(str(self.state.cur_path), str(self.state.out_dir))
-
-            # Clean up artifacts
-            self.state.assoc_files.pop('stereo_mix')
-            artifacts = [self.state.cur_dir.joinpath(self.state.clean_name + '.mkv'),
-                         self.state.cur_dir.joinpath(self.state.clean_name + '.m4a')]
+            # Final product was already written into the next stage directory
+            touched = [self.state.out_dir.joinpath(self._titled_fname())]
+            finished = list(touched)
+
+            # Output made it through verification. Its original is now fair game for eviction
+            if settings['verify']:
+                archive.get_archive(self.state.root).mark_verified(self.state.clean_name, touched[0])
+
+            # Give the reviewer something quicker to look at than the whole file. It's only a preview,
+            # so failing to build it must not leave the title stuck halfway through the transition
+            if settings['review_bundle']:
+                columns, rows = settings['review_grid']
+                try:
+                    finished += review.build_bundle(self.state.out_dir.joinpath(self._titled_fname()), columns,
+                                                    rows, offsets=settings['review_snippet_offsets'],
+                                                    length=settings['review_snippet_length'])
+                except (RuntimeError, OSError) as exc:
+                    print('  Could not build review bundle for {}: {}'.format(self._titled_fname(), exc))
+
+            # Clean up artifacts. The stereo mix may live in scratch
+            mix = self.state.assoc_files.pop('stereo_mix')
+            artifacts = [self.state.cur_dir.joinpath(self.state.clean_name + '.mkv'), mix]
             for item in artifacts:
                 item.unlink()
 
+            scratch = get_scratch()
+            if scratch is not None:
+                scratch.release(mix)
+
+            # Off to the library, in the background
+            offloads += [(_, 'library') for _ in finished]
+
+        else:
+            touched = []
+
+        # Nothing we just read or wrote is going to be needed again any time soon
+        if settings['cache_hints']:
+            self.cache_stats['after'] = cache.snapshot(touched)
+            cache.drop(touched)
+            self._report_cache()
+
+        # Only once we're done with them. An offload to the same device is an instant rename
+        for item, destination in offloads:
+            offload.enqueue(item, destination)
+
         # Finally, complete the transition to the next stage
         self.stage += 1
 
+    def _report_cache(self):
+        """ Print the page cache metrics of the stage that just finished """
+        before = self.cache_stats.get('before')
+        after = self.cache_stats.get('after')
+        if not before or not after:
+            return
+
+        hits = [_ for _ in before['resident'].values() if _ >= 0]
+        print('  Page cache: input {:.0%} cached at start | page cache {} kB before, {} kB after'.format(
+            sum(hits) / len(hits) if hits else 0, before['cached_kb'], after['cached_kb']))
+
+    def _inputs(self):
+        """ Every file the current stage reads """
+        inputs = [self.state.read_path]
+        if self.stage == stages.STAGE_2:
+            inputs.append(self.state.assoc_files['stereo_mix'])
+        return inputs
+
+    def _wrap(self, cmd):
+        """ Launch children under the drop-behind helper, if there is one """
+        if settings['drop_behind']:
+            return list(settings['drop_behind']) + cmd
+        return cmd
+
     def run_commands(self):
         """ Run the commands to transition to the next stage. """
 
         self._set_command()
 
-        # Stage 1 is a two parter and handled a bit differently
-        if self.stage == stages.STAGE_1:
-            cmd_mix = self.cmd_list[0]
-            cmd_encode = self.cmd_list[1]
+        # Measure before our own prefetch, or the hit rate would mostly be counting ourselves
+        if settings['cache_hints']:
+            self.cache_stats = {'before': cache.snapshot(self._inputs())}
+            for path in self._inputs():
+                cache.prefetch(path)
 
-            mix = run(cmd_mix, stdout=PIPE, stderr=PIPE)
-            if mix.returncode != 0:
-                raise RuntimeError('Issue creating stereo mix for mkv', mix)
+        try:
+            # Stage 1 is a two parter and handled a bit differently
+            if self.stage == stages.STAGE_1:
+                cmd_mix = self.cmd_list[0]
+                cmd_encode = self.cmd_list[1]
 
-            encode = run(cmd_encode, input=mix.stdout, stderr=PIPE)
-            if encode.returncode != 0:
-                raise RuntimeError('Issue encoding stereo mix', encode)
+                mix = run(self._wrap(cmd_mix), stdout=PIPE, stderr=PIPE)
+                if mix.returncode != 0:
+                    raise RuntimeError('Issue creating stereo mix for mkv', mix)
 
-        # For all other stages, there's only a single command
-        else:
-            cmd = self.cmd_list[0]
-            ret = run(cmd, stdout=PIPE, stderr=PIPE)
+                encode = run(self._wrap(cmd_encode), input=mix.stdout, stderr=PIPE)
+                if encode.returncode != 0:
+                    raise RuntimeError('Issue encoding stereo mix', encode)
 
-            if ret.returncode != 0:
-                raise RuntimeError('Issue executing commands for mkv', ret)
+            # For all other stages, there's only a single command
+            else:
+                cmd = self.cmd_list[0]
+                ret = run(self._wrap(cmd), stdout=PIPE, stderr=PIPE)
+
+                if ret.returncode != 0:
+                    raise RuntimeError('Issue executing commands for mkv', ret)
+
+            # Don't let post-processing throw away a source until we know the output is whole
+            if settings['verify']:
+                self._verify_output()
+
+            if settings['stream_hashes']:
+                self._collect_stream_hashes()
+
+            if settings['sync_check'] and self.stage == stages.STAGE_2:
+                self._check_sync()
+
+            # post_process() won't clobber anything. Find out now, while the outputs can still be thrown away
+            target = self._move_target()
+            if target is not None and target.exists():
+                raise RuntimeError('Destination already exists', str(self.state.cur_path), str(target))
+
+        except Exception:
+            # The sidecar lives next to the input, where clean_partials() won't find it
+            self._discard_stream_hashes()
+            raise
+
+        # Everything checked out. Outputs get their real names
+        self.commit_outputs()
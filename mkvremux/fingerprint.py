@@ -0,0 +1,111 @@
+""" Cheap content fingerprints for spotting sources we've already handled.
+
+    Hashing a whole 40 GB rip to find out it's the one we remuxed last week would take longer than
+    just remuxing it again. A fingerprint only reads a few MB: the size, a hash of a chunk at the
+    head, middle and tail of the file, and the stream layout ffprobe reports from the header. That
+    is plenty to tell two rips apart, and takes milliseconds.
+
+    Every source that makes it through stage 0 is recorded in a persistent index, and get_mkvs()
+    uses it to skip (or flag) duplicates before any analysis happens.
+"""
+import os
+import json
+import hashlib
+import pathlib
+import threading
+import time
+from subprocess import run, PIPE, DEVNULL
+from typing import Optional
+
+from mkvremux.config import settings, resource_path
+from mkvremux.state import partial_path
+
+# Bytes hashed at each of head, middle and tail
+CHUNK = 4 * 1024 * 1024
+
+
+def stream_layout(path: pathlib.Path) -> str:
+    """ Codec, type, channels and resolution of every stream, as read from the header """
+    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'stream=codec_type,codec_name,channels,width,height',
+           '-of', 'compact=p=0:nk=1', str(path)]
+    try:
+        ret = run(cmd, stdout=PIPE, stderr=DEVNULL)
+    except OSError:
+        return ''
+    return ret.stdout.decode(errors='replace').strip() if ret.returncode == 0 else ''
+
+
+def fingerprint(path: pathlib.Path, chunk: int = CHUNK, probe: bool = True) -> str:
+    """ Fingerprint a file
+
+    :param path:    The file
+    :param chunk:   Bytes hashed at each of head, middle and tail
+    :param probe:   Include the stream layout
+    :return str:    '<size>:<sha1 of the chunks and layout>'
+    """
+    size = os.path.getsize(str(path))
+    digest = hashlib.sha1()
+
+    with open(str(path), 'rb') as f:
+        for offset in sorted({0, max(0, size // 2 - chunk // 2), max(0, size - chunk)}):
+            f.seek(offset)
+            digest.update(f.read(chunk))
+
+    if probe:
+        digest.update(stream_layout(path).encode())
+
+    return '{}:{}'.format(size, digest.hexdigest())
+
+
+class FingerprintIndex:
+    """ Persistent record of every source the pipeline has handled
+
+        Instance Attributes
+        ====================
+
+        path        The index file
+        entries     {fingerprint: {'path', 'added'}}
+    """
+
+    def __init__(self, path: pathlib.Path):
+        """ Constructor for FingerprintIndex """
+        self.path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        try:
+            with open(str(self.path), 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, fp: str) -> Optional[str]:
+        """ Where a fingerprint was seen before, or None """
+        entry = self.entries.get(fp)
+        return entry['path'] if entry else None
+
+    def add(self, fp: str, path: pathlib.Path):
+        """ Record a source as handled """
+        with self._lock:
+            self.entries[fp] = {'path': str(path), 'added': time.time()}
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = partial_path(self.path)
+            with open(str(tmp), 'w') as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(str(tmp), str(self.path))
+
+
+_index = None
+
+
+def get_index() -> Optional[FingerprintIndex]:
+    """ The process wide fingerprint index, or None if duplicate detection is off """
+    global _index
+
+    if not settings['duplicates']:
+        return None
+
+    path = resource_path(settings['fingerprint_index'])
+    if _index is None or _index.path != path:
+        _index = FingerprintIndex(path)
+
+    return _index
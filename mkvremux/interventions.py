@@ -0,0 +1,178 @@
+""" Queue of titles waiting on a human.
+
+    Asking for input in the middle of pre-processing means an overnight run with a single
+    untitled rip just sits on a prompt until morning, and every other title waits behind it. With
+    the queue, a title that needs a decision is parked instead: everything needed to rebuild it
+    (see journal.snapshot) goes into the queue along with what the operator needs to decide
+    (the stream table, candidate titles, ...), and the rest of the batch carries on.
+
+    `python driver.py answer` walks through the queue whenever someone gets around to it.
+    Answered titles are picked back up by the driver and continue from where they were parked.
+    An entry only leaves the queue once its title has committed the next stage, so an answer
+    isn't lost if the driver stops in between.
+"""
+import os
+import json
+import time
+import pathlib
+import threading
+from typing import List, Optional
+
+from mkvremux.catalog import get_catalog
+from mkvremux.config import settings, resource_path
+from mkvremux.journal import snapshot
+from mkvremux.state import partial_path
+
+
+def stream_table(streams: List[dict]) -> List[dict]:
+    """ The parts of each stream someone picking one would look at """
+    return [{
+        'index': _.get('index'),
+        'codec': _.get('codec_name'),
+        'channels': _.get('channels'),
+        'layout': _.get('channel_layout'),
+        'language': _.get('tags', {}).get('language'),
+        'title': _.get('tags', {}).get('title'),
+        'default': _.get('disposition', {}).get('default'),
+    } for _ in streams]
+
+
+def context(mkv, reason: str, candidates: list = None) -> dict:
+    """ What the operator needs to see to resolve an intervention
+
+    :param mkv:         The parked MKV
+    :param reason:      'no_title', 'audio_stream' or 'metadata'
+    :param candidates:  Candidate catalog entries, for 'metadata'
+    """
+    info = {'path': str(mkv.state.cur_path), 'title': mkv.media_title}
+
+    if reason == 'audio_stream':
+        info['streams'] = stream_table(mkv.audio.streams)
+
+    elif reason == 'no_title':
+        # Best guesses from the file name, if the catalog has any
+        guess = mkv.state.init_path.stem.replace('.', ' ').replace('_', ' ')
+        try:
+            info['candidates'] = [_.movie for _ in get_catalog().fuzzy(guess)]
+        except OSError:
+            info['candidates'] = []
+
+    elif reason == 'metadata':
+        info['candidates'] = candidates or []
+
+    return info
+
+
+class InterventionQueue:
+    """ Persistent queue of parked titles
+
+        Instance Attributes
+        ====================
+
+        path        The queue file
+        entries     {key: {'key', 'path', 'reason', 'context', 'intervene', 'record', 'created', 'answer'}}
+        taken       Keys of answered entries already handed out by this process
+    """
+
+    def __init__(self, path: pathlib.Path):
+        """ Constructor for InterventionQueue """
+        self.path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        self.entries = self._load()
+        self.taken = set()
+
+    def _load(self) -> dict:
+        try:
+            with open(str(self.path), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = partial_path(self.path)
+        with open(str(tmp), 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(str(tmp), str(self.path))
+
+    def reload(self):
+        """ Pick up answers written by another process (the answer command) """
+        with self._lock:
+            self.entries = self._load()
+
+    def park(self, mkv, reason: str, info: dict):
+        """ Put a title in the queue until someone decides for it """
+        with self._lock:
+            key = str(mkv.state.init_path)
+            self.entries[key] = {
+                'key': key,
+                'path': str(mkv.state.cur_path),
+                'reason': reason,
+                'context': info,
+                'intervene': mkv.intervene,
+                'record': snapshot(mkv),
+                'created': time.time(),
+                'answer': None
+            }
+            self.taken.discard(key)
+            self._save()
+
+    def parked(self, path: pathlib.Path) -> bool:
+        """ True if a title (by its original or current path) is waiting in the queue """
+        path = str(path)
+        return any(path in (_['key'], _['path']) for _ in self.entries.values())
+
+    def pending(self) -> List[dict]:
+        """ Every entry still waiting on an answer, oldest first """
+        return sorted((_ for _ in self.entries.values() if _['answer'] is None), key=lambda _: _['created'])
+
+    def answer(self, key: str, answer: str):
+        """ Record the decision for a parked title """
+        with self._lock:
+            self.entries = self._load()
+            self.entries[key]['answer'] = answer
+            self._save()
+
+    def take_answered(self) -> List[dict]:
+        """ Every answered entry not handed out yet. They stay in the queue until done() """
+        with self._lock:
+            self.entries = self._load()
+            answered = [_ for _ in self.entries.values() if _['answer'] is not None and _['key'] not in self.taken]
+            self.taken.update(_['key'] for _ in answered)
+        return answered
+
+    def done(self, key: str):
+        """ Remove a title's entry once it has committed the stage after its answer. Anything else is left alone """
+        with self._lock:
+            self.entries = self._load()
+            if self.entries.pop(key, None) is not None:
+                self._save()
+            self.taken.discard(key)
+
+    def carried_on(self, mkv) -> bool:
+        """ True if an answered title was journaled past the stage it was parked at, i.e. the driver stopped
+            before done(). Its entry is removed
+        """
+        key = str(mkv.state.init_path)
+        entry = self.entries.get(key)
+        if entry is None or entry['answer'] is None or entry['record']['stage'] >= mkv.stage:
+            return False
+        self.done(key)
+        return True
+
+
+_queue = None
+
+
+def get_queue() -> Optional[InterventionQueue]:
+    """ The process wide intervention queue, or None if interventions are prompted for inline """
+    global _queue
+
+    if settings['interventions'] != 'queue':
+        return None
+
+    path = resource_path(settings['intervention_queue'])
+    if _queue is None or _queue.path != path:
+        _queue = InterventionQueue(path)
+
+    return _queue
@@ -0,0 +1,238 @@
+""" Library wide stream inventory.
+
+    Answers questions like "which titles have forced subs but no English audio" or "how many
+    DTS-HD sources are over 50 GB" without an ffprobe loop over the whole library every time.
+
+    scan() walks the library and only probes files that are new or changed (size or mtime) since
+    the last scan. Every stream becomes a row in a NumPy structured array with the attributes the
+    pipeline already looks at in MKVStream (codec, channels, language, title, disposition, ...),
+    next to a second array with one row per file. Both live in a single .npz file.
+
+    Queries are plain vectorized comparisons over those columns:
+
+        inv = Inventory.load('resources/inventory.npz')
+        forced = inv.files(kind='subtitle', forced=True)
+        english = inv.files(kind='audio', language='eng')
+        inv.paths(np.setdiff1d(forced, english))
+
+        inv.files(kind='audio', profile='DTS-HD MA', size=lambda _: _ > 50e9)
+
+    Requires numpy.
+"""
+import os
+import sys
+import json
+import pathlib
+from subprocess import run, PIPE, DEVNULL
+from typing import Iterable, List, Union
+
+import numpy as np
+
+from mkvremux import utils
+from mkvremux.config import settings, resource_path
+
+FILE_DTYPE = np.dtype([
+    ('path', 'U512'),
+    ('size', 'i8'),
+    ('mtime', 'f8'),
+])
+
+STREAM_DTYPE = np.dtype([
+    ('file', 'i4'),
+    ('index', 'i2'),
+    ('kind', 'U10'),
+    ('codec', 'U24'),
+    ('profile', 'U24'),
+    ('channels', 'i2'),
+    ('layout', 'U24'),
+    ('width', 'i4'),
+    ('height', 'i4'),
+    ('language', 'U8'),
+    ('title', 'U64'),
+    ('default', '?'),
+    ('forced', '?'),
+    ('bytes', 'i8'),
+])
+
+
+def file_dtype(paths: List[str]) -> np.dtype:
+    """ FILE_DTYPE, widened if needed so that none of the paths get cut short """
+    width = max([512] + [len(_) for _ in paths])
+    return np.dtype([('path', 'U{}'.format(width))] + [(_, FILE_DTYPE[_]) for _ in FILE_DTYPE.names[1:]])
+
+
+def probe(path: pathlib.Path) -> List[dict]:
+    """ Every stream of a file, as ffprobe reports it """
+    cmd = ['ffprobe', '-v', 'error', '-show_streams', '-print_format', 'json', str(path)]
+    ret = run(cmd, stdout=PIPE, stderr=DEVNULL)
+    if ret.returncode != 0:
+        raise RuntimeError('Problem extracting stream data', str(path))
+    return json.loads(ret.stdout).get('streams', [])
+
+
+def _int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def stream_row(file_id: int, stream: dict) -> tuple:
+    """ One STREAM_DTYPE row from an ffprobe stream """
+    tags = stream.get('tags', {})
+    disposition = stream.get('disposition', {})
+    return (
+        file_id,
+        _int(stream.get('index')),
+        stream.get('codec_type', ''),
+        stream.get('codec_name', ''),
+        stream.get('profile', ''),
+        _int(stream.get('channels')),
+        stream.get('channel_layout', ''),
+        _int(stream.get('width')),
+        _int(stream.get('height')),
+        tags.get('language', ''),
+        tags.get('title', ''),
+        bool(disposition.get('default')),
+        bool(disposition.get('forced')),
+        _int(tags.get('NUMBER_OF_BYTES')),
+    )
+
+
+class Inventory:
+    """ Columnar store of every stream in the library
+
+        Instance Attributes
+        ====================
+
+        path        The .npz file the inventory is kept in
+        file_rows   FILE_DTYPE array (path column widened to the longest path), one row per file
+        streams     STREAM_DTYPE array, one row per stream. 'file' is a row number in file_rows
+    """
+
+    def __init__(self, path: Union[str, pathlib.Path]):
+        """ Constructor for Inventory. See Inventory.load() to read an existing one """
+        self.path = pathlib.Path(path)
+        self.file_rows = np.zeros(0, dtype=FILE_DTYPE)
+        self.streams = np.zeros(0, dtype=STREAM_DTYPE)
+
+    @classmethod
+    def load(cls, path: Union[str, pathlib.Path]) -> 'Inventory':
+        """ Read an inventory from disk (an empty one if there isn't one yet) """
+        inventory = cls(path)
+        if inventory.path.exists():
+            with np.load(str(inventory.path), allow_pickle=False) as data:
+                inventory.file_rows = data['files']
+                inventory.streams = data['streams']
+        return inventory
+
+    def save(self):
+        """ Write the inventory to disk, atomically """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + '.part.npz')
+        np.savez(str(tmp), files=self.file_rows, streams=self.streams)
+        os.replace(str(tmp), str(self.path))
+
+    def scan(self, roots: Iterable[Union[str, pathlib.Path]]) -> dict:
+        """ Bring the inventory up to date with every mkv under the given directories
+
+        :return dict:   {'probed', 'unchanged', 'removed'} counts
+        """
+        known = {path: i for i, path in enumerate(self.file_rows['path'])}
+        keep_files = []
+        new_files = []
+
+        for root in roots:
+            for entry in sorted(utils.scan(root, recursive=True), key=lambda _: _.path):
+                path = pathlib.Path(entry.path)
+                stat = entry.stat()
+                i = known.pop(str(path), None)
+                if i is not None and self.file_rows[i]['size'] == stat.st_size \
+                        and self.file_rows[i]['mtime'] == stat.st_mtime:
+                    keep_files.append(i)
+                else:
+                    new_files.append((path, stat))
+
+        # Unchanged files keep their streams, renumbered
+        keep = np.array(sorted(keep_files), dtype='i4')
+        renumber = np.full(len(self.file_rows), -1, dtype='i4')
+        renumber[keep] = np.arange(len(keep), dtype='i4')
+
+        streams = self.streams[np.isin(self.streams['file'], keep)]
+        streams['file'] = renumber[streams['file']]
+        file_rows = [tuple(_) for _ in self.file_rows[keep]]
+        stream_rows = []
+
+        probed = 0
+        for path, stat in new_files:
+            try:
+                found = probe(path)
+            except RuntimeError as exc:
+                print('  Could not probe {}: {}'.format(path, exc))
+                continue
+            file_id = len(file_rows)
+            file_rows.append((str(path), stat.st_size, stat.st_mtime))
+            stream_rows += [stream_row(file_id, _) for _ in found]
+            probed += 1
+
+        self.file_rows = np.array(file_rows, dtype=file_dtype([_[0] for _ in file_rows]))
+        self.streams = np.concatenate([streams, np.array(stream_rows, dtype=STREAM_DTYPE)])
+
+        return {'probed': probed, 'unchanged': len(keep), 'removed': len(known)}
+
+    def mask(self, **conditions) -> np.ndarray:
+        """ Streams matching every condition
+
+            A condition is a column name and either a value (equality) or a callable that takes the
+            whole column and returns a boolean array, e.g. channels=lambda _: _ >= 6. Columns of the
+            file a stream belongs to (path, size, mtime) can be used too.
+
+        :return ndarray:    Boolean mask over self.streams
+        """
+        selected = np.ones(len(self.streams), dtype=bool)
+        for column, condition in conditions.items():
+            if column in STREAM_DTYPE.names:
+                values = self.streams[column]
+            elif column in FILE_DTYPE.names:
+                values = self.file_rows[column][self.streams['file']]
+            else:
+                raise KeyError('Unknown inventory column: ' + column)
+
+            selected &= condition(values) if callable(condition) else values == condition
+        return selected
+
+    def files(self, **conditions) -> np.ndarray:
+        """ Row numbers of every file with at least one stream matching all conditions (see mask()) """
+        return np.unique(self.streams['file'][self.mask(**conditions)])
+
+    def paths(self, files: np.ndarray) -> List[str]:
+        """ Paths of the given file rows """
+        return list(self.file_rows['path'][files])
+
+    def total_size(self, files: np.ndarray) -> int:
+        """ Combined size in bytes of the given file rows """
+        return int(self.file_rows['size'][files].sum())
+
+    def count_by(self, column: str, **conditions) -> dict:
+        """ Number of matching streams per distinct value of a column, e.g. count_by('codec', kind='audio') """
+        values, counts = np.unique(self.streams[column][self.mask(**conditions)], return_counts=True)
+        return dict(zip(values.tolist(), counts.tolist()))
+
+
+def main(argv: List[str]):
+    """ python -m mkvremux.inventory [directory ...]
+
+        Scans the given directories (every processing root's 3_review by default) into
+        settings['inventory'] and prints a summary
+    """
+    roots = argv or [pathlib.Path(_).joinpath('3_review') for _ in settings['roots']]
+    inventory = Inventory.load(resource_path(settings['inventory']))
+    print(inventory.scan(roots))
+    inventory.save()
+
+    print('{} files, {} streams'.format(len(inventory.file_rows), len(inventory.streams)))
+    print(inventory.count_by('codec', kind='audio'))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,217 @@
+""" Crash-safe job journal.
+
+    Everything the pipeline learns about a title in stage 0 (title, stream selections, clean name,
+    associated files, ...) only ever lived in memory, and MKV(path, stage) can't rebuild it from a
+    directory scan. So if the driver died after stage 0, the only way back was to start over.
+
+    Every time a title finishes a stage, a snapshot of it is appended to the journal (one JSON
+    object per line, fsync'd before we move on). On startup the journal is replayed: the last
+    snapshot of every title that hasn't reached stage 3 is turned back into an MKV at the stage it
+    stopped at, without probing or encoding anything again. A torn last line from a crash mid-write
+    is simply ignored.
+
+    A snapshot is only written once the stage has committed, i.e. after its file has moved on. A
+    crash in between leaves the title a stage further along than the journal says, so a title whose
+    file is already in the next stage directory resumes from there.
+"""
+import os
+import json
+import pathlib
+import threading
+from typing import List, Optional
+
+from mkvremux import MKV
+from mkvremux.config import settings, resource_path
+from mkvremux.mkvstream import MKVStream
+from mkvremux.scratch import get_scratch
+from mkvremux.state import stages, partial_path
+
+# MKVStream attributes worth keeping
+STREAM_FIELDS = ['streams', 'copy_streams', 'copy_count', 'copy_indices', 'metadata', 'title']
+
+
+def snapshot(mkv: MKV) -> dict:
+    """ Everything needed to rebuild an MKV at its current stage """
+    streams = {}
+    for kind in ['video', 'audio', 'subs']:
+        stream = getattr(mkv, kind)
+        if stream is not None:
+            streams[kind] = dict({_: getattr(stream, _) for _ in STREAM_FIELDS}, kind=stream.kind)
+
+    return {
+        'key': str(mkv.state.init_path),
+        'stage': mkv.stage,
+        'title': mkv.media_title,
+        'clean_name': mkv.state.clean_name,
+        'assoc_files': {k: str(v) for k, v in mkv.state.assoc_files.items()},
+        'stream_hashes': mkv.state.stream_hashes,
+        'metadata': mkv.metadata,
+        'fingerprint': mkv.fingerprint,
+        'streams': streams,
+    }
+
+
+def restore(record: dict) -> MKV:
+    """ Rebuild an MKV from its snapshot. The inverse of snapshot() """
+    # Start from stage 0 so State knows its root, then jump ahead. Same as the stage tests do
+    mkv = MKV(pathlib.Path(record['key']), stages.STAGE_0)
+
+    mkv._title = record['title']
+    mkv.state.clean_name = record['clean_name']
+    mkv.state.assoc_files = {k: pathlib.Path(v) for k, v in record['assoc_files'].items()}
+    # JSON object keys are always strings
+    mkv.state.stream_hashes = {int(stage): {int(i): h for i, h in hashes.items()}
+                               for stage, hashes in record['stream_hashes'].items()}
+    mkv.metadata = record['metadata']
+    mkv.fingerprint = record['fingerprint']
+
+    for kind, fields in record['streams'].items():
+        stream = MKVStream(fields['kind'])
+        for field in STREAM_FIELDS:
+            setattr(stream, field, fields[field])
+        setattr(mkv, kind, stream)
+
+    mkv.stage = record['stage']
+    return mkv
+
+
+class Journal:
+    """ Append-only record of every title's progress
+
+        Instance Attributes
+        ====================
+
+        path        The journal file
+    """
+
+    def __init__(self, path: pathlib.Path):
+        """ Constructor for Journal """
+        self.path = pathlib.Path(path)
+        self._lock = threading.Lock()
+
+    def record(self, mkv: MKV):
+        """ Append a snapshot of a title and make sure it's on disk """
+        line = json.dumps(snapshot(mkv)) + '\n'
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(str(self.path), 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def replay(self) -> dict:
+        """ The last snapshot of every title in the journal, keyed by title """
+        latest = {}
+        try:
+            with open(str(self.path), 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    latest[record['key']] = record
+        except FileNotFoundError:
+            pass
+        return latest
+
+    def compact(self) -> dict:
+        """ Rewrite the journal with only the titles that are still in progress
+
+        :return dict:   Their last snapshots, keyed by title
+        """
+        pending = {k: v for k, v in self.replay().items() if v['stage'] < stages.STAGE_3}
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = partial_path(self.path)
+            with open(str(tmp), 'w') as f:
+                for record in pending.values():
+                    f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(str(tmp), str(self.path))
+        return pending
+
+    def resume(self) -> List[MKV]:
+        """ Rebuild every title that was in progress when the driver last stopped """
+        mkvs = []
+        for record in self.compact().values():
+            mkv = restore(record)
+
+            # The driver stopped between committing a stage and recording it
+            if not mkv.state.cur_path.exists() and _moved_on(mkv):
+                mkv.stage += 1
+                self.record(mkv)
+                if mkv.stage == stages.STAGE_3:
+                    print('Already finished: ' + record['key'])
+                    continue
+
+            # A stereo mix in scratch may not survive a reboot. The title can make it again
+            mix = mkv.state.assoc_files.get('stereo_mix')
+            if mkv.stage == stages.STAGE_2 and mix is not None and not mix.exists() and mkv.state.cur_path.exists():
+                try:
+                    mkv._move(str(mkv.state.cur_path), str(mkv.state.root.joinpath('1_remux')))
+                except (RuntimeError, OSError) as exc:
+                    print('Cannot resume {}: {}'.format(record['key'], exc))
+                    continue
+                del mkv.state.assoc_files['stereo_mix']
+                mkv.stage = stages.STAGE_1
+                self.record(mkv)
+                print('Stereo mix is gone, back to stage 1: ' + record['key'])
+
+            # Everything the next stage reads has to still be there
+            missing = [_ for _ in [mkv.state.cur_path] + list(mkv.state.assoc_files.values()) if not _.exists()]
+            if missing:
+                print('Cannot resume {}, missing: {}'.format(record['key'], ', '.join(str(_) for _ in missing)))
+                continue
+
+            mkvs.append(mkv)
+        return mkvs
+
+
+def _moved_on(mkv: MKV) -> bool:
+    """ Whether a title's file already made it into the next stage directory (see MKV.post_process)
+
+        Stage 1 leaves the stereo mix behind for stage 2, which has to find it again. Stage 2 cleans
+        up after itself once the final product is written, so a leftover stereo mix is removed.
+    """
+    if mkv.stage == stages.STAGE_2:
+        if mkv.metadata is None or not mkv.state.out_dir.joinpath(mkv._titled_fname()).exists():
+            return False
+        mix = mkv.state.assoc_files.pop('stereo_mix', None)
+        if mix is not None and mix.exists():
+            mix.unlink()
+        return True
+
+    if not mkv.state.out_dir.joinpath(mkv.state.cur_fname).exists():
+        return False
+
+    if mkv.stage == stages.STAGE_1:
+        # The stereo mix is only journaled from stage 2 on. It's either next to the mkv or in scratch
+        places = [mkv.state.out_dir]
+        scratch = get_scratch()
+        if scratch is not None:
+            places.append(scratch.path)
+        mixes = [_.joinpath(mkv.state.clean_name + '.m4a') for _ in places]
+        mixes = [_ for _ in mixes if _.exists()]
+        if not mixes:
+            return False
+        mkv.state.assoc_files['stereo_mix'] = mixes[0]
+
+    return True
+
+
+_journal = None
+
+
+def get_journal() -> Optional[Journal]:
+    """ The process wide journal, or None if journaling is off """
+    global _journal
+
+    if not settings['journal']:
+        return None
+
+    path = resource_path(settings['journal'])
+    if _journal is None or _journal.path != path:
+        _journal = Journal(path)
+
+    return _journal
@@ -0,0 +1,137 @@
+""" Background offload of finished outputs and archived originals.
+
+    Once stage 2 commits, the finished mkv (and its review bundle) only sits in 3_review until it
+    goes to the library, and the original in _archive only sits there until it goes to cold
+    storage. Both are on the fast processing disk, which eventually blocks new jobs. The offload
+    queue moves them out in the background, overlapped with whatever is being processed:
+
+        - Throughput capped so running jobs keep their bandwidth
+        - Every copy is checksummed before the source is removed (see transfer.move)
+        - Failed moves are retried with a growing delay
+
+    Bytes still waiting to leave a device are reported to the scheduler, which would rather wait
+    for them than defer a job that only needs that room.
+"""
+import queue
+import pathlib
+import threading
+import time
+from typing import Optional
+
+from mkvremux import transfer
+from mkvremux.config import settings
+
+
+class OffloadQueue:
+    """ Asynchronous, throttled, verified mover
+
+        Instance Attributes
+        ====================
+
+        bwlimit         Most bytes per second for a move (None for no limit)
+        verify_hash     Checksum each copy before the source is removed
+        retries         How many times a move is attempted
+        retry_delay     Seconds to wait after the first failure (doubles every time)
+        reserve         Bytes that must stay free on the target
+        pending         {path: (device, size)} for everything waiting to be moved
+        failed          Moves that gave up after every retry
+    """
+
+    def __init__(self, bwlimit: int = None, verify_hash: bool = True, retries: int = 3, retry_delay: float = 30,
+                 reserve: int = 0):
+        """ Constructor for OffloadQueue """
+        self.bwlimit = bwlimit
+        self.verify_hash = verify_hash
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.reserve = reserve
+        self.pending = {}
+        self.failed = []
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._progress = threading.Condition(self._lock)
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def put(self, src: pathlib.Path, dst_dir: pathlib.Path):
+        """ Queue a file to be moved into dst_dir """
+        src = pathlib.Path(src)
+        with self._lock:
+            self.pending[src] = (transfer.device(src), src.stat().st_size)
+        self._queue.put((src, pathlib.Path(dst_dir)))
+
+    def pending_bytes(self, device: int = None) -> int:
+        """ Bytes still waiting to be moved off a device (or off every device) """
+        with self._lock:
+            return sum(size for dev, size in self.pending.values() if device is None or dev == device)
+
+    def wait_progress(self, timeout: float = None) -> bool:
+        """ Block until at least one more file has been dealt with
+
+        :return bool: False if there was nothing pending or we timed out
+        """
+        with self._progress:
+            if not self.pending:
+                return False
+            before = len(self.pending)
+            return self._progress.wait_for(lambda: len(self.pending) < before, timeout)
+
+    def join(self):
+        """ Wait for the queue to drain """
+        self._queue.join()
+
+    def _move(self, src: pathlib.Path, dst_dir: pathlib.Path):
+        for attempt in range(self.retries):
+            try:
+                dst_dir.mkdir(parents=True, exist_ok=True)
+                transfer.move(src, dst_dir, verify_hash=self.verify_hash, reserve=self.reserve, bwlimit=self.bwlimit)
+                return
+            except (OSError, RuntimeError) as exc:
+                print('  Offload of {} failed (attempt {}/{}): {}'.format(src.name, attempt + 1, self.retries, exc))
+                if attempt + 1 < self.retries:
+                    time.sleep(self.retry_delay * 2 ** attempt)
+
+        self.failed.append(src)
+
+    def _worker(self):
+        while True:
+            src, dst_dir = self._queue.get()
+            try:
+                self._move(src, dst_dir)
+            finally:
+                with self._progress:
+                    self.pending.pop(src, None)
+                    self._progress.notify_all()
+                self._queue.task_done()
+
+
+_offload = None
+
+
+def get_queue() -> Optional[OffloadQueue]:
+    """ The process wide offload queue, or None if no offload destination is configured """
+    global _offload
+
+    if not settings['offload_library'] and not settings['offload_archive']:
+        return None
+
+    if _offload is None:
+        _offload = OffloadQueue(settings['offload_bwlimit'], retries=settings['offload_retries'],
+                                reserve=settings['transfer_reserve'])
+
+    return _offload
+
+
+def enqueue(path: pathlib.Path, kind: str):
+    """ Queue a committed file for offload
+
+    :param path:    The file
+    :param kind:    'library' for finished outputs, 'archive' for archived originals
+    """
+    dst_dir = settings['offload_' + kind]
+    offload = get_queue()
+    if offload is None or not dst_dir:
+        return
+
+    offload.put(path, dst_dir)
@@ -0,0 +1,187 @@
+""" External metadata providers for titles the local catalog doesn't know.
+
+    A provider takes a batch of titles and returns whatever it can find for them. The HTTP provider
+    asks a metadata service (GET <url>?title=<title>, answering with the movie as JSON, or 404) and
+    keeps every answer in an on-disk cache:
+
+        - Answers are fresh for `ttl` seconds. After that they are revalidated with the ETag the
+          service sent (If-None-Match), so an unchanged answer costs a 304 and no body
+        - "Not found" is cached too, for `negative_ttl` seconds, so a title that isn't anywhere
+          doesn't get asked about on every run
+        - At most `max_concurrent` requests are in flight, and no more than `rate` start per second
+
+    Whatever a provider finds is written back into the catalog (see Catalog.add), so every title is
+    fetched at most once.
+"""
+import abc
+import json
+import time
+import hashlib
+import pathlib
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from mkvremux.config import settings, resource_path
+from mkvremux.state import partial_path
+
+
+class Provider(abc.ABC):
+    """ Base class for metadata providers """
+
+    @abc.abstractmethod
+    def fetch(self, titles: List[str]) -> dict:
+        """ Look up a batch of titles
+
+        :param titles:  The titles
+        :return dict:   {title: movie, or None if the provider doesn't know it}
+        """
+
+
+class ResponseCache:
+    """ On-disk cache of provider answers, one JSON file per request
+
+        Instance Attributes
+        ====================
+
+        path            Cache directory
+        ttl             Seconds an answer is used without asking again
+        negative_ttl    Same, for "not found"
+    """
+
+    def __init__(self, path: pathlib.Path, ttl: float, negative_ttl: float):
+        """ Constructor for ResponseCache """
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def _file(self, key: str) -> pathlib.Path:
+        return self.path.joinpath(hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def get(self, key: str) -> Optional[dict]:
+        """ The cached entry for a request: {'fetched', 'status', 'etag', 'body'}, or None """
+        try:
+            with open(str(self._file(key)), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def fresh(self, entry: dict) -> bool:
+        """ True if an entry can be used without asking the provider again """
+        ttl = self.ttl if entry['status'] == 200 else self.negative_ttl
+        return time.time() - entry['fetched'] < ttl
+
+    def put(self, key: str, status: int, body: Optional[dict], etag: str = None) -> dict:
+        entry = {'fetched': time.time(), 'status': status, 'etag': etag, 'body': body}
+        target = self._file(key)
+        tmp = partial_path(target)
+        with open(str(tmp), 'w') as f:
+            json.dump(entry, f)
+        tmp.replace(target)
+        return entry
+
+
+class RateLimiter:
+    """ Lets at most `rate` callers through per second """
+
+    def __init__(self, rate: float):
+        """ Constructor for RateLimiter """
+        self.interval = 1 / rate if rate else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(max(0.0, start - now))
+
+
+class HttpProvider(Provider):
+    """ Metadata service over HTTP, with a response cache and rate limiting
+
+        Instance Attributes
+        ====================
+
+        url             Service endpoint, queried as <url>?title=<title>
+        cache           ResponseCache
+        max_concurrent  Most requests in flight at once
+        timeout         Seconds before a request is given up on
+        requests        Number of requests actually sent (cache misses and revalidations)
+    """
+
+    def __init__(self, url: str, cache: ResponseCache, max_concurrent: int = 4, rate: float = 5,
+                 timeout: float = 10):
+        """ Constructor for HttpProvider """
+        self.url = url
+        self.cache = cache
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.requests = 0
+        self._limiter = RateLimiter(rate)
+        self._lock = threading.Lock()
+
+    def _request(self, title: str) -> Optional[dict]:
+        url = self.url + '?' + urllib.parse.urlencode({'title': title})
+        entry = self.cache.get(url)
+        if entry is not None and self.cache.fresh(entry):
+            return entry['body']
+
+        headers = {'Accept': 'application/json'}
+        if entry is not None and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+
+        self._limiter.wait()
+        with self._lock:
+            self.requests += 1
+
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=self.timeout) as resp:
+                body = json.loads(resp.read().decode())
+                return self.cache.put(url, 200, body, resp.headers.get('ETag'))['body']
+        except urllib.error.HTTPError as exc:
+            if exc.code == 304:
+                return self.cache.put(url, entry['status'], entry['body'], entry.get('etag'))['body']
+            if exc.code == 404:
+                return self.cache.put(url, 404, None)['body']
+            raise RuntimeError('Metadata provider error', title, exc.code)
+        except (urllib.error.URLError, OSError, ValueError) as exc:
+            raise RuntimeError('Metadata provider error', title, str(exc))
+
+    def fetch(self, titles: List[str]) -> dict:
+        """ See Provider.fetch(). Titles that fail outright come back as None and aren't cached """
+        titles = list(dict.fromkeys(titles))
+
+        def one(title):
+            try:
+                return self._request(title)
+            except RuntimeError as exc:
+                print('  {}: {}'.format(exc.args[0], exc.args[1:]))
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as pool:
+            return dict(zip(titles, pool.map(one, titles)))
+
+
+_provider = None
+
+
+def get_provider() -> Optional[Provider]:
+    """ The process wide metadata provider, or None if there isn't one configured """
+    global _provider
+
+    if not settings['metadata_provider']:
+        return None
+
+    if _provider is None:
+        cache = ResponseCache(resource_path(settings['provider_cache']), settings['provider_ttl'],
+                              settings['provider_negative_ttl'])
+        _provider = HttpProvider(settings['metadata_provider'], cache, settings['provider_max_concurrent'],
+                                 settings['provider_rate'])
+
+    return _provider
@@ -0,0 +1,137 @@
+""" Review bundles for stage 3.
+
+    Scrubbing through a 40 GB file just to check that the right streams made it in (and that the
+    stereo mix sounds sane) doesn't scale. Instead, every finished mkv gets a few small files next
+    to it in 3_review:
+
+        <name>.review.jpg           Contact sheet built from keyframes only
+        <name>.review.a<N>.<M>.mka  Short snippets of each audio track, copied (not re-encoded)
+        <name>.review.txt           The stream table
+
+    Everything here seeks straight to where it needs to be and only decodes keyframes, so building a
+    bundle takes seconds even for UHD HEVC.
+"""
+import json
+import pathlib
+from subprocess import run, PIPE, DEVNULL
+from typing import List, Sequence
+
+from mkvremux.verify import container_duration
+
+
+def bundle_path(path: pathlib.Path, suffix: str) -> pathlib.Path:
+    """ Path of a review bundle file for the given mkv, e.g. 'Title (Year).review.jpg' """
+    return path.with_name('{}.review{}'.format(path.stem, suffix))
+
+
+def contact_sheet(path: pathlib.Path, out_file: pathlib.Path, duration: float,
+                  columns: int, rows: int, width: int):
+    """ Build a contact sheet from evenly spaced keyframes.
+
+        Each thumbnail is its own input with a fast (keyframe) seek and `-skip_frame nokey`, so ffmpeg
+        decodes exactly one frame per thumbnail. The thumbnails are then tiled in the same invocation.
+    """
+    count = columns * rows
+
+    cmd = ['ffmpeg', '-v', 'error', '-y']
+    for n in range(count):
+        seek = duration * (n + 0.5) / count
+        cmd += ['-skip_frame', 'nokey', '-noaccurate_seek', '-ss', '{:.3f}'.format(seek), '-i', str(path)]
+
+    graph = ''
+    for n in range(count):
+        graph += '[{0}:v:0]trim=end_frame=1,setpts=PTS-STARTPTS,scale={1}:-2[t{0}];'.format(n, width)
+    graph += ''.join('[t{}]'.format(_) for _ in range(count))
+    graph += 'concat=n={}:v=1:a=0,tile={}x{}'.format(count, columns, rows)
+
+    cmd += ['-filter_complex', graph, '-frames:v', '1', str(out_file)]
+
+    ret = run(cmd, stdout=DEVNULL, stderr=PIPE)
+    if ret.returncode != 0:
+        raise RuntimeError('Issue building contact sheet', ret)
+
+
+def audio_snippets(path: pathlib.Path, duration: float, tracks: int,
+                   offsets: List[float], length: float) -> List[pathlib.Path]:
+    """ Cut a short snippet of every audio track at each offset. Packets are copied, nothing is decoded.
+
+    :param offsets: Snippet positions as fractions of the total duration
+    :return list:   The snippet files
+    """
+    snippets = []
+
+    for n, offset in enumerate(offsets):
+        cmd = ['ffmpeg', '-v', 'error', '-y', '-ss', '{:.3f}'.format(duration * offset), '-i', str(path)]
+
+        # One output per track, all from the same seek
+        for track in range(tracks):
+            out_file = bundle_path(path, '.a{}.{}.mka'.format(track, n))
+            cmd += ['-t', '{:.3f}'.format(length), '-map', '0:a:{}'.format(track), '-c', 'copy', str(out_file)]
+            snippets.append(out_file)
+
+        ret = run(cmd, stdout=DEVNULL, stderr=PIPE)
+        if ret.returncode != 0:
+            raise RuntimeError('Issue cutting audio snippets', ret)
+
+    return snippets
+
+
+def stream_table(path: pathlib.Path) -> List[dict]:
+    """ Probe the header for the details a reviewer cares about """
+    cmd = ['ffprobe', '-v', 'error', '-show_streams', '-print_format', 'json', str(path)]
+    ret = run(cmd, stdout=PIPE, stderr=DEVNULL)
+
+    if ret.returncode != 0:
+        raise RuntimeError('Problem extracting stream: {}'.format(path))
+
+    table = []
+    for stream in json.loads(ret.stdout)['streams']:
+        tags = stream.get('tags', {})
+        disposition = stream.get('disposition', {})
+        table.append({
+            'index': stream.get('index'),
+            'type': stream.get('codec_type'),
+            'codec': stream.get('codec_name'),
+            'channels': stream.get('channels', ''),
+            'language': tags.get('language', ''),
+            'title': tags.get('title', ''),
+            'default': disposition.get('default', 0),
+            'forced': disposition.get('forced', 0)
+        })
+
+    return table
+
+
+def format_table(table: List[dict]) -> str:
+    """ Render the stream table as fixed width text """
+    columns = ['index', 'type', 'codec', 'channels', 'language', 'default', 'forced', 'title']
+    widths = {c: max([len(c)] + [len(str(_[c])) for _ in table]) for c in columns}
+
+    lines = ['  '.join(c.ljust(widths[c]) for c in columns)]
+    for row in table:
+        lines.append('  '.join(str(row[c]).ljust(widths[c]) for c in columns))
+
+    return '\n'.join(_.rstrip() for _ in lines) + '\n'
+
+
+def build_bundle(path: pathlib.Path, columns: int = 4, rows: int = 4, width: int = 320,
+                 offsets: Sequence[float] = (0.25, 0.5, 0.75), length: float = 10.0) -> List[pathlib.Path]:
+    """ Build the full review bundle for a finished mkv
+
+    :param path:    The finished mkv
+    :return list:   Every file in the bundle
+    """
+    duration = container_duration(path)
+    table = stream_table(path)
+
+    table_file = bundle_path(path, '.txt')
+    with open(str(table_file), 'w') as f:
+        f.write(format_table(table))
+
+    sheet = bundle_path(path, '.jpg')
+    contact_sheet(path, sheet, duration, columns, rows, width)
+
+    tracks = len([_ for _ in table if _['type'] == 'audio'])
+    snippets = audio_snippets(path, duration, tracks, list(offsets), length)
+
+    return [table_file, sheet] + snippets
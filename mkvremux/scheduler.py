@@ -0,0 +1,297 @@
+""" Runs the command execution and post-processing steps for a batch of MKVs.
+
+    Before a job is started, the scheduler predicts how many bytes it is going to write and where.
+    A job is only admitted if every target filesystem has room for it on top of what the jobs
+    already running have reserved. Jobs that don't fit are deferred, not failed: they wait for
+    running jobs to finish and, if there still isn't room, are handed back to the caller untouched.
+
+    Every job is also tagged with the devices it reads from and writes to. Only `per_device` jobs
+    may touch a device at once, so with several processing roots two remuxes never fight over the
+    same spindle while another disk sits idle.
+
+    With an offload queue attached, bytes that are still on their way off a device count as space
+    that is about to free up: a job that only needs that room waits for the offload instead of being
+    deferred.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Tuple
+
+from mkvremux import cache, transfer
+from mkvremux.scratch import get_scratch
+from mkvremux.state import stages
+from mkvremux.verify import container_duration
+
+# Container overhead on top of the raw stream bytes (cues, block headers, etc.)
+MUX_OVERHEAD = 1.01
+
+# Upper bound for the stereo mix bitrate (qaac TVBR q127) in bytes per second
+STEREO_MIX_RATE = 320000 // 8
+
+
+def predict(mkv) -> dict:
+    """ Predict the bytes a job will write, per target directory.
+
+        Stage 0 uses the NUMBER_OF_BYTES tags of the selected streams (falling back to the size of
+        the source when a tag is missing). Later stages work from the files already on disk.
+
+    :param MKV mkv: The mkv, already pre-processed
+    :return dict:   {directory: bytes}
+    """
+    state = mkv.state
+    need = {}
+
+    def add(directory, size):
+        need[directory] = need.get(directory, 0) + int(size)
+
+    def moves_across(src, dst_dir):
+        return transfer.device(src) != transfer.device(dst_dir)
+
+    src_size = state.cur_path.stat().st_size
+
+    if mkv.stage == stages.STAGE_0:
+        streams = mkv.video.copy_streams[:1] + mkv.audio.copy_streams[:1] + mkv.subs.copy_streams
+        try:
+            out_size = sum(int(_['tags']['NUMBER_OF_BYTES']) for _ in streams) * MUX_OVERHEAD
+        except (KeyError, ValueError):
+            out_size = src_size
+        add(state.out_dir, out_size)
+
+        archive = state.root.joinpath('_archive')
+        if moves_across(state.cur_path, archive):
+            add(archive, src_size)
+
+    elif mkv.stage == stages.STAGE_1:
+        # Stereo mix may be headed for scratch instead of the next stage directory
+        add(state.assoc_files['stereo_mix'].parent, container_duration(state.cur_path) * STEREO_MIX_RATE)
+
+        if moves_across(state.cur_path, state.out_dir):
+            add(state.out_dir, src_size)
+
+    elif mkv.stage == stages.STAGE_2:
+        mix_size = state.assoc_files['stereo_mix'].stat().st_size
+        add(state.out_dir, (src_size + mix_size) * MUX_OVERHEAD)
+
+    return need
+
+
+def devices(mkv, need: dict) -> set:
+    """ Every device a job reads from or writes to. The scratch tier isn't a spindle and doesn't count
+
+    :param MKV mkv:     The mkv
+    :param dict need:   {directory: bytes} as returned by predict()
+    :return set:        st_dev of each device
+    """
+    paths = [mkv.state.cur_path] + list(need)
+    if mkv.stage == stages.STAGE_2:
+        paths.append(mkv.state.assoc_files['stereo_mix'])
+
+    scratch = get_scratch()
+    if scratch is not None:
+        paths = [_ for _ in paths if not scratch.contains(_)]
+
+    return {transfer.device(_) for _ in paths}
+
+
+class Scheduler:
+    """ Admission controlled job runner
+
+        Instance Attributes
+        ====================
+
+        max_jobs        How many jobs may run at once
+        per_device      How many jobs may read from or write to a single device at once
+        reserve         Bytes that must stay free on every target filesystem
+        reservations    Bytes held by running jobs, keyed by device
+        busy            Number of running jobs using each device
+        prefetch        Warm up the page cache for the next waiting job while the current ones run
+        stager          Copies the source of the next waiting job to local storage (see staging.py)
+        offload         Moves finished files off the processing disks (see offload.py)
+    """
+
+    # How often (seconds) to look for offload progress while jobs are running
+    OFFLOAD_POLL = 5
+
+    def __init__(self, max_jobs: int = 1, reserve: int = 0, per_device: int = 1, prefetch: bool = False,
+                 stager=None, offload=None):
+        """ Constructor for Scheduler """
+        self.max_jobs = max_jobs
+        self.prefetch = prefetch
+        self.stager = stager
+        self.offload = offload
+        self.per_device = per_device
+        self.reserve = reserve
+        self.reservations = {}
+        self.busy = {}
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def predict(self, mkv) -> dict:
+        """ See predict() """
+        return predict(mkv)
+
+    def devices(self, mkv, need: dict) -> set:
+        """ See devices() """
+        return devices(mkv, need)
+
+    def plan(self, mkv):
+        """ Predicted output and devices of a job, worked out once per run
+
+        :return tuple:  (need, devs), or None if the prediction failed. The mkv is marked as failed then
+        """
+        if mkv not in self._plans:
+            try:
+                need = self.predict(mkv)
+                self._plans[mkv] = (need, self.devices(mkv, need))
+            except Exception as exc:
+                # Something is wrong with this title (missing mix, unreadable source). Not with the batch
+                print('  Cannot schedule {}: {}'.format(mkv.state.cur_path, exc))
+                mkv.can_transition = False
+                self._plans[mkv] = None
+        return self._plans[mkv]
+
+    def idle(self, devs: set) -> bool:
+        """ True if none of the devices is already at its job limit """
+        return all(self.busy.get(_, 0) < self.per_device for _ in devs)
+
+    def free(self, directory) -> int:
+        """ Bytes still free on a directory's filesystem once running jobs finish writing """
+        with self._lock:
+            held = self.reservations.get(transfer.device(directory), 0)
+        return transfer.free_bytes(directory) - held - self.reserve
+
+    def admit(self, need: dict) -> bool:
+        """ Reserve space for a job if every one of its targets has room for it
+
+        :param dict need:   {directory: bytes} as returned by predict()
+        :return bool:       True if the job was admitted
+        """
+        # Several directories can share one filesystem
+        by_device = {}
+        for directory, size in need.items():
+            dev = transfer.device(directory)
+            if dev not in by_device:
+                by_device[dev] = [directory, 0]
+            by_device[dev][1] += size
+
+        with self._lock:
+            for dev, (directory, size) in by_device.items():
+                free = transfer.free_bytes(directory) - self.reservations.get(dev, 0) - self.reserve
+                if size > free:
+                    return False
+
+            for dev, (_, size) in by_device.items():
+                self.reservations[dev] = self.reservations.get(dev, 0) + size
+
+        return True
+
+    def release(self, need: dict):
+        """ Give back the space reserved for a finished job """
+        with self._lock:
+            for directory, size in need.items():
+                dev = transfer.device(directory)
+                self.reservations[dev] = self.reservations.get(dev, 0) - size
+
+    def offload_helps(self, mkv_list: list) -> bool:
+        """ True if the offload queue is still freeing space a waiting job needs """
+        if self.offload is None:
+            return False
+
+        for mkv in mkv_list:
+            plan = self.plan(mkv)
+            if plan is not None and any(self.offload.pending_bytes(transfer.device(_)) for _ in plan[0]):
+                return True
+        return False
+
+    def _run_job(self, job: Callable, mkv):
+        """ Run a single job, reading from its staged copy if there is one """
+        if self.stager is None:
+            return job(mkv)
+
+        self.stager.wait(mkv)
+        try:
+            return job(mkv)
+        finally:
+            self.stager.discard(mkv)
+
+    def run(self, mkv_list: list, job: Callable) -> Tuple[list, list]:
+        """ Run job(mkv) for every mkv, admitting each one only once there's room for its output.
+
+        :param list mkv_list:   The MKVs to process
+        :param job:             Does the actual work for a single mkv
+        :return tuple:          (MKVs that were run or failed, MKVs that were deferred). Failed ones have
+                                can_transition set to False
+        """
+        waiting = list(mkv_list)
+        done = []
+        running = {}
+        hinted = set()
+        self._plans = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_jobs) as pool:
+            while waiting or running:
+
+                # Start everything that fits, in order. A job whose devices are busy is skipped
+                # over so that a later job on an idle device can start in the meantime
+                for mkv in list(waiting):
+                    if len(running) >= self.max_jobs:
+                        break
+
+                    plan = self.plan(mkv)
+                    if plan is None:
+                        waiting.remove(mkv)
+                        done.append(mkv)
+                        continue
+
+                    need, devs = plan
+                    if not self.idle(devs):
+                        continue
+
+                    if self.admit(need):
+                        waiting.remove(mkv)
+                        for dev in devs:
+                            self.busy[dev] = self.busy.get(dev, 0) + 1
+                        running[pool.submit(self._run_job, job, mkv)] = (mkv, need, devs)
+
+                # Nothing running means nothing is going to free up, unless the offload queue is still
+                # moving files off a disk we're short on. Otherwise whatever is left gets deferred
+                if not running:
+                    if self.offload_helps(waiting) and self.offload.wait_progress():
+                        continue
+                    break
+
+                # Let the next job start on a warm cache, or better yet a local copy
+                if waiting and waiting[0] not in hinted:
+                    hinted.add(waiting[0])
+                    if self.stager is not None:
+                        self.stager.start(waiting[0])
+                    if self.prefetch:
+                        cache.prefetch(waiting[0].state.cur_path)
+
+                # Space freed by the offload queue can admit a job before any running one finishes
+                poll = self.OFFLOAD_POLL if waiting and self.offload_helps(waiting) else None
+                finished, _ = wait(list(running), timeout=poll, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    mkv, need, devs = running.pop(future)
+                    self.release(need)
+                    for dev in devs:
+                        self.busy[dev] -= 1
+                    done.append(mkv)
+
+                    # One title blowing up mustn't take the jobs running next to it down too
+                    try:
+                        future.result()
+                    except Exception as exc:
+                        print('  Job failed for {}: {!r}'.format(mkv.state.cur_path, exc))
+                        mkv.can_transition = False
+
+        # Staged copies of jobs that never ran (deferred or failed) would otherwise stay in staging for good
+        if self.stager is not None:
+            for mkv in hinted:
+                self.stager.discard(mkv)
+
+        for mkv in waiting:
+            print('  Deferred (not enough free space): ' + str(mkv.state.cur_path))
+
+        self._plans = {}
+        return done, waiting
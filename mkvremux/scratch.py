@@ -0,0 +1,88 @@
+""" Fast scratch tier for small intermediates.
+
+    The stereo mix is tiny next to the mkv it came from, but writing it to the same spinning disk
+    the next 40 GB remux is streaming to adds seeks to a big sequential write. When a scratch area
+    is configured (e.g. /dev/shm or a local SSD) small intermediates go there instead, up to a size
+    cap. Once the cap is hit, jobs simply fall back to the stage directories.
+
+    A title that stops before stage 2 is done gives its reservation back (see MKV.release_scratch).
+    A finished mix it leaves behind for a retry still counts against the cap for as long as it is
+    there, because the cap is checked against what's actually on disk as well.
+"""
+import os
+import pathlib
+import threading
+from typing import Optional
+
+from mkvremux import transfer
+from mkvremux.config import settings
+from mkvremux.state import partial_path
+
+
+class Scratch:
+    """ A capped scratch directory
+
+        Instance Attributes
+        ====================
+
+        path            The scratch directory
+        cap             Most bytes we'll ever keep in it
+        reservations    Bytes promised to each file that lives (or will live) in scratch
+    """
+
+    def __init__(self, path: pathlib.Path, cap: int):
+        """ Constructor for Scratch """
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.cap = cap
+        self.reservations = {}
+        self._lock = threading.Lock()
+
+    @property
+    def used(self) -> int:
+        """ Bytes promised to reserved files plus the size of anything else left in scratch """
+        # A reserved file is still being written under its partial name
+        reserved = {_.name for _ in self.reservations} | {partial_path(_).name for _ in self.reservations}
+        with os.scandir(str(self.path)) as it:
+            leftover = sum(_.stat().st_size for _ in it if _.is_file() and _.name not in reserved)
+        return sum(self.reservations.values()) + leftover
+
+    def contains(self, path: pathlib.Path) -> bool:
+        """ True if path lives in scratch """
+        return self.path in pathlib.Path(path).parents
+
+    def reserve(self, fname: str, size: int) -> Optional[pathlib.Path]:
+        """ Reserve room for a file
+
+        :param str fname:   Name of the file
+        :param int size:    Predicted size of the file
+        :return:            Where to put the file, or None if scratch is full
+        """
+        with self._lock:
+            if self.used + size > self.cap or transfer.free_bytes(self.path) < size:
+                return None
+
+            target = self.path.joinpath(fname)
+            self.reservations[target] = size
+            return target
+
+    def release(self, path: pathlib.Path):
+        """ Forget about a file once it's gone """
+        with self._lock:
+            self.reservations.pop(pathlib.Path(path), None)
+
+
+_scratch = None
+
+
+def get_scratch() -> Optional[Scratch]:
+    """ The process wide scratch tier, or None if there isn't one configured """
+    global _scratch
+
+    if settings['scratch'] is None:
+        return None
+
+    if _scratch is None or _scratch.path != pathlib.Path(settings['scratch']):
+        _scratch = Scratch(settings['scratch'], settings['scratch_cap'])
+
+    return _scratch
@@ -0,0 +1,98 @@
+""" Prefetch-to-local staging for sources on network storage.
+
+    When 0_analyze lives on a slow share, stage 0 spends most of its time waiting on the network
+    while the local disk and CPU sit idle, and between jobs it's the other way around. With a
+    staging directory configured, the scheduler double-buffers: while job N runs, the source of the
+    next job is copied to local storage in the background (with a bandwidth cap so job N isn't
+    starved). Job N+1 then reads the local copy, which is removed once the job is done.
+"""
+import hashlib
+import pathlib
+import threading
+
+from mkvremux import transfer
+from mkvremux.state import stages
+
+
+class Stager:
+    """ Background copier for upcoming stage 0 sources
+
+        Instance Attributes
+        ====================
+
+        path        Local staging directory
+        bwlimit     Most bytes per second a background copy may use (None for no limit)
+        reserve     Bytes that must stay free in the staging directory
+        jobs        {mkv: [thread, target, succeeded, size]} for every copy started
+    """
+
+    def __init__(self, path: pathlib.Path, bwlimit: int = None, reserve: int = 0):
+        """ Constructor for Stager """
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.bwlimit = bwlimit
+        self.reserve = reserve
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def _copy(self, mkv, src: pathlib.Path, target: pathlib.Path):
+        try:
+            result = transfer.copy(src, target, reserve=self.reserve, bwlimit=self.bwlimit)
+            print('  Staged {} ({:.1f} MB/s)'.format(src.name, result.size / 1e6 / max(result.seconds, 1e-6)))
+            succeeded = True
+        except (OSError, RuntimeError) as exc:
+            # Not fatal. The job just reads straight from the source
+            print('  Could not stage {}: {}'.format(src.name, exc))
+            succeeded = False
+
+        with self._lock:
+            if mkv in self.jobs:
+                self.jobs[mkv][2] = succeeded
+
+    def start(self, mkv):
+        """ Start copying the source of an upcoming job, if it's a stage 0 job and there's room """
+        if mkv.stage != stages.STAGE_0:
+            return
+
+        src = mkv.state.cur_path
+        with self._lock:
+            if mkv in self.jobs:
+                return
+
+            # Copies still in flight will need their room too
+            size = src.stat().st_size
+            pending = sum(_[3] for _ in self.jobs.values() if not _[1].exists())
+            if transfer.free_bytes(self.path) - pending - size < self.reserve:
+                return
+
+            # Two roots can each have a source by the same name. Their staged copies mustn't collide
+            prefix = hashlib.sha1(str(src).encode(errors='surrogateescape')).hexdigest()[:12]
+            target = self.path.joinpath('{}_{}'.format(prefix, src.name))
+            thread = threading.Thread(target=self._copy, args=(mkv, src, target), daemon=True)
+            self.jobs[mkv] = [thread, target, False, size]
+
+        thread.start()
+
+    def wait(self, mkv):
+        """ Wait for a job's staged copy (if one was started) and point the job at it """
+        entry = self.jobs.get(mkv)
+        if entry is None:
+            return
+
+        entry[0].join()
+        if entry[2]:
+            mkv.state.staged_path = entry[1]
+
+    def discard(self, mkv):
+        """ Remove a job's staged copy once the job is done with it """
+        with self._lock:
+            entry = self.jobs.pop(mkv, None)
+
+        if entry is None:
+            return
+
+        # Just in case the job never waited on it
+        entry[0].join()
+        mkv.state.staged_path = None
+        if entry[1].exists():
+            entry[1].unlink()
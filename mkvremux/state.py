@@ -6,6 +6,14 @@ from collections import namedtuple
 Pipeline = namedtuple('Pipeline', ['STAGE_0', 'STAGE_1', 'STAGE_2', 'STAGE_3'])
 stages = Pipeline(0, 1, 2, 3)
 
+# Suffix for outputs that are still being written
+PARTIAL = '.part'
+
+
+def partial_path(path: pathlib.Path) -> pathlib.Path:
+    """ The temporary name an output is written under until its stage succeeds """
+    return path.with_name(path.name + PARTIAL)
+
 
 class State:
     """ Helper class to track the state of the file through the entire process,
@@ -34,6 +42,10 @@ class State:
 
     clean_name  str                 The name of the file with badchars removed
     assoc_files dict                A dict of files associated with this file
+    stream_hashes dict              Hashes of every stream written, keyed by stage then stream index
+    pending     dict                Outputs of the current stage that haven't been committed yet (final paths)
+    staged_path pathlib.Path        Local copy of the current file, if one was staged (see staging.py)
+    read_path   pathlib.Path        Where the current stage should read the file from
 
     # Maybe not needed
     next_path   pathlib.Path        Path to the next location the file should go
@@ -86,9 +98,35 @@ class State:
 
         self.assoc_files = {}
 
+        # Filled in by the remux stages when stream hashing is enabled
+        self.stream_hashes = {}
+
+        # Outputs being written by the current stage. They live in out_dir under a temporary name
+        self.pending = {}
+
+        # Set while a local copy of a (network) source is available
+        self.staged_path = None
+
         # If you're wondering how most of the above attributes get set on init. It's here
         self.stage = start_stage
 
+    def plan_output(self, key: str, fname: str, directory: pathlib.Path = None) -> pathlib.Path:
+        """ Plan an output of the current stage.
+
+            Outputs are written straight into the next stage directory under a temporary name and
+            only get their real name once the stage succeeds (see MKV.commit_outputs). This way
+            finished data never has to be moved, and anything still carrying the temporary suffix
+            is known to be half-written.
+
+        :param key:     Name of the output, e.g. 'mkv' or 'stereo_mix'
+        :param fname:   Final filename of the output
+        :param directory: Where the output goes if not out_dir (e.g. the scratch tier)
+        :return:        The temporary path to write to
+        """
+        final = (directory or self.out_dir).joinpath(fname)
+        self.pending[key] = final
+        return partial_path(final)
+
     @property
     def out_dir(self):
         return self._out_dir
@@ -101,6 +139,10 @@ class State:
         else:
             self.out_fname = self.cur_fname
 
+    @property
+    def read_path(self):
+        return self.staged_path or self.cur_path
+
     @property
     def cur_path(self):
         return self._cur_path
@@ -148,8 +190,8 @@ class State:
             self.cur_path = self.root.joinpath('2_mix', self.clean_name + self.ext)
             self.out_dir = self.root.joinpath('3_review')
 
-            # Also update the path for 'stereo_mix'
-            if 'stereo_mix' in self.assoc_files:
+            # Also update the path for 'stereo_mix', unless it lives outside the stage directories (scratch)
+            if 'stereo_mix' in self.assoc_files and self.assoc_files['stereo_mix'].parent.parent == self.root:
                 mix_file = self.assoc_files['stereo_mix'].name
                 self.assoc_files['stereo_mix'] = self.root.joinpath('2_mix', mix_file)
 
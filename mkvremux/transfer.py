@@ -0,0 +1,245 @@
+""" Moving big files between stage directories.
+
+    shutil.move quietly turns into a full Python level copy whenever the destination is on another
+    filesystem. For a 40 GB mkv that means no progress, no integrity check and, if the target fills
+    up halfway, a half-written file. Everything that moves media around should go through move().
+
+        Same device     os.rename. Constant time
+        Cross device    reflink if the filesystem supports it, otherwise copy_file_range / sendfile
+                        (falling back to a plain buffered copy), then fsync, size check, optional
+                        hash check and only then unlink the source
+"""
+import os
+import time
+import errno
+import shutil
+import hashlib
+import pathlib
+from collections import namedtuple
+from typing import Union
+
+from mkvremux.state import partial_path
+
+# Result of a move. method is one of 'rename', 'reflink', 'copy_file_range', 'sendfile', 'copy'
+Transfer = namedtuple('Transfer', ['src', 'dst', 'size', 'seconds', 'method'])
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+CHUNK = 64 * 1024 * 1024
+
+
+def free_bytes(path: Union[str, pathlib.Path]) -> int:
+    """ Bytes available to us on the filesystem holding path """
+    st = os.statvfs(str(path))
+    return st.f_bavail * st.f_frsize
+
+
+def device(path: Union[str, pathlib.Path]) -> int:
+    """ The device a path lives on """
+    return os.stat(str(path)).st_dev
+
+
+def file_hash(path: Union[str, pathlib.Path]) -> str:
+    """ sha256 of an entire file """
+    digest = hashlib.sha256()
+    with open(str(path), 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _same_device(src: pathlib.Path, dst_dir: pathlib.Path) -> bool:
+    return device(src) == device(dst_dir)
+
+
+def _copy(src: pathlib.Path, dst: pathlib.Path, size: int) -> str:
+    """ Copy src to dst using the cheapest mechanism the platform offers.
+
+    :return str: The mechanism that was used
+    """
+    with open(str(src), 'rb') as fsrc, open(str(dst), 'wb') as fdst:
+
+        # Reflink. Only works when both ends are on the same (CoW) filesystem, e.g. btrfs subvolumes
+        try:
+            import fcntl
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            method = 'reflink'
+        except (ImportError, OSError):
+            method = None
+
+        # In-kernel copies. Neither one round trips the data through Python
+        for name in ['copy_file_range', 'sendfile']:
+            if method is not None or not hasattr(os, name):
+                continue
+            try:
+                offset = 0
+                while offset < size:
+                    if name == 'copy_file_range':
+                        sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(CHUNK, size - offset))
+                    else:
+                        sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, min(CHUNK, size - offset))
+                    if sent == 0:
+                        break
+                    offset += sent
+            except OSError as exc:
+                if exc.errno not in [errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF]:
+                    raise
+
+            # Some filesystems (procfs-like, some FUSE mounts) report 0 bytes instead of failing
+            if offset == size:
+                method = name
+            else:
+                # Start over with the next mechanism
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+
+        if method is None:
+            shutil.copyfileobj(fsrc, fdst, CHUNK)
+            method = 'copy'
+
+        fdst.flush()
+        os.fsync(fdst.fileno())
+
+    return method
+
+
+def _throttled_copy(src: pathlib.Path, dst: pathlib.Path, bwlimit: int) -> str:
+    """ Buffered copy that never goes faster than bwlimit bytes per second.
+
+        Used for background copies that must leave bandwidth for the jobs that are actually running.
+    """
+    chunk = min(CHUNK, max(bwlimit, 1024 * 1024))
+    start = time.monotonic()
+    copied = 0
+
+    with open(str(src), 'rb') as fsrc, open(str(dst), 'wb') as fdst:
+        for block in iter(lambda: fsrc.read(chunk), b''):
+            fdst.write(block)
+            copied += len(block)
+
+            # Sleep off anything we're ahead of schedule
+            ahead = copied / bwlimit - (time.monotonic() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+        fdst.flush()
+        os.fsync(fdst.fileno())
+
+    return 'throttled'
+
+
+def _copy_checked(src: pathlib.Path, dst: pathlib.Path, size: int, verify_hash: bool, bwlimit: int) -> str:
+    """ Copy src to dst under a temporary name, check it, then give it its real name
+
+    :return str: The mechanism that was used
+    """
+    # Copy under a temporary name so a half-done copy is never mistaken for the real thing
+    tmp = partial_path(dst)
+    try:
+        if bwlimit:
+            method = _throttled_copy(src, tmp, bwlimit)
+        else:
+            method = _copy(src, tmp, size)
+
+        if tmp.stat().st_size != size:
+            raise RuntimeError('Size mismatch after copy', str(src), str(tmp))
+
+        if verify_hash and file_hash(src) != file_hash(tmp):
+            raise RuntimeError('Hash mismatch after copy', str(src), str(tmp))
+
+    except BaseException:
+        if tmp.exists():
+            tmp.unlink()
+        raise
+
+    os.replace(str(tmp), str(dst))
+    _fsync_dir(dst.parent)
+
+    return method
+
+
+def _fsync_dir(path: pathlib.Path):
+    """ Make a rename or unlink durable. Not possible (or needed) everywhere """
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def copy(src: Union[str, pathlib.Path], dst: Union[str, pathlib.Path], verify_hash: bool = False,
+         reserve: int = 0, bwlimit: int = None) -> Transfer:
+    """ Copy a file safely. The source is left alone.
+
+    :param src:         File to copy
+    :param dst:         Destination file or directory
+    :param verify_hash: Hash both copies when done
+    :param reserve:     Bytes that must still be free on the target afterwards
+    :param bwlimit:     Most bytes per second to copy. None for as fast as possible
+    :return Transfer:   What was copied, how and how long it took
+    :raises RuntimeError if the target doesn't have room or the copy doesn't match the source
+    """
+    src = pathlib.Path(src)
+    dst = pathlib.Path(dst)
+    if dst.is_dir():
+        dst = dst.joinpath(src.name)
+
+    size = src.stat().st_size
+    start = time.monotonic()
+
+    if free_bytes(dst.parent) - size < reserve:
+        raise RuntimeError('Not enough space to copy file', str(src), str(dst.parent))
+
+    method = _copy_checked(src, dst, size, verify_hash, bwlimit)
+
+    return Transfer(src, dst, size, time.monotonic() - start, method)
+
+
+def move(src: Union[str, pathlib.Path], dst: Union[str, pathlib.Path], verify_hash: bool = False,
+         reserve: int = 0, bwlimit: int = None) -> Transfer:
+    """ Move a file, in constant time when possible and safely when not.
+
+    :param src:         File to move
+    :param dst:         Destination file or directory (like shutil.move)
+    :param verify_hash: Hash both copies before removing the source on a cross device move
+    :param reserve:     Bytes that must still be free on the target after a cross device move
+    :param bwlimit:     Most bytes per second for a cross device move. None for as fast as possible
+    :return Transfer:   What was moved, how and how long it took
+    :raises RuntimeError if the destination exists, the target doesn't have room or the copy doesn't match the source
+    """
+    src = pathlib.Path(src)
+    dst = pathlib.Path(dst)
+    if dst.is_dir():
+        dst = dst.joinpath(src.name)
+
+    # Both rename() and the final replace() would silently clobber whatever is there
+    if dst.exists():
+        raise RuntimeError('Destination already exists', str(src), str(dst))
+
+    size = src.stat().st_size
+    start = time.monotonic()
+
+    if _same_device(src, dst.parent):
+        os.rename(str(src), str(dst))
+        return Transfer(src, dst, size, time.monotonic() - start, 'rename')
+
+    if free_bytes(dst.parent) - size < reserve:
+        raise RuntimeError('Not enough space to move file', str(src), str(dst.parent))
+
+    method = _copy_checked(src, dst, size, verify_hash, bwlimit)
+
+    src.unlink()
+    _fsync_dir(src.parent)
+
+    elapsed = time.monotonic() - start
+    print('    Moved {} ({:.1f} MB) in {:.1f}s [{:.1f} MB/s via {}]'.format(
+        src.name, size / 1e6, elapsed, size / 1e6 / max(elapsed, 1e-6), method))
+
+    return Transfer(src, dst, size, elapsed, method)
@@ -1,6 +1,11 @@
+import os
+import time
+import fnmatch
 import pathlib
-from typing import List
-from mkvremux import MKV
+from typing import Iterable, Iterator, List, Union
+from mkvremux import MKV, fingerprint
+from mkvremux.config import settings
+from mkvremux.state import PARTIAL
 
 
 def list_by_extension(target: str, ext: str) -> list:
@@ -16,18 +21,165 @@ def list_by_extension(target: str, ext: str) -> list:
     return [_ for _ in p.iterdir() if _.suffix == ext]
 
 
-def get_mkvs(stage: int) -> List[MKV]:
-    """ Given a specific processing stage, find all MKVs that need to be handle
+def clean_partials(root: str = '.') -> list:
+    """ Remove half-written outputs left behind by a stage that didn't finish.
+
+    :param str root:    The processing root
+    :return list:       The files that were removed
+    """
+    removed = []
+    for stage_dir in ['1_remux', '2_mix', '3_review', '_archive']:
+        p = pathlib.Path(root).joinpath(stage_dir)
+        if not p.is_dir():
+            continue
+        for item in p.iterdir():
+            if item.name.endswith(PARTIAL):
+                item.unlink()
+                removed.append(item)
+    return removed
+
+
+class Job:
+    """ Lightweight descriptor of a file waiting to be processed. The MKV is only built when it's needed
+
+        Instance Attributes
+        ====================
+
+        path            Path to the file
+        stage           Processing stage the file is in
+        size            Size in bytes (from the directory scan)
+        mtime           Modification time (from the directory scan)
+        fingerprint     Content fingerprint, if duplicate detection is on (see fingerprint.py)
+        duplicate_of    Where the same content was seen before, if anywhere
+    """
+    __slots__ = ['path', 'stage', 'size', 'mtime', 'fingerprint', 'duplicate_of']
+
+    def __init__(self, path: pathlib.Path, stage: int, size: int, mtime: float):
+        """ Constructor for Job """
+        self.path = path
+        self.stage = stage
+        self.size = size
+        self.mtime = mtime
+        self.fingerprint = None
+        self.duplicate_of = None
+
+    @classmethod
+    def for_path(cls, path: pathlib.Path, stage: int) -> 'Job':
+        """ A Job for a file that didn't come from scan() """
+        stat = path.stat()
+        return cls(path, stage, stat.st_size, stat.st_mtime)
+
+    def mkv(self) -> MKV:
+        """ Build the MKV for this job """
+        mkv = MKV(self.path, self.stage)
+        mkv.fingerprint = self.fingerprint
+        mkv.duplicate_of = self.duplicate_of
+        return mkv
+
+
+def scan(target: Union[str, pathlib.Path], ext: str = '.mkv', recursive: bool = False, include: list = None,
+         exclude: list = None, min_size: int = 0, min_age: float = 0) -> Iterator[os.DirEntry]:
+    """ Lazily find files with os.scandir, reusing the stat results it already has
+
+    :param target:      Directory to scan
+    :param ext:         Desired file extension including the dot (e.g. '.mkv')
+    :param recursive:   Descend into subdirectories
+    :param include:     Only names matching one of these glob patterns (None for everything)
+    :param exclude:     Skip names matching any of these glob patterns
+    :param min_size:    Skip files smaller than this many bytes
+    :param min_age:     Skip files modified less than this many seconds ago (e.g. still being copied)
+    :return:            DirEntry of every match
+    """
+    now = time.time()
+    pending = [str(target)]
+
+    while pending:
+        try:
+            it = os.scandir(pending.pop())
+        except FileNotFoundError:
+            continue
+
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        pending.append(entry.path)
+                    continue
+
+                name = entry.name
+                if not name.endswith(ext) or not entry.is_file():
+                    continue
+                if include and not any(fnmatch.fnmatch(name, _) for _ in include):
+                    continue
+                if exclude and any(fnmatch.fnmatch(name, _) for _ in exclude):
+                    continue
+
+                stat = entry.stat()
+                if stat.st_size < min_size or now - stat.st_mtime < min_age:
+                    continue
+
+                yield entry
+
+
+def skip_duplicates(jobs: Iterable[Job]) -> Iterator[Job]:
+    """ Drop (or flag) stage 0 jobs whose content was already processed or is in the batch twice """
+    index = fingerprint.get_index()
+    seen = {}
+
+    for job in jobs:
+        if job.stage != 0 or index is None:
+            yield job
+            continue
+
+        # Don't spend an hour remuxing something we've already done (or that's in here twice)
+        job.fingerprint = fingerprint.fingerprint(job.path)
+        job.duplicate_of = index.get(job.fingerprint) or seen.get(job.fingerprint)
+        seen.setdefault(job.fingerprint, str(job.path))
+
+        if job.duplicate_of is None:
+            yield job
+        elif settings['duplicates'] == 'flag':
+            print('Possible duplicate: {} (same as {})'.format(job.path, job.duplicate_of))
+            yield job
+        else:
+            print('Skipping duplicate: {} (same as {})'.format(job.path, job.duplicate_of))
+
+
+# Directory each stage picks its input up from
+search_paths = {
+    0: '0_analyze',
+    1: '1_remux',
+    2: '2_mix'
+}
+
+
+def iter_jobs(stage: int, root: str = '.', min_age: float = None) -> Iterator[Job]:
+    """ Find every file that needs handling at a given stage. See get_mkvs()
+
+        The directory is listed once, up front. Jobs (and their fingerprints) are still produced one
+        at a time, but the files processed in between can't show up in the listing: whether a
+        directory iterator returns entries added while it's open (e.g. the orig_ files stage 0
+        renames sources to) is left open by POSIX.
 
     :param int stage:   The desired processing stage
-    :return list:       A list of found MKVs
+    :param str root:    The processing root to look in
+    :param min_age:     Skip files modified less than this many seconds ago (None for settings['scan_min_age'])
+    :return:            A Job for every file found
     """
+    if min_age is None:
+        min_age = settings['scan_min_age']
+    entries = list(scan(pathlib.Path(root).joinpath(search_paths[stage]), include=settings['scan_include'],
+                        exclude=settings['scan_exclude'], min_size=settings['scan_min_size'], min_age=min_age))
 
-    search_paths = {
-        0: '0_analyze',
-        1: '1_remux',
-        2: '2_mix'
-    }
+    jobs = (Job(pathlib.Path(_.path), stage, _.stat().st_size, _.stat().st_mtime) for _ in entries)
+    return skip_duplicates(jobs)
 
-    files = list_by_extension(search_paths[stage], '.mkv')
-    return [MKV(_, stage) for _ in files]
+
+def get_mkvs(stage: int, root: str = '.') -> List[MKV]:
+    """ Given a specific processing stage, find all MKVs that need to be handle
+
+    :param int stage:   The desired processing stage
+    :param str root:    The processing root to look in
+    :return list:       A list of found MKVs
+    """
+    return [_.mkv() for _ in iter_jobs(stage, root)]
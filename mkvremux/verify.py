@@ -0,0 +1,369 @@
+""" Cheap verification of remux output.
+
+    The remux stages never touch the actual encoded data (everything is `-c copy`), so a healthy
+    output carries exactly the same packets as its source. That means we can catch truncated or
+    short-written files by comparing per-stream packet counts, byte totals and durations without
+    decoding a single frame.
+
+    Sources are described by the statistics tags (NUMBER_OF_FRAMES, NUMBER_OF_BYTES, DURATION) the
+    ripper writes into the track headers, so they aren't read at all. The packet index is only
+    walked when those tags are missing. The output can't be judged by its tags: ffmpeg copies them
+    from the source along with the rest of the stream metadata, so they say the right thing even
+    when the file is short. Its packets are counted by ffprobe itself (-count_packets) and only its
+    durations come from the header, which the muxer writes fresh.
+
+    Index checks can't see a corrupt packet though, so there is also an optional sampled mode that
+    decodes a few short windows at random keyframes and compares frame hashes with the source.
+"""
+import json
+import random
+import pathlib
+from subprocess import run, Popen, PIPE, DEVNULL
+from typing import Union, List, Tuple, Optional
+
+
+def _header(path: Union[str, pathlib.Path], count_packets: bool = False) -> dict:
+    """ Stream entries (with tags) and format entries of a container, from ffprobe """
+    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'stream=index,codec_type,duration,nb_read_packets:stream_tags'
+           ':format=duration', '-of', 'json', str(path)]
+    if count_packets:
+        cmd.insert(1, '-count_packets')
+
+    ret = run(cmd, stdout=PIPE, stderr=DEVNULL)
+    if ret.returncode != 0:
+        raise RuntimeError('Problem reading stream headers: {}'.format(path))
+
+    return json.loads(ret.stdout)
+
+
+def _tag(stream: dict, name: str) -> Optional[str]:
+    """ A stream tag by name. mkvmerge and MakeMKV sometimes append a language (NUMBER_OF_BYTES-eng) """
+    for key, value in stream.get('tags', {}).items():
+        if key.upper() == name or key.upper().startswith(name + '-'):
+            return value
+    return None
+
+
+def _duration(stream: dict, fmt: dict) -> float:
+    """ Duration of a stream from its header: DURATION tag, then stream duration, then the container's """
+    tag = _tag(stream, 'DURATION')
+    if tag:
+        try:
+            hours, minutes, seconds = tag.split(':')
+            return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        except ValueError:
+            pass
+    return _to_float(stream.get('duration')) or _to_float(fmt.get('duration')) or 0.0
+
+
+def tagged_stats(path: Union[str, pathlib.Path]) -> Optional[dict]:
+    """ Per stream totals from the statistics tags in the container header. Nothing is demuxed.
+
+    :param path:    Path to the container
+    :return dict:   Same as stream_stats(), or None if any stream is missing its statistics tags
+    """
+    probe = _header(path)
+    stats = {}
+    for stream in probe.get('streams', []):
+        packets, size = _tag(stream, 'NUMBER_OF_FRAMES'), _tag(stream, 'NUMBER_OF_BYTES')
+        if packets is None or size is None:
+            return None
+        stats[stream['index']] = {
+            'codec_type': stream.get('codec_type'),
+            'packets': int(packets),
+            'bytes': int(size),
+            'duration': _duration(stream, probe.get('format', {}))
+        }
+    return stats
+
+
+def counted_stats(path: Union[str, pathlib.Path]) -> dict:
+    """ Per stream packet counts from ffprobe's own counter, durations from the header.
+
+        The whole file is still demuxed, but inside ffprobe: there's no per-packet output to
+        parse. Byte totals aren't available this way and are reported as None.
+
+    :param path:    Path to the container
+    :return dict:   Same as stream_stats()
+    """
+    probe = _header(path, count_packets=True)
+    return {_['index']: {
+        'codec_type': _.get('codec_type'),
+        'packets': int(_.get('nb_read_packets', 0)),
+        'bytes': None,
+        'duration': _duration(_, probe.get('format', {}))
+    } for _ in probe.get('streams', [])}
+
+
+def source_stats(path: Union[str, pathlib.Path]) -> dict:
+    """ Per stream totals of a source: its statistics tags if it has them, its packet index otherwise """
+    stats = tagged_stats(path)
+    return stats if stats is not None else stream_stats(path)
+
+
+def stream_stats(path: Union[str, pathlib.Path]) -> dict:
+    """ Walk the packet index of a container and total it up per stream.
+
+        ffprobe only demuxes here, nothing is decoded. Output is streamed and summed as it
+        arrives so memory stays flat no matter how many packets the file has.
+
+    :param path:    Path to the container
+    :return dict:   {stream_index: {'codec_type', 'packets', 'bytes', 'duration'}}
+    """
+    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'packet=codec_type,stream_index,pts_time,duration_time,size',
+           '-of', 'compact=p=0', str(path)]
+
+    stats = {}
+    with Popen(cmd, stdout=PIPE, stderr=DEVNULL, universal_newlines=True) as proc:
+        for line in proc.stdout:
+            packet = dict(_.split('=', 1) for _ in line.strip().split('|') if '=' in _)
+            if 'stream_index' not in packet:
+                continue
+
+            index = int(packet['stream_index'])
+            entry = stats.setdefault(index, {
+                'codec_type': packet.get('codec_type'),
+                'packets': 0,
+                'bytes': 0,
+                'start': None,
+                'end': None
+            })
+            entry['packets'] += 1
+            entry['bytes'] += int(packet.get('size', 0))
+
+            # Subtitle (and some audio) packets don't always carry timestamps
+            pts = _to_float(packet.get('pts_time'))
+            if pts is not None:
+                end = pts + (_to_float(packet.get('duration_time')) or 0.0)
+                entry['start'] = pts if entry['start'] is None else min(entry['start'], pts)
+                entry['end'] = end if entry['end'] is None else max(entry['end'], end)
+
+    if proc.returncode != 0:
+        raise RuntimeError('Problem reading packet index: {}'.format(path))
+
+    for entry in stats.values():
+        start = entry.pop('start')
+        end = entry.pop('end')
+        entry['duration'] = end - start if start is not None else 0.0
+
+    return stats
+
+
+def compare_stats(expected: List[dict], actual: List[dict], tolerance: float) -> List[str]:
+    """ Compare the stats of each output stream with the stats of the source stream it was copied from.
+
+    :param expected:    Source stream stats, in output stream order
+    :param actual:      Output stream stats, in output stream order
+    :param tolerance:   Allowed duration difference in seconds
+    :return list:       A description of every mismatch. Empty if the output is good
+    """
+    mismatches = []
+
+    if len(expected) != len(actual):
+        mismatches.append('Expected {} streams in output, found {}'.format(len(expected), len(actual)))
+
+    for index, (want, got) in enumerate(zip(expected, actual)):
+        if want['codec_type'] != got['codec_type']:
+            mismatches.append('Stream {}: expected {} stream, found {}'.format(
+                index, want['codec_type'], got['codec_type']))
+            continue
+
+        for key in ['packets', 'bytes']:
+            # Totals we couldn't get cheaply for one side aren't compared
+            if want[key] is not None and got[key] is not None and want[key] != got[key]:
+                mismatches.append('Stream {}: {} {} != {}'.format(index, key, got[key], want[key]))
+
+        if abs(want['duration'] - got['duration']) > tolerance:
+            mismatches.append('Stream {}: duration {:.3f}s != {:.3f}s'.format(
+                index, got['duration'], want['duration']))
+
+    return mismatches
+
+
+def verify_remux(out_path: pathlib.Path, sources: List[Tuple[pathlib.Path, Optional[list]]],
+                 tolerance: float) -> List[str]:
+    """ Verify a remuxed container against its source(s)
+
+    :param out_path:    The freshly written container
+    :param sources:     Inputs in the same order they were passed to ffmpeg. Each is a tuple of
+                        (path, indices) where indices is the list of mapped streams in -map order
+                        or None if every stream was mapped (-map N)
+    :param tolerance:   Allowed duration difference in seconds
+    :return list:       A description of every mismatch. Empty if the output is good
+    """
+    expected = []
+    for path, indices in sources:
+        stats = source_stats(path)
+        for index in (indices if indices is not None else sorted(stats)):
+            # A mapped stream with no packets at all simply won't show up in the packet index
+            expected.append(stats.get(index, {'codec_type': None, 'packets': 0, 'bytes': 0, 'duration': 0.0}))
+
+    out_stats = counted_stats(out_path)
+    actual = [out_stats[_] for _ in sorted(out_stats)]
+
+    return compare_stats(expected, actual, tolerance)
+
+
+def stream_types(path: Union[str, pathlib.Path]) -> dict:
+    """ Read the stream layout from the container header. Nothing is demuxed.
+
+    :param path:    Path to the container
+    :return dict:   {stream_index: codec_type}
+    """
+    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'stream=index,codec_type', '-of', 'json', str(path)]
+    ret = run(cmd, stdout=PIPE, stderr=DEVNULL)
+
+    if ret.returncode != 0:
+        raise RuntimeError('Problem extracting stream layout: {}'.format(path))
+
+    return {_['index']: _['codec_type'] for _ in json.loads(ret.stdout)['streams']}
+
+
+def container_duration(path: Union[str, pathlib.Path]) -> float:
+    """ Duration of the container (in seconds) as reported in its header """
+    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', str(path)]
+    ret = run(cmd, stdout=PIPE, stderr=DEVNULL)
+
+    if ret.returncode != 0:
+        raise RuntimeError('Problem Extracting Global Format Data', ret)
+
+    return _to_float(json.loads(ret.stdout)['format'].get('duration')) or 0.0
+
+
+def keyframe_times(path: Union[str, pathlib.Path], count: int, duration: float, seed=None) -> List[float]:
+    """ Pick random seek points and snap each one to the keyframe a seek would actually land on.
+
+        Every point is passed to a single ffprobe call as a read interval that stops after one packet,
+        so this costs `count` seeks regardless of how big the file is.
+
+    :param path:        Path to the container
+    :param count:       Number of seek points
+    :param duration:    Duration of the container in seconds
+    :param seed:        Seed for the random generator. Handy for reproducing a failure
+    :return list:       Sorted, de-duplicated keyframe timestamps
+    """
+    rng = random.Random(seed)
+    targets = sorted(rng.uniform(0, duration * 0.95) for _ in range(count))
+    intervals = ','.join('{:.3f}%+#1'.format(_) for _ in targets)
+
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-read_intervals', intervals,
+           '-show_entries', 'packet=pts_time,flags', '-of', 'compact=p=0', str(path)]
+    ret = run(cmd, stdout=PIPE, stderr=DEVNULL, universal_newlines=True)
+
+    if ret.returncode != 0:
+        raise RuntimeError('Problem reading keyframes: {}'.format(path))
+
+    times = set()
+    for line in ret.stdout.splitlines():
+        packet = dict(_.split('=', 1) for _ in line.strip().split('|') if '=' in _)
+        pts = _to_float(packet.get('pts_time'))
+        if pts is not None and 'K' in packet.get('flags', ''):
+            times.add(pts)
+
+    return sorted(times)
+
+
+def start_time(path: Union[str, pathlib.Path]) -> float:
+    """ Timestamp of the earliest of the first few packets of a container, in seconds.
+
+        Remuxing doesn't have to keep timestamps where they were (stage 0 can shift the start,
+        an AAC stream's priming samples can start it early), so seek points are measured from here.
+    """
+    cmd = ['ffprobe', '-v', 'error', '-read_intervals', '%+#16', '-show_entries', 'packet=pts_time',
+           '-of', 'compact=p=0', str(path)]
+    ret = run(cmd, stdout=PIPE, stderr=DEVNULL, universal_newlines=True)
+
+    if ret.returncode != 0:
+        raise RuntimeError('Problem reading start time: {}'.format(path))
+
+    times = [_to_float(_.strip().partition('=')[2]) for _ in ret.stdout.splitlines()]
+    times = [_ for _ in times if _ is not None]
+    return min(times) if times else 0.0
+
+
+def window_hashes(path: Union[str, pathlib.Path], start: float, window: float, indices: list) -> dict:
+    """ Decode a short window of the given streams and hash every frame.
+
+    :param path:        Path to the container
+    :param start:       Where the window starts (seconds)
+    :param window:      Length of the window (seconds)
+    :param indices:     Streams to decode
+    :return dict:       {stream_index: [frame hashes in order]}
+    """
+    cmd = ['ffmpeg', '-v', 'error', '-ss', '{:.3f}'.format(start), '-i', str(path)]
+    for index in indices:
+        cmd += ['-map', '0:{}'.format(index)]
+    cmd += ['-t', '{:.3f}'.format(window), '-f', 'framemd5', '-']
+
+    ret = run(cmd, stdout=PIPE, stderr=DEVNULL, universal_newlines=True)
+
+    if ret.returncode != 0:
+        raise RuntimeError('Problem decoding sample window: {}'.format(path))
+
+    # framemd5 numbers its streams in -map order
+    hashes = {_: [] for _ in indices}
+    for line in ret.stdout.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        fields = [_.strip() for _ in line.split(',')]
+        hashes[indices[int(fields[0])]].append(fields[-1])
+
+    return hashes
+
+
+def verify_samples(out_path: pathlib.Path, sources: List[Tuple[pathlib.Path, Optional[list]]],
+                   count: int, window: float, seed=None) -> List[str]:
+    """ Decode `count` short windows of the output at random keyframes and make sure every
+    audio and video frame matches the same window of the source.
+
+        Subtitles are skipped. They're tiny and the index check already covers them. Not finding a
+        single keyframe to sample counts as a failure rather than a pass.
+
+    :param out_path:    The freshly written container
+    :param sources:     Same as verify_remux()
+    :param count:       Number of windows to check
+    :param window:      Length of each window in seconds
+    :param seed:        Seed for picking seek points
+    :return list:       A description of every mismatch. Empty if the output is good
+    """
+    # Work out which source stream each output stream was copied from
+    mapping = []
+    for path, indices in sources:
+        types = stream_types(path)
+        for index in (indices if indices is not None else sorted(types)):
+            mapping.append((path, index, types[index]))
+
+    # (out_index, src_path, src_index) for everything we can decode
+    checked = [(n, path, index) for n, (path, index, kind) in enumerate(mapping) if kind in ['audio', 'video']]
+
+    src_indices = {}
+    for _, path, index in checked:
+        src_indices.setdefault(path, []).append(index)
+
+    # The same moment in each file, relative to where each one starts
+    out_start = start_time(out_path)
+    shift = {path: start_time(path) - out_start for path in src_indices}
+
+    points = keyframe_times(out_path, count, container_duration(out_path), seed)
+    if not points:
+        return ['No keyframes found to sample in {}'.format(out_path)]
+
+    mismatches = []
+    for point in points:
+        got = window_hashes(out_path, point, window, [_[0] for _ in checked])
+        want = {path: window_hashes(path, point + shift[path], window, indices)
+                for path, indices in src_indices.items()}
+
+        for out_index, path, index in checked:
+            if got[out_index] != want[path][index]:
+                mismatches.append('Stream {}: decoded frames differ from source at {:.3f}s'.format(out_index, point))
+
+    return mismatches
+
+
+def _to_float(val: Optional[str]) -> Optional[float]:
+    """ ffprobe reports missing values as 'N/A' """
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,223 @@
+""" Watch-folder support for daemon mode.
+
+    Instead of scanning 0_analyze once and exiting, the driver can keep running and pick files up
+    as they arrive. A file only counts once it is completely there:
+
+        - inotify has to report it closed after writing (or moved in), and
+        - its size has to stay the same for `settle` seconds after that
+
+    inotify is used through libc directly, so a watcher sleeps in select() and costs nothing while
+    idle. Where inotify isn't available (not Linux, network mounts that never send events) the
+    PollingWatcher rescans every `interval` seconds instead.
+"""
+import os
+import abc
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import pathlib
+from typing import List
+
+from mkvremux import utils
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct('iIII')
+
+
+class Watcher(abc.ABC):
+    """ Base class for watchers. Keeps track of files until they have settled
+
+        Instance Attributes
+        ====================
+
+        dirs        Directories being watched
+        settle      Seconds a file's size must stay the same before it's handed out
+        pending     {path: (size, since)} for files that showed up but haven't settled yet
+    """
+
+    def __init__(self, dirs: List[pathlib.Path], settle: float = 10):
+        """ Constructor for Watcher """
+        self.dirs = [pathlib.Path(_) for _ in dirs]
+        self.settle = settle
+        self.pending = {}
+
+    def _candidate(self, path: pathlib.Path):
+        """ A file showed up (or was written to again). Its settle time starts over """
+        # orig_ files were renamed by the pipeline itself
+        if path.suffix != '.mkv' or path.name.startswith('orig_'):
+            return
+        try:
+            self.pending[path] = (path.stat().st_size, time.monotonic())
+        except FileNotFoundError:
+            self.pending.pop(path, None)
+
+    def _settled(self) -> List[pathlib.Path]:
+        """ Every pending file whose size hasn't changed for `settle` seconds """
+        now = time.monotonic()
+        ready = []
+        for path, (size, since) in list(self.pending.items()):
+            try:
+                current = path.stat().st_size
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+
+            if current != size:
+                self.pending[path] = (current, now)
+            elif now - since >= self.settle:
+                del self.pending[path]
+                ready.append(path)
+        return sorted(ready)
+
+    def seed(self):
+        """ Files already in the watched directories that were written to in the last `settle` seconds may
+            still be copying. Treat them as if they had just shown up, so they're handed out once they settle
+        """
+        now = time.time()
+        for directory in self.dirs:
+            for entry in utils.scan(directory):
+                if now - entry.stat().st_mtime < self.settle:
+                    self._candidate(pathlib.Path(entry.path))
+
+    @abc.abstractmethod
+    def wait(self, timeout: float = None) -> List[pathlib.Path]:
+        """ Block until at least one new file is complete
+
+        :param timeout: Give up after this many seconds (None to wait forever)
+        :return list:   The complete files (empty if we timed out)
+        """
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(Watcher):
+    """ Watcher driven by inotify events """
+
+    def __init__(self, dirs: List[pathlib.Path], settle: float = 10):
+        """ Constructor for InotifyWatcher
+
+        :raises OSError if inotify isn't available
+        """
+        super().__init__(dirs, settle)
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+        except (OSError, AttributeError):
+            raise OSError('inotify is not available')
+
+        self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self.watches = {}
+        for path in self.dirs:
+            wd = add_watch(self.fd, str(path).encode(), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed', str(path))
+            self.watches[wd] = path
+
+    def _read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(errors='surrogateescape')
+            offset += length
+
+            if wd in self.watches and name:
+                self._candidate(self.watches[wd].joinpath(name))
+
+    def wait(self, timeout: float = None) -> List[pathlib.Path]:
+        """ See Watcher.wait() """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            # Nothing pending means nothing to do until the kernel tells us otherwise
+            wait_for = self.settle if self.pending else None
+            if deadline is not None:
+                left = max(0.0, deadline - time.monotonic())
+                wait_for = left if wait_for is None else min(wait_for, left)
+
+            readable, _, _ = select.select([self.fd], [], [], wait_for)
+            if readable:
+                self._read_events()
+
+            ready = self._settled()
+            if ready:
+                return ready
+            if deadline is not None and time.monotonic() >= deadline:
+                return []
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(Watcher):
+    """ Watcher that rescans its directories every `interval` seconds
+
+        Instance Attributes
+        ====================
+
+        interval    Seconds between scans
+        known       {path: (size, mtime)} as of the last scan, so files are only handed out once
+    """
+
+    def __init__(self, dirs: List[pathlib.Path], settle: float = 10, interval: float = 30):
+        """ Constructor for PollingWatcher """
+        super().__init__(dirs, settle)
+        self.interval = interval
+        self.known = {}
+
+    def _poll(self):
+        found = {}
+        for directory in self.dirs:
+            for entry in utils.scan(directory):
+                stat = entry.stat()
+                found[pathlib.Path(entry.path)] = (stat.st_size, stat.st_mtime)
+
+        for path, signature in found.items():
+            if self.known.get(path) != signature:
+                self._candidate(path)
+        self.known = found
+
+    def wait(self, timeout: float = None) -> List[pathlib.Path]:
+        """ See Watcher.wait() """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            self._poll()
+            ready = self._settled()
+            if ready:
+                return ready
+
+            pause = min(self.interval, self.settle) if self.pending else self.interval
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return []
+                pause = min(pause, left)
+            time.sleep(pause)
+
+
+def get_watcher(dirs: List[pathlib.Path], settle: float = 10, interval: float = 30, inotify: bool = True) -> Watcher:
+    """ An inotify watcher if possible, a polling one otherwise """
+    if inotify:
+        try:
+            return InotifyWatcher(dirs, settle)
+        except OSError as exc:
+            print('inotify unavailable ({}), polling every {}s instead'.format(exc, interval))
+    return PollingWatcher(dirs, settle, interval)
@@ -57,7 +57,7 @@ class TestGoldenPath:
                 - mkv file will be renamed to orig_<name>
                 - mkv file will be processed and desired streams flagged
                 - Desired streams will be extracted into new mkv file
-                - New mkv file moved to next stage
+                - New mkv file written straight into the next stage
                 - Original mkv file archived
 
             Expected Values:
@@ -65,7 +65,6 @@ class TestGoldenPath:
                 - can_transition    -> True
 
             Expected Outputs:
-                - 'tests/processing/0_analyze/Stage 0 Test Good.mkv'
                 - 'tests/processing/1_remux/Stage 0 Test Good.mkv'
                 - 'tests/processing/_archive/orig_Stage 0 Test Good.mkv'
         """
@@ -77,13 +76,12 @@ class TestGoldenPath:
         assert orig.exists()
 
         self.mkv.run_commands()
-        out = pathlib.Path('tests/processing/0_analyze/Stage 0 Test Good.mkv')
+        out = pathlib.Path('tests/processing/1_remux/Stage 0 Test Good.mkv')
         assert out.exists()
 
         self.mkv.post_process()
-        moved = pathlib.Path('tests/processing/1_remux/Stage 0 Test Good.mkv')
         archived_orig = pathlib.Path('tests/processing/_archive/orig_Stage 0 Test Good.mkv')
-        assert moved.exists()
+        assert out.exists()
         assert archived_orig.exists()
 
     def test_stage_1(self):
@@ -92,8 +90,8 @@ class TestGoldenPath:
             Expected Behavior:
                 - Complete pre-processing, command execution, and post-processing with no errors
                 - mkv Audio stream will be downmixed into stereo
-                - Stereo mix will be AAC encoded
-                - Both files will be moved to stage_2
+                - Stereo mix will be AAC encoded straight into stage_2
+                - mkv file will be moved to stage_2
 
             Expected Values:
                 - intervene         -> False
@@ -101,7 +99,6 @@ class TestGoldenPath:
 
             Expected Outputs:
                 - 'tests/processing/1_remux/Stage 0 Test Good.mkv'
-                - 'tests/processing/1_remux/Stage 0 Test Good.m4a'
                 - 'tests/processing/2_mix/Stage 0 Test Good.mkv'
                 - 'tests/processing/2_mix/Stage 0 Test Good.m4a'
         """
@@ -111,7 +108,7 @@ class TestGoldenPath:
 
         self.mkv.run_commands()
         out_0 = pathlib.Path('tests/processing/1_remux/Stage 0 Test Good.mkv')
-        out_1 = pathlib.Path('tests/processing/1_remux/Stage 0 Test Good.m4a')
+        out_1 = pathlib.Path('tests/processing/2_mix/Stage 0 Test Good.m4a')
         assert out_0.exists()
         assert out_1.exists()
 
@@ -127,9 +124,8 @@ class TestGoldenPath:
             Expected Behavior:
                 - Complete pre-processing, command execution, and post-processing with no errors
                 - Retrieve metadata from movie_details.json
-                - Stereo mix will be muxed into the mkv file
+                - Stereo mix will be muxed into the mkv file, written straight into stage_3
                 - Stereo mix file will be deleted
-                - mkv file will be moved to stage_3
 
             Expected Values:
                 - intervene         -> False
@@ -138,8 +134,7 @@ class TestGoldenPath:
                 - metadata['title'] -> 'Full Pipeline Test Good'
 
             Expected Outputs:
-                - 'tests/processing/2_mix/Stage 0 Test Good.mkv'
-                - 'tests/processing/3_review/Stage 0 Test Good.mkv'
+                - 'tests/processing/3_review/Full Pipeline Test Good (1066).mkv'
         """
         def _dork_metadata(mkv):
             mocked_metadata = {
@@ -161,15 +156,14 @@ class TestGoldenPath:
         assert self.mkv.metadata['title'] == 'Full Pipeline Test Good'
 
         self.mkv.run_commands()
-        out = pathlib.Path('tests/processing/2_mix/Full Pipeline Test Good (1066).mkv')
+        out = pathlib.Path('tests/processing/3_review/Full Pipeline Test Good (1066).mkv')
         assert out.exists()
 
         self.mkv.post_process()
-        moved = pathlib.Path('tests/processing/3_review/Full Pipeline Test Good (1066).mkv')
         mkv_artifact = pathlib.Path('tests/processing/2_mix/Stage 0 Test Good.mkv')
         m4a_artifact = pathlib.Path('tests/processing/2_mix/Stage 0 Test Good.m4a')
         assert self.mkv.state.assoc_files.get('stereo_mix') is None
-        assert moved.exists()
+        assert out.exists()
         assert mkv_artifact.exists() is False
         assert m4a_artifact.exists() is False
 
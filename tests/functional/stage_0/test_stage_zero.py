@@ -144,7 +144,7 @@ class TestGoldenPath:
             '-map', '0:0', '-map', '0:1', '-map_metadata', '0', '-metadata',
             'title=Stage 0 Test Good', '-metadata:s:v:0', 'title=h264 Remux',
             '-metadata:s:a:0', 'title=DTS-HD MA 7.1', '-c', 'copy',
-            'tests\\processing\\0_analyze\\Stage 0 Test Good.mkv'
+            '-f', 'matroska', 'tests\\processing\\1_remux\\Stage 0 Test Good.mkv.part'
         ]
 
         assert len(self.mkv.cmd_list) == 1
@@ -154,10 +154,10 @@ class TestGoldenPath:
         """ Command Execution for Stage_0
 
             Expected behavior:
-                - Stage 1 MKV generated successfully
+                - Stage 1 MKV generated successfully, straight into the next stage directory
         """
         # This is where the output file should be
-        out = pathlib.Path('tests/processing/0_analyze/Stage 0 Test Good.mkv')
+        out = pathlib.Path('tests/processing/1_remux/Stage 0 Test Good.mkv')
         self.mkv.run_commands()
         assert out.exists()
 
@@ -126,7 +126,7 @@ class TestGoldenPath:
 
         expected_1 = [
             'qaac64', '--verbose', '--tvbr', '127', '--quality', '2', '--rate', 'keep', '--ignorelength',
-            '--no-delay', '-', '-o', 'tests\\processing\\1_remux\\Stage 1 Test Good.m4a'
+            '--no-delay', '-', '-o', 'tests\\processing\\2_mix\\Stage 1 Test Good.m4a.part'
         ]
 
         assert len(self.mkv.cmd_list) == 2
@@ -140,9 +140,9 @@ class TestGoldenPath:
                 - Stereo mix is extracted and encoded
 
             Expected Outputs:
-                - 1_remux/Stage 1 Test Good.m4a
+                - 2_mix/Stage 1 Test Good.m4a
         """
-        out = pathlib.Path('tests/processing/1_remux/Stage 1 Test Good.m4a')
+        out = pathlib.Path('tests/processing/2_mix/Stage 1 Test Good.m4a')
         self.mkv.run_commands()
         assert out.exists()
 
@@ -150,7 +150,7 @@ class TestGoldenPath:
         """ Post-processing for stage_0
 
             Expected Behavior:
-                - Stage 1 MKV and Stereo mix file will be moved to 2_mix
+                - Stage 1 MKV will be moved to 2_mix to join the stereo mix
         """
         # Expected locations after post processing
         out_0 = pathlib.Path('tests/processing/2_mix/Stage 1 Test Good.mkv')
@@ -148,7 +148,8 @@ class TestGoldenPath:
             '-metadata', 'imdb_id=tt0123456',
             '-metadata:s:a:1', 'language=eng', '-metadata:s:a:1', "title=Frank's Stereo Mix",
             '-metadata:s:a:1', 'encoder=qaac 2.63, CoreAudioToolbox 7.10.9.0, AAC-LC Encoder, TVBR q127, Quality 96',
-            '-disposition:a:1', 'none', 'tests\\processing\\2_mix\\Stage 2 Test Good (1066).mkv'
+            '-disposition:a:1', 'none',
+            '-f', 'matroska', 'tests\\processing\\3_review\\Stage 2 Test Good (1066).mkv.part'
         ]
 
         assert len(self.mkv.cmd_list) == 1
@@ -161,10 +162,10 @@ class TestGoldenPath:
                 - Stereo mix is muxed into the mkv container
 
             Expected Outputs:
-                - 2_mix/Stage 2 Test Good (1066).mkv
+                - 3_review/Stage 2 Test Good (1066).mkv
         """
 
-        out = pathlib.Path('tests/processing/2_mix/Stage 2 Test Good (1066).mkv')
+        out = pathlib.Path('tests/processing/3_review/Stage 2 Test Good (1066).mkv')
         self.mkv.run_commands()
         assert out.exists()
 
@@ -0,0 +1,40 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from mkvremux.avsync import estimate_lag
+
+
+class TestEstimateLag:
+    """ Test that envelope cross-correlation finds the right offset """
+
+    @pytest.fixture
+    def env(self):
+        rng = np.random.RandomState(1066)
+        return rng.rand(8000)
+
+    def test_aligned(self, env):
+        """ Do identical envelopes have zero lag?
+
+            Expected values:
+                - lag   -> 0
+        """
+        assert estimate_lag(env, env.copy(), 400) == 0
+
+    def test_late(self, env):
+        """ Is a delayed envelope detected with the right sign?
+
+            Expected values:
+                - lag   -> 16 (40ms at 400 Hz)
+        """
+        late = np.concatenate([np.zeros(16), env[:-16]])
+        assert estimate_lag(late, env, 400) == 16
+
+    def test_early(self, env):
+        """ Is an early envelope detected with the right sign?
+
+            Expected values:
+                - lag   -> -16
+        """
+        early = np.concatenate([env[16:], np.zeros(16)])
+        assert estimate_lag(early, env, 400) == -16
@@ -0,0 +1,31 @@
+from mkvremux import cache
+
+
+class TestCache:
+    """ Test the page cache helpers on a small file """
+
+    def test_snapshot(self, tmp_path):
+        """ Do we get residency for every existing file and skip missing ones?
+
+            Expected values:
+                - resident has one entry, between 0 and 1 (or -1 where unsupported)
+        """
+        path = tmp_path.joinpath('Default Test.mkv')
+        path.write_bytes(b'\x00' * 65536)
+        missing = tmp_path.joinpath('Missing.mkv')
+
+        stats = cache.snapshot([path, missing])
+        assert list(stats['resident']) == [str(path)]
+        assert stats['resident'][str(path)] == -1.0 or 0.0 <= stats['resident'][str(path)] <= 1.0
+
+    def test_hints(self, tmp_path):
+        """ Can hints be issued without touching the contents?
+
+            Expected behavior:
+                - No errors, file unchanged
+        """
+        path = tmp_path.joinpath('Default Test.mkv')
+        path.write_bytes(b'\x1a' * 65536)
+        cache.prefetch(path)
+        cache.drop([path])
+        assert path.read_bytes() == b'\x1a' * 65536
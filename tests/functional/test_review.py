@@ -0,0 +1,35 @@
+import pathlib
+
+from mkvremux.review import bundle_path, format_table
+
+
+class TestBundle:
+    """ Test the pieces of the review bundle that don't need ffmpeg """
+
+    def test_bundle_path(self):
+        """ Are bundle files named after the mkv and kept next to it?
+
+            Expected values:
+                - 'tests/processing/3_review/Stage 2 Test Good (1066).review.jpg'
+        """
+        mkv = pathlib.Path('tests/processing/3_review/Stage 2 Test Good (1066).mkv')
+        sheet = bundle_path(mkv, '.jpg')
+        assert sheet.as_posix() == 'tests/processing/3_review/Stage 2 Test Good (1066).review.jpg'
+
+    def test_format_table(self):
+        """ Is the stream table rendered one stream per line with aligned columns?
+
+            Expected values:
+                - 3 lines (header + 2 streams)
+                - Columns line up
+        """
+        table = [
+            {'index': 0, 'type': 'video', 'codec': 'h264', 'channels': '', 'language': 'eng',
+             'title': 'h264 Remux', 'default': 1, 'forced': 0},
+            {'index': 1, 'type': 'audio', 'codec': 'dts', 'channels': 8, 'language': 'eng',
+             'title': 'DTS-HD MA 7.1', 'default': 1, 'forced': 0}
+        ]
+        lines = format_table(table).splitlines()
+        assert len(lines) == 3
+        assert lines[0].startswith('index  type   codec')
+        assert lines[1].index('h264') == lines[2].index('dts')
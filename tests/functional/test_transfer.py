@@ -0,0 +1,98 @@
+import pytest
+
+from mkvremux import transfer
+
+
+@pytest.fixture
+def src(tmp_path):
+    """ A small stand-in for an mkv """
+    src_dir = tmp_path.joinpath('0_analyze')
+    src_dir.mkdir()
+    path = src_dir.joinpath('Default Test.mkv')
+    path.write_bytes(b'\x1a\x45\xdf\xa3' * 4096)
+    return path
+
+
+@pytest.fixture
+def dst_dir(tmp_path):
+    path = tmp_path.joinpath('1_remux')
+    path.mkdir()
+    return path
+
+
+class TestMove:
+    """ Test that files are moved with the right mechanism and never lost """
+
+    def test_same_device(self, src, dst_dir):
+        """ Is a move on the same device a plain rename?
+
+            Expected values:
+                - method        -> 'rename'
+                - source gone, destination present
+        """
+        ret = transfer.move(src, dst_dir)
+        assert ret.method == 'rename'
+        assert not src.exists()
+        assert dst_dir.joinpath('Default Test.mkv').exists()
+
+    def test_cross_device(self, src, dst_dir, monkeypatch):
+        """ Is a cross device move copied, checked and only then unlinked?
+
+            Expected values:
+                - method        -> not 'rename'
+                - contents identical
+                - no .part file left behind
+        """
+        data = src.read_bytes()
+        monkeypatch.setattr(transfer, '_same_device', lambda *args: False)
+        ret = transfer.move(src, dst_dir, verify_hash=True)
+        assert ret.method != 'rename'
+        assert ret.size == len(data)
+        assert not src.exists()
+        assert dst_dir.joinpath('Default Test.mkv').read_bytes() == data
+        assert list(dst_dir.iterdir()) == [dst_dir.joinpath('Default Test.mkv')]
+
+    def test_no_space(self, src, dst_dir, monkeypatch):
+        """ Do we refuse a cross device move that would fill the target?
+
+            Expected behavior:
+                - RuntimeError
+                - Source untouched
+        """
+        monkeypatch.setattr(transfer, '_same_device', lambda *args: False)
+        monkeypatch.setattr(transfer, 'free_bytes', lambda *args: 100)
+        with pytest.raises(RuntimeError) as exc:
+            transfer.move(src, dst_dir)
+        assert 'Not enough space' in str(exc.value)
+        assert src.exists()
+        assert list(dst_dir.iterdir()) == []
+
+    def test_exists(self, src, dst_dir):
+        """ Do we refuse to move a file over one that's already there?
+
+            Expected behavior:
+                - RuntimeError
+                - Both files untouched
+        """
+        dst_dir.joinpath('Default Test.mkv').write_bytes(b'other')
+        with pytest.raises(RuntimeError) as exc:
+            transfer.move(src, dst_dir)
+        assert 'already exists' in str(exc.value)
+        assert src.exists()
+        assert dst_dir.joinpath('Default Test.mkv').read_bytes() == b'other'
+
+    def test_kernel_copy_stops_early(self, src, dst_dir, monkeypatch):
+        """ Does a kernel copy that reports 0 bytes early fall back instead of failing the move?
+
+            Expected values:
+                - method        -> 'copy'
+                - contents identical
+        """
+        data = src.read_bytes()
+        monkeypatch.setattr(transfer, '_same_device', lambda *args: False)
+        monkeypatch.setattr(transfer.os, 'copy_file_range', lambda *args: 0, raising=False)
+        monkeypatch.setattr(transfer.os, 'sendfile', lambda *args: 0, raising=False)
+
+        ret = transfer.move(src, dst_dir)
+        assert ret.method == 'copy'
+        assert dst_dir.joinpath('Default Test.mkv').read_bytes() == data
@@ -0,0 +1,196 @@
+import json
+
+import pytest
+
+from mkvremux import verify
+from mkvremux.verify import compare_stats, tagged_stats, verify_samples, window_hashes
+
+
+def _stats(codec_type, packets, size, duration):
+    return {'codec_type': codec_type, 'packets': packets, 'bytes': size, 'duration': duration}
+
+
+class TestCompareStats:
+    """ Test that source and output stream stats are compared correctly """
+
+    def test_identical(self):
+        """ Does a perfect copy pass?
+
+            Expected values:
+                - mismatches    -> []
+        """
+        src = [_stats('video', 120, 1000000, 5.005), _stats('audio', 157, 80000, 5.008)]
+        out = [_stats('video', 120, 1000000, 5.005), _stats('audio', 157, 80000, 5.008)]
+        assert compare_stats(src, out, 0.5) == []
+
+    def test_truncated(self):
+        """ Is a short write caught?
+
+            Expected values:
+                - One mismatch each for packets, bytes and duration
+        """
+        src = [_stats('video', 120, 1000000, 5.005)]
+        out = [_stats('video', 60, 500000, 2.502)]
+        mismatches = compare_stats(src, out, 0.5)
+        assert len(mismatches) == 3
+        assert 'packets' in mismatches[0]
+        assert 'bytes' in mismatches[1]
+        assert 'duration' in mismatches[2]
+
+    def test_duration_tolerance(self):
+        """ Are small duration differences (e.g. muxer rounding) ignored?
+
+            Expected values:
+                - mismatches    -> []
+        """
+        src = [_stats('audio', 157, 80000, 5.008)]
+        out = [_stats('audio', 157, 80000, 5.000)]
+        assert compare_stats(src, out, 0.5) == []
+
+    def test_missing_stream(self):
+        """ Is a dropped stream caught?
+
+            Expected values:
+                - Stream count mismatch reported
+        """
+        src = [_stats('video', 120, 1000000, 5.005), _stats('audio', 157, 80000, 5.008)]
+        out = [_stats('video', 120, 1000000, 5.005)]
+        mismatches = compare_stats(src, out, 0.5)
+        assert mismatches == ['Expected 2 streams in output, found 1']
+
+    def test_wrong_type(self):
+        """ Are streams out of order caught?
+
+            Expected values:
+                - Stream type mismatch reported
+        """
+        src = [_stats('video', 120, 1000000, 5.005)]
+        out = [_stats('audio', 120, 1000000, 5.005)]
+        mismatches = compare_stats(src, out, 0.5)
+        assert mismatches == ['Stream 0: expected video stream, found audio']
+
+    def test_bytes_unknown(self):
+        """ Are byte totals only compared when both sides have them (the output's are counted without sizes)?
+
+            Expected values:
+                - mismatches    -> [] for unknown bytes, a packets mismatch is still caught
+        """
+        src = [_stats('video', 120, 1000000, 5.005)]
+        assert compare_stats(src, [_stats('video', 120, None, 5.005)], 0.5) == []
+        assert len(compare_stats(src, [_stats('video', 119, None, 5.005)], 0.5)) == 1
+
+
+class _Ret:
+    returncode = 0
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+
+
+class TestTaggedStats:
+    """ Test that source totals are read from the statistics tags in the track headers """
+
+    def test_tags(self, monkeypatch):
+        """ Are NUMBER_OF_FRAMES, NUMBER_OF_BYTES and DURATION used, language suffix or not?
+
+            Expected values:
+                - stats[0]      -> video, 120 packets, 1000000 bytes, 5.005s
+                - stats[1]      -> audio, 157 packets, 80000 bytes, 5.008s
+        """
+        probe = {'streams': [
+            {'index': 0, 'codec_type': 'video',
+             'tags': {'NUMBER_OF_FRAMES': '120', 'NUMBER_OF_BYTES': '1000000', 'DURATION': '00:00:05.005000000'}},
+            {'index': 1, 'codec_type': 'audio',
+             'tags': {'NUMBER_OF_FRAMES-eng': '157', 'NUMBER_OF_BYTES-eng': '80000', 'DURATION-eng': '00:00:05.008'}}
+        ], 'format': {'duration': '5.010000'}}
+
+        monkeypatch.setattr('mkvremux.verify.run', lambda *args, **kwargs: _Ret(json.dumps(probe)))
+        stats = tagged_stats('foo.mkv')
+        assert stats[0] == _stats('video', 120, 1000000, 5.005)
+        assert stats[1]['packets'] == 157
+        assert stats[1]['bytes'] == 80000
+        assert abs(stats[1]['duration'] - 5.008) < 1e-9
+
+    def test_untagged(self, monkeypatch):
+        """ Is a stream without statistics tags reported so the packet index gets walked instead?
+
+            Expected values:
+                - stats         -> None
+        """
+        probe = {'streams': [
+            {'index': 0, 'codec_type': 'video', 'tags': {'NUMBER_OF_FRAMES': '120', 'NUMBER_OF_BYTES': '1000000'}},
+            {'index': 1, 'codec_type': 'audio', 'tags': {'language': 'eng'}}
+        ], 'format': {'duration': '5.010000'}}
+
+        monkeypatch.setattr('mkvremux.verify.run', lambda *args, **kwargs: _Ret(json.dumps(probe)))
+        assert tagged_stats('foo.mkv') is None
+
+
+class TestWindowHashes:
+    """ Test that framemd5 output is attributed to the right source streams """
+
+    def test_parse(self, monkeypatch):
+        """ Are framemd5 stream numbers (which follow -map order) mapped back to container indices?
+
+            Expected values:
+                - hashes[4]     -> ['aaa', 'bbb']
+                - hashes[1]     -> ['ccc']
+        """
+        framemd5 = '\n'.join([
+            '#format: frame checksums',
+            '#stream#, dts,        pts, duration,     size, hash',
+            '0,          0,          0,     1001,  3110400, aaa',
+            '1,          0,          0,     1024,     4096, ccc',
+            '0,       1001,       1001,     1001,  3110400, bbb',
+        ])
+
+        class _Ret:
+            returncode = 0
+            stdout = framemd5
+
+        monkeypatch.setattr('mkvremux.verify.run', lambda *args, **kwargs: _Ret())
+        hashes = window_hashes('foo.mkv', 10.0, 2.0, [4, 1])
+        assert hashes[4] == ['aaa', 'bbb']
+        assert hashes[1] == ['ccc']
+
+
+class TestVerifySamples:
+    """ Test that sampled windows are compared at the same moment of source and output """
+
+    @pytest.fixture
+    def probe(self, monkeypatch):
+        """ A source that starts 1.5s later than its remux (e.g. stage 0 reset the start time) """
+        starts = {'src.mkv': 1.5, 'out.mkv': 0.0}
+        frames = {'src.mkv': {11.5: ['aaa', 'bbb'], 31.5: ['ccc']}, 'out.mkv': {10.0: ['aaa', 'bbb'], 30.0: ['ccc']}}
+        calls = []
+
+        def _window(path, start, window, indices):
+            calls.append((path, start))
+            return {_: frames[path].get(start, []) for _ in indices}
+
+        monkeypatch.setattr(verify, 'stream_types', lambda path: {0: 'video', 1: 'subtitle'})
+        monkeypatch.setattr(verify, 'container_duration', lambda path: 60.0)
+        monkeypatch.setattr(verify, 'start_time', lambda path: starts[path])
+        monkeypatch.setattr(verify, 'keyframe_times', lambda path, count, duration, seed: [10.0, 30.0])
+        monkeypatch.setattr(verify, 'window_hashes', _window)
+        return calls
+
+    def test_aligned(self, probe):
+        """ Is each source window taken at the output's seek point plus the difference in start times?
+
+            Expected values:
+                - mismatches    -> []
+                - source seeks  -> 11.5, 31.5
+        """
+        assert verify_samples('out.mkv', [('src.mkv', None)], 2, 2.0) == []
+        assert [start for path, start in probe if path == 'src.mkv'] == [11.5, 31.5]
+
+    def test_no_keyframes(self, probe, monkeypatch):
+        """ Does a sample run that finds nothing to sample fail instead of passing?
+
+            Expected values:
+                - One mismatch, nothing decoded
+        """
+        monkeypatch.setattr(verify, 'keyframe_times', lambda path, count, duration, seed: [])
+        assert len(verify_samples('out.mkv', [('src.mkv', None)], 2, 2.0)) == 1
+        assert probe == []
@@ -0,0 +1,62 @@
+from mkvremux.archive import Archive, Evictor
+
+
+class TestArchive:
+    """ Test the archive index and eviction of archived originals """
+
+    @staticmethod
+    def _archive(tmp_path, names):
+        archive_dir = tmp_path.joinpath('_archive')
+        archive_dir.mkdir()
+        archive = Archive(tmp_path)
+        for name in names:
+            original = archive_dir.joinpath('orig_' + name + '.mkv')
+            original.write_bytes(b'\x00' * 1024)
+            archive.add(original, name)
+        return archive
+
+    def test_only_verified_evicted(self, tmp_path):
+        """ Are only originals with a verified output evicted, oldest first?
+
+            Expected values:
+                - evicted   -> [orig_Old.mkv, orig_New.mkv] (in that order)
+                - remaining -> orig_Unverified.mkv, still in the index
+        """
+        archive = self._archive(tmp_path, ['New', 'Unverified', 'Old'])
+        archive.entries['Old']['archived'] -= 100
+        archive.mark_verified('Old', tmp_path.joinpath('3_review', 'Old.mkv'))
+        archive.mark_verified('New', tmp_path.joinpath('3_review', 'New.mkv'))
+
+        # A high-water mark of 0 can never be met, so everything eligible goes
+        evicted = Evictor([archive], 0.0).run_once()
+
+        assert [_.name for _ in evicted] == ['orig_Old.mkv', 'orig_New.mkv']
+        assert list(archive.entries) == ['Unverified']
+        assert tmp_path.joinpath('_archive', 'orig_Unverified.mkv').exists()
+
+    def test_under_high_water(self, tmp_path):
+        """ Is nothing evicted while the disk is under the high-water mark?
+
+            Expected values:
+                - evicted   -> []
+        """
+        archive = self._archive(tmp_path, ['Default Test'])
+        archive.mark_verified('Default Test', tmp_path.joinpath('3_review', 'Default Test.mkv'))
+
+        assert archive.evict(1.0) == []
+        assert tmp_path.joinpath('_archive', 'orig_Default Test.mkv').exists()
+
+    def test_index_persisted(self, tmp_path):
+        """ Does the index survive a restart and drop originals that went away?
+
+            Expected values:
+                - entries   -> only 'Kept', still verified
+        """
+        archive = self._archive(tmp_path, ['Kept', 'Gone'])
+        archive.mark_verified('Kept', tmp_path.joinpath('3_review', 'Kept.mkv'))
+        tmp_path.joinpath('_archive', 'orig_Gone.mkv').unlink()
+
+        reloaded = Archive(tmp_path)
+        reloaded.scan()
+        assert list(reloaded.entries) == ['Kept']
+        assert reloaded.entries['Kept']['verified']
@@ -0,0 +1,277 @@
+import os
+import json
+
+from mkvremux.catalog import Catalog, ambiguous, normalize, resolve, resolution_report
+from mkvremux.catalog_db import SqliteCatalog
+
+
+def _write(path, movies):
+    with open(str(path), 'w') as f:
+        json.dump({'Movies': movies}, f)
+
+
+class TestCatalog:
+    """ Test the indexed movie catalog """
+
+    movies = [
+        {'title': 'The Thing', 'year': '1982', 'imdb_id': 'tt0084787'},
+        {'title': 'Blade Runner 2049', 'year': '2017', 'imdb_id': 'tt1856101'},
+        {'title': 'Dune', 'year': '1984', 'imdb_id': 'tt0087182'},
+        {'title': 'Dune', 'year': '2021', 'imdb_id': 'tt1160419'},
+    ]
+
+    def test_normalize(self):
+        """ Are case, punctuation, ':' and leading articles ignored?
+
+            Expected values:
+                - 'Blade Runner: 2049'  -> 'blade runner 2049'
+                - 'The Thing'           -> 'thing'
+                - 'A'                   -> 'a'
+        """
+        assert normalize('Blade Runner: 2049') == 'blade runner 2049'
+        assert normalize('The Thing') == 'thing'
+        assert normalize('A') == 'a'
+
+    def test_lookup(self, tmp_path):
+        """ Are exact, normalized, year and imdb_id lookups answered from the index?
+
+            Expected values:
+                - 'The Thing'           -> 1982
+                - 'thing'               -> 1982
+                - 'Blade Runner: 2049'  -> tt1856101
+                - 'Dune', year 2021     -> tt1160419
+                - 'Dune'                -> None, two matches to choose from
+                - 'Nope'                -> None
+        """
+        path = tmp_path.joinpath('movie_details.json')
+        _write(path, self.movies)
+        catalog = Catalog(path)
+
+        assert catalog.lookup('The Thing')['year'] == '1982'
+        assert catalog.lookup('thing')['year'] == '1982'
+        assert catalog.lookup('Blade Runner: 2049')['imdb_id'] == 'tt1856101'
+        assert catalog.lookup('Dune', '2021')['imdb_id'] == 'tt1160419'
+        assert catalog.lookup('Nope') is None
+        assert catalog.lookup('Dune') is None
+        assert [_['year'] for _ in catalog.matches('dune')] == ['1984', '2021']
+        assert catalog.by_imdb('tt0087182')['year'] == '1984'
+        assert len(catalog.by_year('2017')) == 1
+
+        assert catalog.timings['loads'] == 1
+        assert catalog.timings['lookups'] == 7
+
+    def test_reload_on_change(self, tmp_path):
+        """ Is the catalog reloaded when the file changes?
+
+            Expected values:
+                - loads     -> 2
+                - 'Brazil'  -> found after the change
+        """
+        path = tmp_path.joinpath('movie_details.json')
+        _write(path, self.movies)
+        catalog = Catalog(path)
+        assert catalog.lookup('Brazil') is None
+
+        _write(path, self.movies + [{'title': 'Brazil', 'year': '1985', 'imdb_id': 'tt0088846'}])
+        stat = os.stat(str(path))
+        os.utime(str(path), (stat.st_atime, stat.st_mtime + 10))
+
+        assert catalog.lookup('Brazil')['year'] == '1985'
+        assert catalog.timings['loads'] == 2
+
+
+class TestFuzzy:
+    """ Test ranked fuzzy matching through the trigram index """
+
+    movies = [
+        {'title': 'Blade Runner', 'year': '1982'},
+        {'title': 'Blade Runner 2049', 'year': '2017'},
+        {'title': 'Dune', 'year': '1984'},
+        {'title': 'Dune', 'year': '2021'},
+    ]
+
+    def test_ranked(self, tmp_path):
+        """ Is the closest title ranked first, with its edit distance?
+
+            Expected values:
+                - 'Blade Runer 2049'    -> Blade Runner 2049, distance 1, not ambiguous
+                - 'Nothing Like It'     -> []
+        """
+        path = tmp_path.joinpath('movie_details.json')
+        _write(path, self.movies)
+        catalog = Catalog(path)
+
+        candidates = catalog.fuzzy('Blade Runer 2049')
+        assert candidates[0].movie['title'] == 'Blade Runner 2049'
+        assert candidates[0].distance == 1
+        assert not ambiguous(candidates)
+        assert catalog.fuzzy('Nothing Like It') == []
+
+    def test_ambiguous(self, tmp_path):
+        """ Are equally good matches reported as ambiguous unless the year settles it?
+
+            Expected values:
+                - 'Dunes'           -> ambiguous (1984 and 2021)
+                - 'Dunes', 2021     -> Dune (2021), not ambiguous
+        """
+        path = tmp_path.joinpath('movie_details.json')
+        _write(path, self.movies)
+        catalog = Catalog(path)
+
+        assert ambiguous(catalog.fuzzy('Dunes'))
+
+        candidates = catalog.fuzzy('Dunes', year='2021')
+        assert not ambiguous(candidates)
+        assert candidates[0].movie['year'] == '2021'
+
+
+class TestSqliteCatalog:
+    """ Test the SQLite backed catalog and its incremental import """
+
+    movies = [
+        {'title': 'The Thing', 'year': '1982', 'imdb_id': 'tt0084787'},
+        {'title': 'Blade Runner 2049', 'year': '2017', 'imdb_id': 'tt1856101'},
+        {'title': 'Dune', 'year': '1984', 'imdb_id': 'tt0087182'},
+    ]
+
+    def test_lookup(self, tmp_path):
+        """ Are lookups answered from the database the same way as from memory?
+
+            Expected values:
+                - 'thing'               -> 1982
+                - 'Blade Runer: 2049'   -> Blade Runner 2049, distance 1
+                - imported              -> 3 added
+        """
+        path = tmp_path.joinpath('movie_details.json')
+        _write(path, self.movies)
+        catalog = SqliteCatalog(tmp_path.joinpath('movie_details.db'), path)
+
+        assert catalog.lookup('thing')['year'] == '1982'
+        assert catalog.fuzzy('Blade Runer: 2049')[0].movie['imdb_id'] == 'tt1856101'
+        assert catalog.by_imdb('tt0087182')['title'] == 'Dune'
+        assert catalog.imported == {'added': 3, 'changed': 0, 'removed': 0}
+        assert catalog.size() == 3
+
+    def test_fuzzy_matches_memory(self, tmp_path):
+        """ Does the database find the same candidates as the in-memory index, even among hundreds of titles that
+        share most of their trigrams with the query?
+
+            Expected values:
+                - fuzzy()       -> same movies and distances from both catalogs, for every query
+        """
+        movies = [{'title': 'Star Trek Chapter {}'.format(_), 'year': str(1950 + _ % 70)} for _ in range(400)]
+        movies += [{'title': 'Star Trek Chapters', 'year': '1999'}, {'title': 'Stark Trek', 'year': '2001'},
+                   {'title': 'Heat', 'year': '1995'}, {'title': 'Heist', 'year': '2001'}]
+        path = tmp_path.joinpath('movie_details.json')
+        _write(path, movies)
+
+        memory = Catalog(path)
+        database = SqliteCatalog(tmp_path.joinpath('movie_details.db'), path)
+        for query in ['Star Trek Chapter', 'Star Trek Chapter 99', 'Star Trek', 'Heat', 'Hest']:
+            want = [(_.movie['title'], _.distance) for _ in memory.fuzzy(query, limit=20)]
+            assert [(_.movie['title'], _.distance) for _ in database.fuzzy(query, limit=20)] == want
+            assert want
+
+    def test_short_query(self, tmp_path):
+        """ Are short queries, with too few trigrams to filter on, answered the same way by both catalogs?
+
+            Expected values:
+                - 'Ut'          -> It and Up, distance 1, ambiguous
+        """
+        movies = [{'title': _, 'year': '2000'} for _ in ['It', 'Up', 'Her', 'Heat', 'Alien', 'Aliens', 'Se7en']]
+        path = tmp_path.joinpath('movie_details.json')
+        _write(path, movies)
+
+        memory = Catalog(path)
+        database = SqliteCatalog(tmp_path.joinpath('movie_details.db'), path)
+        for catalog in [memory, database]:
+            candidates = catalog.fuzzy('Ut')
+            assert [(_.movie['title'], _.distance) for _ in candidates] == [('It', 1), ('Up', 1)]
+            assert ambiguous(candidates)
+
+    def test_incremental_import(self, tmp_path):
+        """ Are only the differences written when the catalog file changes?
+
+            Expected values:
+                - imported      -> 1 added, 1 changed, 1 removed
+                - reopened      -> nothing imported, same contents
+        """
+        path = tmp_path.joinpath('movie_details.json')
+        db = tmp_path.joinpath('movie_details.db')
+        _write(path, self.movies)
+        SqliteCatalog(db, path).refresh()
+
+        edited = [dict(self.movies[0], desc='Antarctica'), self.movies[1],
+                  {'title': 'Brazil', 'year': '1985', 'imdb_id': 'tt0088846'}]
+        _write(path, edited)
+        stat = os.stat(str(path))
+        os.utime(str(path), (stat.st_atime, stat.st_mtime + 10))
+
+        catalog = SqliteCatalog(db, path)
+        catalog.refresh()
+        assert catalog.imported == {'added': 1, 'changed': 1, 'removed': 1}
+        assert catalog.lookup('The Thing')['desc'] == 'Antarctica'
+        assert catalog.lookup('Dune') is None
+
+        reopened = SqliteCatalog(db, path)
+        reopened.refresh()
+        assert reopened.imported == {'added': 0, 'changed': 0, 'removed': 0}
+        assert reopened.lookup('Brazil')['year'] == '1985'
+
+
+class TestResolve:
+    """ Test batch metadata resolution """
+
+    def test_batch(self, tmp_path):
+        """ Is every title in the batch sorted into exact, fuzzy, ambiguous or missing?
+
+            Expected values:
+                - 'The Thing'       -> exact
+                - 'Blade Runer'     -> fuzzy, Blade Runner
+                - 'Dunes'           -> ambiguous
+                - 'Dune'            -> ambiguous, both 1984 and 2021 as candidates
+                - 'Nope'            -> missing
+        """
+        path = tmp_path.joinpath('movie_details.json')
+        _write(path, [
+            {'title': 'The Thing', 'year': '1982'},
+            {'title': 'Blade Runner', 'year': '1982'},
+            {'title': 'Dune', 'year': '1984'},
+            {'title': 'Dune', 'year': '2021'},
+        ])
+
+        resolved = resolve(['The Thing', 'Blade Runer', 'Dunes', 'Dune', 'Nope', 'The Thing'], Catalog(path))
+
+        assert {_: resolved[_].status for _ in resolved} == {
+            'The Thing': 'exact', 'Blade Runer': 'fuzzy', 'Dunes': 'ambiguous', 'Dune': 'ambiguous', 'Nope': 'missing'}
+        assert [_.movie['year'] for _ in resolved['Dune'].candidates] == ['1984', '2021']
+        assert resolved['Blade Runer'].movie['title'] == 'Blade Runner'
+        assert resolved['Nope'].movie is None
+        assert 'Missing: 1' in resolution_report(resolved)
+
+    def test_fetched_once(self, tmp_path):
+        """ Is a movie the provider finds for several titles, or that the catalog already has, only added once?
+
+            Expected values:
+                - both titles       -> fetched
+                - catalog file      -> one Blade Runner 2049, one Heat
+                - 'Heat' afterwards -> exact, not ambiguous
+        """
+        blade_runner = {'title': 'Blade Runner 2049', 'year': '2017', 'imdb_id': 'tt1856101'}
+        heat = {'title': 'Heat', 'year': '1995'}
+
+        class _Provider:
+            def fetch(self, titles):
+                return {_: dict(heat) if _ == 'LA Heist' else dict(blade_runner) for _ in titles}
+
+        path = tmp_path.joinpath('movie_details.json')
+        _write(path, [heat])
+        catalog = Catalog(path)
+
+        resolved = resolve(['BR2049', 'Replicant Sequel', 'LA Heist'], catalog, provider=_Provider())
+        assert {_.status for _ in resolved.values()} == {'fetched'}
+
+        with open(str(path)) as f:
+            titles = sorted(_['title'] for _ in json.load(f)['Movies'])
+        assert titles == ['Blade Runner 2049', 'Heat']
+        assert resolve(['Heat'], catalog)['Heat'].status == 'exact'
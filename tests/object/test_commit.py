@@ -0,0 +1,43 @@
+import pytest
+
+from mkvremux import MKV
+from mkvremux.config import settings
+from mkvremux.state import stages
+
+
+class TestCommit:
+    """ Test that a stage's outputs are only committed once its source can move on """
+
+    def test_archive_taken(self, tmp_path, monkeypatch):
+        """ Is a stage 0 whose original can't be archived stopped before its output gets its real name?
+
+            Expected values:
+                - RuntimeError 'Destination already exists'
+                - output        -> still under its temporary name
+        """
+        for stage_dir in ['0_analyze', '1_remux', '_archive']:
+            tmp_path.joinpath(stage_dir).mkdir()
+        tmp_path.joinpath('0_analyze', 'Commit Test.mkv').write_bytes(b'\x00' * 1024)
+        tmp_path.joinpath('_archive', 'Commit Test.mkv').write_bytes(b'\x00' * 1024)
+
+        mkv = MKV(tmp_path.joinpath('0_analyze', 'Commit Test.mkv'), stages.STAGE_0)
+        mkv.media_title = 'Commit Test'
+        partial = mkv.state.plan_output('mkv', 'Commit Test.mkv')
+
+        class _Ret:
+            returncode = 0
+
+        def _command():
+            mkv.cmd_list = [['ffmpeg']]
+            partial.write_bytes(b'\x00' * 1024)
+
+        for setting in ['cache_hints', 'verify', 'stream_hashes']:
+            monkeypatch.setitem(settings, setting, False)
+        monkeypatch.setattr(mkv, '_set_command', _command)
+        monkeypatch.setattr('mkvremux.container.run', lambda *args, **kwargs: _Ret())
+
+        with pytest.raises(RuntimeError) as exc:
+            mkv.run_commands()
+        assert exc.value.args[0] == 'Destination already exists'
+        assert partial.exists()
+        assert not tmp_path.joinpath('1_remux', 'Commit Test.mkv').exists()
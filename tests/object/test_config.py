@@ -0,0 +1,31 @@
+import pathlib
+
+from mkvremux.config import settings, resource_path
+
+
+class TestResourcePath:
+    """ Test that resource paths don't depend on the directory the driver was started from """
+
+    def test_default(self, monkeypatch):
+        """ Do relative resources live in the first processing root by default?
+
+            Expected values:
+                - resource_path('resources/journal.jsonl')  -> <first root>/resources/journal.jsonl
+        """
+        monkeypatch.setitem(settings, 'resource_dir', None)
+        monkeypatch.setitem(settings, 'roots', ['/srv/remux', '/mnt/disk2/remux'])
+        assert resource_path('resources/journal.jsonl') == pathlib.Path('/srv/remux/resources/journal.jsonl')
+
+    def test_resource_dir(self, monkeypatch):
+        """ Is resource_dir used when set, and are absolute paths and None left alone?
+
+            Expected values:
+                - relative      -> under resource_dir
+                - absolute      -> unchanged
+                - None          -> None
+        """
+        monkeypatch.setitem(settings, 'resource_dir', '/etc/mkvremux')
+        expected = pathlib.Path('/etc/mkvremux/resources/movie_details.json')
+        assert resource_path('resources/movie_details.json') == expected
+        assert resource_path('/data/catalog.json') == pathlib.Path('/data/catalog.json')
+        assert resource_path(None) is None
@@ -0,0 +1,48 @@
+from mkvremux import utils
+from mkvremux.config import settings
+from mkvremux.fingerprint import FingerprintIndex, fingerprint
+
+
+class TestFingerprint:
+    """ Test partial content fingerprints and duplicate detection """
+
+    def test_fingerprint(self, tmp_path):
+        """ Do identical files match and a change in the middle not?
+
+            Expected values:
+                - copy          -> same fingerprint
+                - middle byte   -> different fingerprint
+        """
+        data = bytearray(b'\x1a\x45\xdf\xa3' * 1024 * 1024)
+        first = tmp_path.joinpath('first.mkv')
+        first.write_bytes(data)
+        copy = tmp_path.joinpath('copy.mkv')
+        copy.write_bytes(data)
+        data[len(data) // 2] ^= 0xff
+        changed = tmp_path.joinpath('changed.mkv')
+        changed.write_bytes(data)
+
+        assert fingerprint(first, chunk=4096, probe=False) == fingerprint(copy, chunk=4096, probe=False)
+        assert fingerprint(first, chunk=4096, probe=False) != fingerprint(changed, chunk=4096, probe=False)
+
+    def test_get_mkvs_skips_duplicates(self, tmp_path, monkeypatch):
+        """ Does get_mkvs() skip sources already processed and repeats within the batch?
+
+            Expected values:
+                - 'Brand New.mkv'   -> the only one kept
+        """
+        monkeypatch.setitem(settings, 'duplicates', 'skip')
+        monkeypatch.setitem(settings, 'fingerprint_index', str(tmp_path.joinpath('fingerprints.json')))
+
+        analyze = tmp_path.joinpath('0_analyze')
+        analyze.mkdir()
+        analyze.joinpath('Brand New.mkv').write_bytes(b'\x01' * 4096)
+        analyze.joinpath('Brand New Again.mkv').write_bytes(b'\x01' * 4096)
+        analyze.joinpath('Done Before.mkv').write_bytes(b'\x02' * 4096)
+
+        FingerprintIndex(settings['fingerprint_index']).add(fingerprint(analyze.joinpath('Done Before.mkv')),
+                                                            tmp_path.joinpath('_archive', 'orig_Done Before.mkv'))
+
+        kept = utils.get_mkvs(0, str(tmp_path))
+        assert len(kept) == 1
+        assert kept[0].state.cur_path.name in ['Brand New.mkv', 'Brand New Again.mkv']
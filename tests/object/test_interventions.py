@@ -0,0 +1,111 @@
+from mkvremux import MKV
+from mkvremux.interventions import InterventionQueue, context
+from mkvremux.journal import restore
+from mkvremux.mkvstream import MKVStream
+from mkvremux.state import stages
+
+
+def _parkable_mkv(root):
+    """ An MKV the way stage 0 leaves it when there are two audio streams to choose from """
+    for stage_dir in ['0_analyze', '1_remux', '2_mix']:
+        root.joinpath(stage_dir).mkdir()
+    root.joinpath('0_analyze', 'orig_Parked Test.mkv').write_bytes(b'\x00' * 1024)
+
+    mkv = MKV(root.joinpath('0_analyze', 'Parked Test.mkv'), stages.STAGE_0)
+    mkv.state.cur_path = root.joinpath('0_analyze', 'orig_Parked Test.mkv')
+    mkv.media_title = 'Parked Test'
+    mkv.audio = MKVStream('Audio')
+    mkv.audio.streams = [
+        {'index': 1, 'codec_name': 'truehd', 'channels': 8, 'tags': {'language': 'eng'}},
+        {'index': 2, 'codec_name': 'dts', 'channels': 6, 'tags': {'language': 'eng', 'title': 'DTS-HD MA'}}
+    ]
+    mkv.intervene['needed'] = True
+    mkv.intervene['reason']['audio_stream'] = True
+    return mkv
+
+
+class TestInterventionQueue:
+    """ Test that titles needing a decision are parked, answered and handed back """
+
+    def test_park(self, tmp_path):
+        """ Is a parked title waiting in the queue, with the stream table, under both of its paths?
+
+            Expected values:
+                - pending()     -> one entry, reason audio_stream, streams 1 and 2
+                - parked()      -> True for the original and the orig_ path, False for anything else
+                - reloaded      -> same entry from a second queue on the same file
+        """
+        mkv = _parkable_mkv(tmp_path)
+        queue = InterventionQueue(tmp_path.joinpath('interventions.json'))
+        queue.park(mkv, 'audio_stream', context(mkv, 'audio_stream'))
+
+        pending = queue.pending()
+        assert len(pending) == 1
+        assert pending[0]['reason'] == 'audio_stream'
+        assert [_['index'] for _ in pending[0]['context']['streams']] == [1, 2]
+        assert pending[0]['context']['streams'][1]['title'] == 'DTS-HD MA'
+
+        assert queue.parked(tmp_path.joinpath('0_analyze', 'Parked Test.mkv'))
+        assert queue.parked(tmp_path.joinpath('0_analyze', 'orig_Parked Test.mkv'))
+        assert not queue.parked(tmp_path.joinpath('0_analyze', 'Other.mkv'))
+
+        assert InterventionQueue(queue.path).pending() == pending
+
+    def test_answer(self, tmp_path):
+        """ Is an answered title handed out once, ready to be rebuilt, and only removed when it's done?
+
+            Expected values:
+                - pending()         -> [] once answered
+                - take_answered()   -> the entry with its answer, then [] the second time
+                - restored          -> stage 0, same title and audio streams
+                - done()            -> no longer parked
+        """
+        mkv = _parkable_mkv(tmp_path)
+        queue = InterventionQueue(tmp_path.joinpath('interventions.json'))
+        queue.park(mkv, 'audio_stream', context(mkv, 'audio_stream'))
+
+        # Answered from another process
+        InterventionQueue(queue.path).answer(str(mkv.state.init_path), '2')
+        assert queue.pending() != []
+        queue.reload()
+        assert queue.pending() == []
+
+        answered = queue.take_answered()
+        assert len(answered) == 1
+        assert answered[0]['answer'] == '2'
+        assert answered[0]['intervene']['reason']['audio_stream'] is True
+        assert queue.take_answered() == []
+        assert queue.parked(mkv.state.init_path)
+
+        restored = restore(answered[0]['record'])
+        assert restored.stage == stages.STAGE_0
+        assert restored.media_title == 'Parked Test'
+        assert restored.audio.stream_count == 2
+
+        queue.done(str(mkv.state.init_path))
+        assert not queue.parked(mkv.state.init_path)
+        assert InterventionQueue(queue.path).take_answered() == []
+
+    def test_restart(self, tmp_path):
+        """ Does an answer survive the driver stopping before its title committed anything?
+
+            Expected values:
+                - new queue, same file      -> the answered entry again
+                - carried_on() at stage 0   -> False (still parked)
+                - carried_on() at stage 1   -> True, and the entry is gone
+        """
+        mkv = _parkable_mkv(tmp_path)
+        queue = InterventionQueue(tmp_path.joinpath('interventions.json'))
+        queue.park(mkv, 'audio_stream', context(mkv, 'audio_stream'))
+        queue.answer(str(mkv.state.init_path), '2')
+        assert len(queue.take_answered()) == 1
+
+        # The driver stopped here
+        queue = InterventionQueue(queue.path)
+        assert [_['answer'] for _ in queue.take_answered()] == ['2']
+
+        assert not queue.carried_on(mkv)
+        mkv.state.clean_name = 'Parked Test'
+        mkv.stage = stages.STAGE_1
+        assert queue.carried_on(mkv)
+        assert not queue.parked(mkv.state.init_path)
@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from mkvremux import inventory
+from mkvremux.inventory import Inventory
+
+STREAMS = {
+    'Forced Subs.mkv': [
+        {'index': 0, 'codec_type': 'video', 'codec_name': 'hevc', 'width': 3840, 'height': 2160},
+        {'index': 1, 'codec_type': 'audio', 'codec_name': 'dts', 'profile': 'DTS-HD MA', 'channels': 8,
+         'tags': {'language': 'fre'}},
+        {'index': 2, 'codec_type': 'subtitle', 'codec_name': 'hdmv_pgs_subtitle', 'tags': {'language': 'eng'},
+         'disposition': {'forced': 1}},
+    ],
+    'English.mkv': [
+        {'index': 0, 'codec_type': 'video', 'codec_name': 'h264', 'width': 1920, 'height': 1080},
+        {'index': 1, 'codec_type': 'audio', 'codec_name': 'truehd', 'channels': 8, 'tags': {'language': 'eng'}},
+        {'index': 2, 'codec_type': 'subtitle', 'codec_name': 'hdmv_pgs_subtitle', 'tags': {'language': 'eng'},
+         'disposition': {'forced': 1}},
+    ],
+}
+
+
+class TestInventory:
+    """ Test the stream inventory and its queries """
+
+    def _library(self, tmp_path, monkeypatch):
+        library = tmp_path.joinpath('library')
+        library.mkdir()
+        for name in STREAMS:
+            library.joinpath(name).write_bytes(b'\x00' * 1024)
+
+        probed = []
+
+        def _probe(path):
+            probed.append(path.name)
+            return STREAMS[path.name]
+
+        monkeypatch.setattr(inventory, 'probe', _probe)
+        return library, probed
+
+    def test_query(self, tmp_path, monkeypatch):
+        """ Can the inventory answer a question across titles?
+
+            Expected values:
+                - forced subs but no English audio  -> ['Forced Subs.mkv']
+                - DTS-HD MA over 512 bytes          -> 1 file
+                - audio codecs                      -> {'dts': 1, 'truehd': 1}
+        """
+        library, _ = self._library(tmp_path, monkeypatch)
+        inv = Inventory(tmp_path.joinpath('inventory.npz'))
+        inv.scan([library])
+
+        forced = inv.files(kind='subtitle', forced=True)
+        english = inv.files(kind='audio', language='eng')
+        assert [os.path.basename(_) for _ in inv.paths(np.setdiff1d(forced, english))] == ['Forced Subs.mkv']
+
+        dts_hd = inv.files(kind='audio', profile='DTS-HD MA', size=lambda _: _ > 512)
+        assert len(dts_hd) == 1
+        assert inv.total_size(dts_hd) == 1024
+        assert inv.count_by('codec', kind='audio') == {'dts': 1, 'truehd': 1}
+
+    def test_incremental(self, tmp_path, monkeypatch):
+        """ Are only new or changed files probed on a rescan, and removed ones dropped?
+
+            Expected values:
+                - second scan   -> nothing probed
+                - after change  -> only English.mkv probed, Forced Subs.mkv dropped
+        """
+        library, probed = self._library(tmp_path, monkeypatch)
+        inv = Inventory(tmp_path.joinpath('inventory.npz'))
+        inv.scan([library])
+        inv.save()
+
+        inv = Inventory.load(tmp_path.joinpath('inventory.npz'))
+        assert inv.scan([library]) == {'probed': 0, 'unchanged': 2, 'removed': 0}
+
+        library.joinpath('English.mkv').write_bytes(b'\x00' * 2048)
+        library.joinpath('Forced Subs.mkv').unlink()
+        del probed[:]
+
+        assert inv.scan([library]) == {'probed': 1, 'unchanged': 0, 'removed': 1}
+        assert probed == ['English.mkv']
+        assert len(inv.streams) == 3
+        assert inv.total_size(inv.files(kind='audio', codec='truehd')) == 2048
+
+    def test_long_path(self, tmp_path, monkeypatch):
+        """ Are paths longer than the default column width kept whole, so they aren't re-probed on every scan?
+
+            Expected values:
+                - paths()       -> the full path
+                - rescan        -> nothing probed
+        """
+        library, probed = self._library(tmp_path, monkeypatch)
+        deep = library.joinpath(*['Collection ' + 'x' * 200] * 3)
+        deep.mkdir(parents=True)
+        library.joinpath('English.mkv').rename(deep.joinpath('English.mkv'))
+
+        inv = Inventory(tmp_path.joinpath('inventory.npz'))
+        inv.scan([library])
+        inv.save()
+        assert str(deep.joinpath('English.mkv')) in inv.paths(np.arange(len(inv.file_rows)))
+
+        del probed[:]
+        inv = Inventory.load(tmp_path.joinpath('inventory.npz'))
+        assert inv.scan([library]) == {'probed': 0, 'unchanged': 2, 'removed': 0}
+        assert probed == []
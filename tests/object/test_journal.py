@@ -0,0 +1,140 @@
+from mkvremux import MKV
+from mkvremux.journal import Journal
+from mkvremux.mkvstream import MKVStream
+from mkvremux.state import stages
+
+
+def _stage_1_mkv(root):
+    """ An MKV the way stage 0 leaves it """
+    for stage_dir in ['0_analyze', '1_remux', '2_mix']:
+        root.joinpath(stage_dir).mkdir()
+    root.joinpath('1_remux', 'Journal Test.mkv').write_bytes(b'\x00' * 1024)
+
+    mkv = MKV(root.joinpath('0_analyze', 'Journal Test.mkv'), stages.STAGE_0)
+    mkv.media_title = 'Journal Test'
+    mkv.audio = MKVStream('Audio')
+    mkv.audio.streams = [{'index': 1, 'codec_name': 'truehd'}, {'index': 2, 'codec_name': 'ac3'}]
+    mkv.audio.copy_streams = mkv.audio.streams[:1]
+    mkv.audio.copy_indices = [1]
+    mkv.audio.copy_count = 1
+    mkv.state.stream_hashes = {stages.STAGE_0: {0: 'SHA256=aa', 1: 'SHA256=bb'}}
+    mkv.stage = stages.STAGE_1
+    return mkv
+
+
+class TestJournal:
+    """ Test that titles in progress survive a restart """
+
+    def test_resume(self, tmp_path):
+        """ Is a title rebuilt at the stage it stopped at, with everything stage 0 worked out?
+
+            Expected values:
+                - stage         -> 1
+                - cur_path      -> <root>/1_remux/Journal Test.mkv
+                - selections    -> audio stream 1, stage 0 stream hashes
+        """
+        journal = Journal(tmp_path.joinpath('journal.jsonl'))
+        journal.record(_stage_1_mkv(tmp_path))
+
+        # A crash halfway through the next write
+        with open(str(journal.path), 'a') as f:
+            f.write('{"key": "torn')
+
+        resumed = journal.resume()
+        assert len(resumed) == 1
+
+        mkv = resumed[0]
+        assert mkv.stage == stages.STAGE_1
+        assert mkv.media_title == 'Journal Test'
+        assert mkv.state.cur_path == tmp_path.joinpath('1_remux', 'Journal Test.mkv')
+        assert mkv.state.out_dir == tmp_path.joinpath('2_mix')
+        assert mkv.audio.copy_indices == [1]
+        assert mkv.audio.stream_count == 2
+        assert mkv.state.stream_hashes == {stages.STAGE_0: {0: 'SHA256=aa', 1: 'SHA256=bb'}}
+
+    def test_finished_dropped(self, tmp_path):
+        """ Are finished titles left out of the resume and compacted away?
+
+            Expected values:
+                - resume()      -> []
+                - journal       -> empty after compaction
+        """
+        mkv = _stage_1_mkv(tmp_path)
+        journal = Journal(tmp_path.joinpath('journal.jsonl'))
+        journal.record(mkv)
+        mkv.state.clean_name = 'Journal Test'
+        mkv.stage = stages.STAGE_3
+        journal.record(mkv)
+
+        assert journal.resume() == []
+        assert journal.path.read_text() == ''
+
+    def test_moved_on(self, tmp_path):
+        """ Is a title that committed a stage but wasn't journaled yet picked up from the next stage?
+
+            Expected values:
+                - stage 1 file already in 2_mix     -> resumed at stage 2 with its stereo mix, and journaled there
+                - stage 2 output already in review  -> finished, leftover stereo mix removed
+        """
+        mkv = _stage_1_mkv(tmp_path)
+        mkv.state.clean_name = 'Journal Test'
+        mkv.metadata = {'title': 'Journal Test', 'year': 2001}
+
+        journal = Journal(tmp_path.joinpath('journal.jsonl'))
+        journal.record(mkv)
+
+        # Crashed right after post_process moved the mkv into 2_mix, where stage 1 wrote the stereo mix
+        tmp_path.joinpath('1_remux', 'Journal Test.mkv').rename(tmp_path.joinpath('2_mix', 'Journal Test.mkv'))
+        tmp_path.joinpath('2_mix', 'Journal Test.m4a').write_bytes(b'\x00' * 1024)
+
+        resumed = journal.resume()
+        assert [_.stage for _ in resumed] == [stages.STAGE_2]
+        assert resumed[0].state.cur_path == tmp_path.joinpath('2_mix', 'Journal Test.mkv')
+        assert resumed[0].state.assoc_files['stereo_mix'] == tmp_path.joinpath('2_mix', 'Journal Test.m4a')
+        assert [_['stage'] for _ in journal.replay().values()] == [stages.STAGE_2]
+
+        # Crashed after stage 2 wrote the final product and removed its source, before the mix
+        tmp_path.joinpath('3_review').mkdir()
+        tmp_path.joinpath('3_review', 'Journal Test (2001).mkv').write_bytes(b'\x00' * 1024)
+        tmp_path.joinpath('2_mix', 'Journal Test.mkv').unlink()
+
+        assert journal.resume() == []
+        assert not tmp_path.joinpath('2_mix', 'Journal Test.m4a').exists()
+        assert journal.compact() == {}
+
+    def test_moved_on_without_mix(self, tmp_path):
+        """ Is a stage 1 title whose mkv moved on but whose stereo mix can't be found left alone?
+
+            Expected values:
+                - resume()      -> [] (reported as missing), still journaled at stage 1
+        """
+        mkv = _stage_1_mkv(tmp_path)
+        journal = Journal(tmp_path.joinpath('journal.jsonl'))
+        journal.record(mkv)
+        tmp_path.joinpath('1_remux', 'Journal Test.mkv').rename(tmp_path.joinpath('2_mix', 'Journal Test.mkv'))
+
+        assert journal.resume() == []
+        assert [_['stage'] for _ in journal.replay().values()] == [stages.STAGE_1]
+
+    def test_mix_gone(self, tmp_path):
+        """ Is a stage 2 title whose stereo mix didn't survive sent back to stage 1 to make it again?
+
+            Expected values:
+                - stage         -> 1, journaled there
+                - cur_path      -> <root>/1_remux/Journal Test.mkv
+                - stereo_mix    -> forgotten
+        """
+        mkv = _stage_1_mkv(tmp_path)
+        mkv.state.assoc_files['stereo_mix'] = tmp_path.joinpath('scratch', 'Journal Test.m4a')
+        tmp_path.joinpath('1_remux', 'Journal Test.mkv').rename(tmp_path.joinpath('2_mix', 'Journal Test.mkv'))
+        mkv.stage = stages.STAGE_2
+
+        journal = Journal(tmp_path.joinpath('journal.jsonl'))
+        journal.record(mkv)
+
+        resumed = journal.resume()
+        assert [_.stage for _ in resumed] == [stages.STAGE_1]
+        assert resumed[0].state.cur_path == tmp_path.joinpath('1_remux', 'Journal Test.mkv')
+        assert resumed[0].state.cur_path.exists()
+        assert 'stereo_mix' not in resumed[0].state.assoc_files
+        assert [_['stage'] for _ in journal.replay().values()] == [stages.STAGE_1]
@@ -0,0 +1,49 @@
+from mkvremux import transfer
+from mkvremux.offload import OffloadQueue
+
+
+class TestOffloadQueue:
+    """ Test that finished files are moved off the processing disk in the background """
+
+    def test_offload(self, tmp_path):
+        """ Does a queued file end up in its destination, verified, with nothing left pending?
+
+            Expected values:
+                - pending_bytes -> size of the file right after put(), 0 once drained
+                - destination   -> same contents as the source, source removed
+        """
+        review = tmp_path.joinpath('3_review')
+        review.mkdir()
+        src = review.joinpath('Default Test (2018).mkv')
+        data = b'\x1a\x45\xdf\xa3' * 4096
+        src.write_bytes(data)
+
+        offloader = OffloadQueue(retry_delay=0)
+        offloader.put(src, tmp_path.joinpath('library'))
+        assert offloader.pending_bytes(transfer.device(review)) in [0, len(data)]
+
+        offloader.join()
+        assert offloader.pending_bytes() == 0
+        assert not offloader.failed
+        assert not src.exists()
+        assert tmp_path.joinpath('library', src.name).read_bytes() == data
+
+    def test_retries_then_gives_up(self, tmp_path):
+        """ Is a move that keeps failing retried and then reported?
+
+            Expected values:
+                - failed    -> [src] after every retry failed, source untouched
+        """
+        src = tmp_path.joinpath('orig_Default Test.mkv')
+        src.write_bytes(b'\x00' * 1024)
+
+        # A file where the destination directory should be makes every attempt fail
+        blocker = tmp_path.joinpath('cold')
+        blocker.write_bytes(b'')
+
+        offloader = OffloadQueue(retries=2, retry_delay=0)
+        offloader.put(src, blocker)
+        offloader.join()
+
+        assert offloader.failed == [src]
+        assert src.exists()
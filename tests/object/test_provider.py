@@ -0,0 +1,98 @@
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from mkvremux.catalog import Catalog, resolve
+from mkvremux.provider import HttpProvider, ResponseCache
+
+MOVIES = {
+    'Brazil': {'title': 'Brazil', 'year': '1985', 'imdb_id': 'tt0088846'}
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """ Stand-in metadata service. Knows one movie and always answers with the same ETag """
+
+    hits = []
+
+    def do_GET(self):
+        title = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)['title'][0]
+        _Handler.hits.append((title, self.headers.get('If-None-Match')))
+
+        if title not in MOVIES:
+            self.send_response(404)
+            self.end_headers()
+        elif self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+        else:
+            body = json.dumps(MOVIES[title]).encode()
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def service():
+    _Handler.hits = []
+    server = HTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}/movies'.format(server.server_port)
+    server.shutdown()
+
+
+class TestHttpProvider:
+    """ Test the HTTP metadata provider and its response cache """
+
+    def test_cache(self, service, tmp_path):
+        """ Are answers (and "not found") cached, then revalidated with the ETag once stale?
+
+            Expected values:
+                - first fetch   -> Brazil found, Nope None, 2 requests
+                - second fetch  -> same answers, no new requests
+                - after ttl     -> Brazil revalidated with If-None-Match, Nope still cached
+        """
+        provider = HttpProvider(service, ResponseCache(tmp_path.joinpath('cache'), ttl=3600, negative_ttl=3600),
+                                rate=0)
+
+        found = provider.fetch(['Brazil', 'Nope', 'Brazil'])
+        assert found == {'Brazil': MOVIES['Brazil'], 'Nope': None}
+        assert provider.requests == 2
+
+        assert provider.fetch(['Brazil', 'Nope']) == found
+        assert provider.requests == 2
+
+        provider.cache.ttl = 0
+        assert provider.fetch(['Brazil'])['Brazil'] == MOVIES['Brazil']
+        assert _Handler.hits[-1] == ('Brazil', '"v1"')
+        assert provider.fetch(['Nope'])['Nope'] is None
+        assert provider.requests == 3
+
+    def test_written_back(self, service, tmp_path):
+        """ Does a title the provider found end up in the catalog?
+
+            Expected values:
+                - 'Brazil'  -> fetched, then an exact match in the catalog
+                - 'Nope'    -> missing
+        """
+        path = tmp_path.joinpath('movie_details.json')
+        with open(str(path), 'w') as f:
+            json.dump({'Movies': [{'title': 'Dune', 'year': '1984'}]}, f)
+        catalog = Catalog(path)
+        provider = HttpProvider(service, ResponseCache(tmp_path.joinpath('cache'), 3600, 3600), rate=0)
+
+        resolved = resolve(['Brazil', 'Nope', 'Dune'], catalog, provider=provider)
+        assert resolved['Brazil'].status == 'fetched'
+        assert resolved['Nope'].status == 'missing'
+        assert resolved['Dune'].status == 'exact'
+
+        assert catalog.lookup('Brazil')['imdb_id'] == 'tt0088846'
@@ -0,0 +1,78 @@
+import os
+import time
+
+from mkvremux import utils
+from mkvremux.config import settings
+
+
+class TestScan:
+    """ Test the scandir based scanner and lazy job descriptors """
+
+    def test_filters(self, tmp_path):
+        """ Are extension, include/exclude, size and age rules applied, recursively if asked?
+
+            Expected values:
+                - default       -> ['Big.mkv', 'Old.mkv']
+                - recursive     -> adds 'sub/Nested.mkv'
+                - exclude 'O*'  -> ['Big.mkv']
+                - min_size 100  -> ['Big.mkv']
+                - min_age 60    -> ['Old.mkv']
+        """
+        tmp_path.joinpath('Big.mkv').write_bytes(b'\x00' * 1024)
+        tmp_path.joinpath('Old.mkv').write_bytes(b'\x00' * 10)
+        tmp_path.joinpath('Half.mkv.part').write_bytes(b'\x00' * 10)
+        tmp_path.joinpath('notes.txt').write_bytes(b'')
+        tmp_path.joinpath('sub').mkdir()
+        tmp_path.joinpath('sub', 'Nested.mkv').write_bytes(b'\x00' * 10)
+
+        old = time.time() - 3600
+        os.utime(str(tmp_path.joinpath('Old.mkv')), (old, old))
+
+        def names(**kwargs):
+            return sorted(os.path.relpath(_.path, str(tmp_path)) for _ in utils.scan(tmp_path, **kwargs))
+
+        assert names() == ['Big.mkv', 'Old.mkv']
+        assert names(recursive=True) == ['Big.mkv', 'Old.mkv', os.path.join('sub', 'Nested.mkv')]
+        assert names(exclude=['O*']) == ['Big.mkv']
+        assert names(include=['B*', 'O*'], min_size=100) == ['Big.mkv']
+        assert names(min_age=60) == ['Old.mkv']
+
+    def test_lazy_jobs(self, tmp_path, monkeypatch):
+        """ Are jobs plain descriptors until an MKV is asked for?
+
+            Expected values:
+                - job           -> path, stage 0 and size from the scan
+                - job.mkv()     -> MKV at stage 0 for the same file
+        """
+        monkeypatch.setitem(settings, 'duplicates', None)
+        tmp_path.joinpath('0_analyze').mkdir()
+        tmp_path.joinpath('0_analyze', 'Default Test.mkv').write_bytes(b'\x00' * 512)
+
+        jobs = utils.iter_jobs(0, str(tmp_path))
+        job = next(jobs)
+        assert job.path == tmp_path.joinpath('0_analyze', 'Default Test.mkv')
+        assert (job.stage, job.size) == (0, 512)
+        assert next(jobs, None) is None
+
+        mkv = job.mkv()
+        assert mkv.stage == 0
+        assert mkv.state.cur_path == job.path
+
+    def test_listed_once(self, tmp_path, monkeypatch):
+        """ Are files that show up while jobs are being taken (like renamed orig_ sources) left for the next scan?
+
+            Expected values:
+                - jobs          -> 'A.mkv' and 'B.mkv' only
+        """
+        monkeypatch.setitem(settings, 'duplicates', None)
+        analyze = tmp_path.joinpath('0_analyze')
+        analyze.mkdir()
+        for name in ['A.mkv', 'B.mkv']:
+            analyze.joinpath(name).write_bytes(b'\x00' * 512)
+
+        jobs = utils.iter_jobs(0, str(tmp_path))
+        first = next(jobs)
+        first.path.rename(first.path.with_name('orig_' + first.path.name))
+        analyze.joinpath('C.mkv').write_bytes(b'\x00' * 512)
+
+        assert sorted([first.path.name] + [_.path.name for _ in jobs]) == ['A.mkv', 'B.mkv']
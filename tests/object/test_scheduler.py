@@ -0,0 +1,202 @@
+import time
+import pathlib
+import threading
+
+import pytest
+
+from mkvremux import scheduler
+from mkvremux.scheduler import Scheduler
+
+
+class _Job:
+    """ Just enough of an MKV for the scheduler to work with """
+
+    def __init__(self, name, size, out_dir, dev=0):
+        self.name = name
+        self.size = size
+        self.out_dir = out_dir
+        self.dev = dev
+        self.state = self
+        self.cur_path = pathlib.Path(name)
+
+
+class _Scheduler(Scheduler):
+    """ Predictions and devices come straight from the fake job """
+
+    def predict(self, mkv):
+        return {mkv.out_dir: mkv.size}
+
+    def devices(self, mkv, need):
+        return {mkv.dev}
+
+
+@pytest.fixture
+def free_space(monkeypatch):
+    """ Pretend every filesystem has 100 bytes free """
+    monkeypatch.setattr(scheduler.transfer, 'free_bytes', lambda *args: 100)
+
+
+class TestAdmission:
+    """ Test that jobs are only admitted when their output fits """
+
+    def test_admit_and_release(self, tmp_path, free_space):
+        """ Do reservations of running jobs count against free space?
+
+            Expected values:
+                - First 60 byte job admitted, second one not
+                - Second one admitted after the first is released
+        """
+        sched = Scheduler()
+        need = {tmp_path: 60}
+        assert sched.admit(need)
+        assert not sched.admit(need)
+        sched.release(need)
+        assert sched.admit(need)
+
+    def test_reserve(self, tmp_path, free_space):
+        """ Is the reserve kept free?
+
+            Expected values:
+                - 60 byte job rejected with a 50 byte reserve
+        """
+        sched = Scheduler(reserve=50)
+        assert not sched.admit({tmp_path: 60})
+
+    def test_run_defers(self, tmp_path, free_space):
+        """ Are jobs that don't fit deferred instead of run?
+
+            Expected values:
+                - small     -> run
+                - huge      -> deferred, never passed to the job function
+        """
+        ran = []
+        small = _Job('small.mkv', 10, tmp_path)
+        huge = _Job('huge.mkv', 1000, tmp_path)
+
+        done, deferred = _Scheduler(max_jobs=2).run([huge, small], lambda mkv: ran.append(mkv))
+        assert done == [small]
+        assert deferred == [huge]
+        assert ran == [small]
+
+
+class TestDevices:
+    """ Test that jobs are spread across devices """
+
+    def test_per_device_cap(self, tmp_path, free_space):
+        """ Do jobs on the same device wait for each other while other devices keep working?
+
+            Expected values:
+                - Never more than 1 job per device at once
+                - Both devices busy at the same time at some point
+        """
+        lock = threading.Lock()
+        active = {}
+        peak = {'per_device': 0, 'total': 0}
+
+        def job(mkv):
+            with lock:
+                active[mkv.dev] = active.get(mkv.dev, 0) + 1
+                peak['per_device'] = max(peak['per_device'], active[mkv.dev])
+                peak['total'] = max(peak['total'], sum(active.values()))
+            time.sleep(0.05)
+            with lock:
+                active[mkv.dev] -= 1
+
+        jobs = [_Job('a{}.mkv'.format(_), 1, tmp_path, dev=1) for _ in range(3)]
+        jobs += [_Job('b{}.mkv'.format(_), 1, tmp_path, dev=2) for _ in range(3)]
+
+        done, deferred = _Scheduler(max_jobs=4, per_device=1).run(jobs, job)
+        assert len(done) == 6
+        assert deferred == []
+        assert peak['per_device'] == 1
+        assert peak['total'] == 2
+
+
+class TestFailures:
+    """ Test that one bad title doesn't take the batch down """
+
+    def test_predict_fails(self, tmp_path, free_space):
+        """ Is a title whose prediction fails marked as failed while the rest still run?
+
+            Expected values:
+                - bad       -> returned as done, can_transition False, never run
+                - no mix    -> same, for an error that isn't a RuntimeError
+                - good      -> run
+        """
+        class _Failing(_Scheduler):
+            calls = []
+
+            def predict(self, mkv):
+                self.calls.append(mkv)
+                if mkv.name == 'bad.mkv':
+                    raise RuntimeError('Problem Extracting Global Format Data')
+                if mkv.name == 'no mix.mkv':
+                    raise KeyError('stereo_mix')
+                return super().predict(mkv)
+
+        ran = []
+        bad = _Job('bad.mkv', 10, tmp_path)
+        no_mix = _Job('no mix.mkv', 10, tmp_path)
+        good = _Job('good.mkv', 10, tmp_path)
+
+        done, deferred = _Failing().run([bad, no_mix, good], lambda mkv: ran.append(mkv))
+        assert done == [bad, no_mix, good]
+        assert deferred == []
+        assert ran == [good]
+        assert bad.can_transition is False
+        assert no_mix.can_transition is False
+        assert _Failing.calls.count(bad) == 1
+
+    def test_job_raises(self, tmp_path, free_space):
+        """ Does an unexpected exception in one job only fail that job?
+
+            Expected values:
+                - Both jobs done, the one that raised with can_transition False
+        """
+        def job(mkv):
+            if mkv.name == 'bad.mkv':
+                raise KeyError('stereo_mix')
+            mkv.can_transition = True
+
+        bad = _Job('bad.mkv', 10, tmp_path)
+        good = _Job('good.mkv', 10, tmp_path)
+
+        done, deferred = _Scheduler(max_jobs=2).run([bad, good], job)
+        assert sorted(_.name for _ in done) == ['bad.mkv', 'good.mkv']
+        assert bad.can_transition is False
+        assert good.can_transition is True
+
+
+class TestStaging:
+    """ Test that staged copies don't outlive the run """
+
+    def test_deferred_discarded(self, tmp_path, free_space):
+        """ Is the staged copy of a job that was deferred thrown away before run() returns?
+
+            Expected values:
+                - huge      -> staged while small ran, deferred, then discarded
+        """
+        class _Stager:
+            started = []
+            discarded = []
+
+            def start(self, mkv):
+                self.started.append(mkv)
+
+            def wait(self, mkv):
+                pass
+
+            def discard(self, mkv):
+                self.discarded.append(mkv)
+
+        def job(mkv):
+            time.sleep(0.05)
+
+        small = _Job('small.mkv', 10, tmp_path)
+        huge = _Job('huge.mkv', 1000, tmp_path)
+
+        stager = _Stager()
+        done, deferred = _Scheduler(max_jobs=2, stager=stager).run([small, huge], job)
+        assert deferred == [huge]
+        assert stager.started == [huge]
+        assert huge in stager.discarded
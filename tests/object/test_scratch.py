@@ -0,0 +1,88 @@
+from mkvremux import MKV
+from mkvremux.config import settings
+from mkvremux.scratch import Scratch, get_scratch
+from mkvremux.state import stages, partial_path
+
+
+class TestScratch:
+    """ Test that the scratch tier honors its cap """
+
+    def test_reserve(self, tmp_path):
+        """ Do we get a path inside scratch while under the cap?
+
+            Expected values:
+                - path      -> <scratch>/Default Test.m4a
+                - used      -> 100
+        """
+        scratch = Scratch(tmp_path.joinpath('scratch'), 1000)
+        path = scratch.reserve('Default Test.m4a', 100)
+        assert path == tmp_path.joinpath('scratch', 'Default Test.m4a')
+        assert scratch.contains(path)
+        assert scratch.used == 100
+
+    def test_full(self, tmp_path):
+        """ Do we fall back once the cap is reached, and get room back on release?
+
+            Expected values:
+                - Second reservation refused
+                - Accepted again after release
+        """
+        scratch = Scratch(tmp_path.joinpath('scratch'), 1000)
+        first = scratch.reserve('One.m4a', 600)
+        assert scratch.reserve('Two.m4a', 600) is None
+        scratch.release(first)
+        assert scratch.reserve('Two.m4a', 600) is not None
+
+    def test_contains(self, tmp_path):
+        """ Are paths outside scratch recognized as such? """
+        scratch = Scratch(tmp_path.joinpath('scratch'), 1000)
+        assert not scratch.contains(tmp_path.joinpath('2_mix', 'Default Test.m4a'))
+
+    def test_leftover(self, tmp_path):
+        """ Does a mix left behind after its reservation was released still count against the cap?
+
+            Expected values:
+                - used      -> 600 while reserved and being written, 600 once released but still on disk
+                - used      -> 0 once the file is gone
+        """
+        scratch = Scratch(tmp_path.joinpath('scratch'), 1000)
+        path = scratch.reserve('One.m4a', 600)
+        path.with_name('One.m4a.part').write_bytes(b'\x00' * 500)
+        assert scratch.used == 600
+
+        path.with_name('One.m4a.part').rename(path)
+        path.write_bytes(b'\x00' * 600)
+        scratch.release(path)
+        assert scratch.used == 600
+        assert scratch.reserve('Two.m4a', 600) is None
+
+        path.unlink()
+        assert scratch.used == 0
+
+
+class TestReleaseScratch:
+    """ Test that a title which stops gives its scratch reservation back """
+
+    def test_failed_stage_1(self, tmp_path, monkeypatch):
+        """ Is the reservation of a title that failed stage 1 released and its half-written mix removed?
+
+            Expected values:
+                - used      -> 0
+                - partial   -> removed
+        """
+        monkeypatch.setitem(settings, 'scratch', str(tmp_path.joinpath('scratch')))
+        monkeypatch.setitem(settings, 'scratch_cap', 1000)
+        root = tmp_path.joinpath('root')
+        for stage_dir in ['0_analyze', '1_remux', '2_mix']:
+            root.joinpath(stage_dir).mkdir(parents=True)
+
+        mkv = MKV(root.joinpath('0_analyze', 'Scratch Test.mkv'), stages.STAGE_0)
+        mkv.state.clean_name = 'Scratch Test'
+        mkv.stage = stages.STAGE_1
+        mix = get_scratch().reserve('Scratch Test.m4a', 600)
+        mkv.state.assoc_files['stereo_mix'] = mix
+        partial_path(mix).write_bytes(b'\x00' * 100)
+
+        mkv.release_scratch()
+        assert get_scratch().used == 0
+        assert not partial_path(mix).exists()
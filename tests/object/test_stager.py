@@ -0,0 +1,91 @@
+from mkvremux.staging import Stager
+from mkvremux.state import stages
+
+
+class _State:
+    def __init__(self, path):
+        self.cur_path = path
+        self.staged_path = None
+
+
+class _MKV:
+    """ Just enough of an MKV for the stager to work with """
+
+    def __init__(self, path, stage=stages.STAGE_0):
+        self.state = _State(path)
+        self.stage = stage
+
+
+class TestStager:
+    """ Test that sources are staged locally and cleaned up afterwards """
+
+    def test_stage_and_discard(self, tmp_path):
+        """ Does a staged job read from an identical local copy that goes away afterwards?
+
+            Expected values:
+                - staged_path   -> <staging>/<hash>_orig_Default Test.mkv, same contents as the source
+                - staged_path   -> None after discard, local copy removed, source untouched
+        """
+        share = tmp_path.joinpath('0_analyze')
+        share.mkdir()
+        src = share.joinpath('orig_Default Test.mkv')
+        src.write_bytes(b'\x1a\x45\xdf\xa3' * 8192)
+
+        stager = Stager(tmp_path.joinpath('staging'), bwlimit=10 * 1024 * 1024)
+        mkv = _MKV(src)
+        stager.start(mkv)
+        stager.wait(mkv)
+
+        staged = mkv.state.staged_path
+        assert staged.parent == tmp_path.joinpath('staging')
+        assert staged.name.endswith('_orig_Default Test.mkv')
+        assert staged.read_bytes() == src.read_bytes()
+
+        stager.discard(mkv)
+        assert mkv.state.staged_path is None
+        assert not staged.exists()
+        assert src.exists()
+
+    def test_same_name(self, tmp_path):
+        """ Do sources with the same name from two roots get staged copies of their own?
+
+            Expected values:
+                - staged_path   -> different for each, each with its own source's contents
+                - discard one   -> the other's copy is still there
+        """
+        mkvs = []
+        for root in ['root_a', 'root_b']:
+            share = tmp_path.joinpath(root, '0_analyze')
+            share.mkdir(parents=True)
+            share.joinpath('orig_Default Test.mkv').write_bytes(root.encode() * 1024)
+            mkvs.append(_MKV(share.joinpath('orig_Default Test.mkv')))
+
+        stager = Stager(tmp_path.joinpath('staging'))
+        for mkv in mkvs:
+            stager.start(mkv)
+        for mkv in mkvs:
+            stager.wait(mkv)
+
+        first, second = [_.state.staged_path for _ in mkvs]
+        assert first != second
+        assert first.read_bytes() == b'root_a' * 1024
+        assert second.read_bytes() == b'root_b' * 1024
+
+        stager.discard(mkvs[0])
+        assert not first.exists()
+        assert second.exists()
+
+    def test_later_stages_ignored(self, tmp_path):
+        """ Are only stage 0 sources staged?
+
+            Expected values:
+                - staged_path   -> None
+        """
+        src = tmp_path.joinpath('Default Test.mkv')
+        src.write_bytes(b'\x00' * 1024)
+
+        stager = Stager(tmp_path.joinpath('staging'))
+        mkv = _MKV(src, stages.STAGE_1)
+        stager.start(mkv)
+        stager.wait(mkv)
+        assert mkv.state.staged_path is None
@@ -0,0 +1,85 @@
+import pytest
+
+from mkvremux import MKV
+from mkvremux.config import settings
+from mkvremux.state import stages
+
+
+def _stage_2_mkv(root):
+    """ An MKV waiting for stage 2, with the stream hashes stage 0 worked out """
+    for stage_dir in ['0_analyze', '1_remux', '2_mix', '3_review']:
+        root.joinpath(stage_dir).mkdir()
+
+    mkv = MKV(root.joinpath('0_analyze', 'Hash Test.mkv'), stages.STAGE_0)
+    mkv.media_title = 'Hash Test'
+    mkv.state.stream_hashes = {stages.STAGE_0: {0: 'SHA256=aa', 1: 'SHA256=bb'}}
+    mkv.stage = stages.STAGE_2
+    return mkv
+
+
+def _write_sidecar(mkv, lines):
+    """ What ffmpeg's streamhash muxer would have written during the stage """
+    sidecar = mkv.state.cur_dir.joinpath(mkv.state.clean_name + '.streamhash')
+    sidecar.write_text(''.join(_ + '\n' for _ in lines))
+    mkv.state.assoc_files['stream_hashes'] = sidecar
+    return sidecar
+
+
+class TestStreamHashes:
+    """ Test that stream hashes written during a stage are collected and compared between stages """
+
+    def test_unchanged(self, tmp_path):
+        """ Are matching hashes stored, with the stereo mix as an extra stream?
+
+            Expected values:
+                - stream_hashes[2]  -> {0: aa, 1: bb, 2: cc}
+                - sidecar           -> removed
+        """
+        mkv = _stage_2_mkv(tmp_path)
+        sidecar = _write_sidecar(mkv, ['0,v,SHA256=aa', '1,a,SHA256=bb', '2,a,SHA256=cc'])
+
+        mkv._collect_stream_hashes()
+        assert mkv.state.stream_hashes[stages.STAGE_2] == {0: 'SHA256=aa', 1: 'SHA256=bb', 2: 'SHA256=cc'}
+        assert not sidecar.exists()
+
+    def test_changed(self, tmp_path):
+        """ Is a stream whose data changed between stage 0 and stage 2 caught?
+
+            Expected values:
+                - RuntimeError 'Stream hashes changed between stages' naming stream 1
+                - sidecar           -> removed
+        """
+        mkv = _stage_2_mkv(tmp_path)
+        sidecar = _write_sidecar(mkv, ['0,v,SHA256=aa', '1,a,SHA256=ff', '2,a,SHA256=cc'])
+
+        with pytest.raises(RuntimeError) as exc:
+            mkv._collect_stream_hashes()
+        assert exc.value.args == ('Stream hashes changed between stages', [1])
+        assert not sidecar.exists()
+
+    def test_failed_stage(self, tmp_path, monkeypatch):
+        """ Is the sidecar cleaned up when the stage fails before the hashes are collected?
+
+            Expected values:
+                - RuntimeError from verification
+                - sidecar           -> removed
+        """
+        mkv = _stage_2_mkv(tmp_path)
+        sidecar = _write_sidecar(mkv, ['0,v,SHA256=aa'])
+
+        class _Ret:
+            returncode = 0
+
+        def _fail():
+            raise RuntimeError('Output verification failed', ['Stream 0: packets 1 != 2'])
+
+        monkeypatch.setitem(settings, 'cache_hints', False)
+        monkeypatch.setitem(settings, 'verify', True)
+        monkeypatch.setattr(mkv, '_set_command', lambda: setattr(mkv, 'cmd_list', [['ffmpeg']]))
+        monkeypatch.setattr(mkv, '_verify_output', _fail)
+        monkeypatch.setattr('mkvremux.container.run', lambda *args, **kwargs: _Ret())
+
+        with pytest.raises(RuntimeError):
+            mkv.run_commands()
+        assert not sidecar.exists()
+        assert 'stream_hashes' not in mkv.state.assoc_files
@@ -0,0 +1,78 @@
+import os
+import time
+
+import pytest
+
+from mkvremux.watch import InotifyWatcher, PollingWatcher, Watcher
+
+
+class TestWatch:
+    """ Test that watchers only hand out files once they are complete """
+
+    @staticmethod
+    def _check(watcher, directory):
+        # Nothing there yet
+        assert watcher.wait(timeout=0.2) == []
+
+        with open(str(directory.joinpath('New Arrival.mkv')), 'wb') as f:
+            f.write(b'\x00' * 1024)
+        directory.joinpath('notes.txt').write_bytes(b'')
+        directory.joinpath('orig_Earlier.mkv').write_bytes(b'')
+
+        assert watcher.wait(timeout=5) == [directory.joinpath('New Arrival.mkv')]
+
+        # Handed out exactly once
+        assert watcher.wait(timeout=0.3) == []
+
+    def test_inotify(self, tmp_path):
+        """ Is a file handed out once it's closed and its size has settled?
+
+            Expected values:
+                - before the copy   -> []
+                - after the copy    -> ['New Arrival.mkv'] (not notes.txt or orig_ files)
+                - afterwards        -> []
+        """
+        try:
+            watcher = InotifyWatcher([tmp_path], settle=0.1)
+        except OSError:
+            pytest.skip('inotify not available')
+
+        try:
+            self._check(watcher, tmp_path)
+        finally:
+            watcher.close()
+
+    def test_polling(self, tmp_path):
+        """ Does the polling fallback behave the same?
+
+            Expected values:
+                - same as test_inotify
+        """
+        self._check(PollingWatcher([tmp_path], settle=0.1, interval=0.05), tmp_path)
+
+    def test_seed(self, tmp_path):
+        """ Are files that were already there when watching started handed out once they settle?
+
+            Expected values:
+                - old file          -> left alone (the startup scan picks it up)
+                - recent file       -> handed out after settling
+        """
+        old = tmp_path.joinpath('Already Copied.mkv')
+        old.write_bytes(b'\x00' * 1024)
+        os.utime(str(old), (time.time() - 60, time.time() - 60))
+        tmp_path.joinpath('Still Copying.mkv').write_bytes(b'\x00' * 1024)
+
+        watcher = PollingWatcher([tmp_path], settle=0.1, interval=0.05)
+        watcher.known = {old: (1024, old.stat().st_mtime)}
+        watcher.seed()
+        assert list(watcher.pending) == [tmp_path.joinpath('Still Copying.mkv')]
+        assert watcher.wait(timeout=5) == [tmp_path.joinpath('Still Copying.mkv')]
+
+    def test_abstract(self):
+        """ Can only a watcher that knows how to wait be created?
+
+            Expected values:
+                - Watcher()     -> TypeError
+        """
+        with pytest.raises(TypeError):
+            Watcher([])